@@ -0,0 +1,290 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+
+"""Fingerprints of files and directories used in module signatures.
+
+The signature of a File or Directory constant depends on the state of the
+path on disk. PathFingerprinter computes it in one of the following modes:
+
+ - 'mtime': the integer modification time of the path, or of the most
+   recently modified directory below it (the original behavior);
+ - 'stat': the size and nanosecond modification time of the file, or of
+   every file below the directory;
+ - 'sample': like 'stat', plus a hash of the first, middle and last
+   blocks of each file;
+ - 'content': the size and a hash of the full content of each file, so
+   that touching or copying a file does not change its fingerprint.
+
+The information read from the file system is memoized until the next
+call to new_execution(), so a path is only visited once per execution.
+Content hashes are kept across executions, keyed by the file's inode,
+size and modification time.
+
+"""
+
+import os
+import stat
+
+try:
+    import hashlib
+    sha_hash = hashlib.sha1
+except ImportError:
+    import sha
+    sha_hash = sha.new
+
+import unittest
+
+MODES = ('mtime', 'stat', 'sample', 'content')
+
+class PathFingerprinter(object):
+    def __init__(self, sample_size=65536, max_hashes=100000):
+        self.sample_size = sample_size
+        self.max_hashes = max_hashes
+        # path -> os.stat result, or the OSError it raised
+        self._stats = {}
+        # path -> sorted directory entries
+        self._listings = {}
+        # (mode, path) -> fingerprint
+        self._fingerprints = {}
+        # (sampled, path, inode, size, mtime) -> content hash
+        self._hashes = {}
+
+    def new_execution(self):
+        """new_execution() -> None
+        Forgets the file system information gathered so far; content
+        hashes are kept since they are keyed by the file's stat.
+
+        """
+        self._stats.clear()
+        self._listings.clear()
+        self._fingerprints.clear()
+
+    def stat(self, path):
+        try:
+            st = self._stats[path]
+        except KeyError:
+            try:
+                st = os.stat(path)
+            except OSError, e:
+                st = e
+            self._stats[path] = st
+        if isinstance(st, OSError):
+            raise st
+        return st
+
+    def listdir(self, path):
+        try:
+            return self._listings[path]
+        except KeyError:
+            entries = sorted(os.listdir(path))
+            self._listings[path] = entries
+            return entries
+
+    def fingerprint(self, path, mode='mtime'):
+        """fingerprint(path: str, mode: str) -> str
+        Returns the fingerprint of the file or directory at path in the
+        given mode. Raises OSError if the path cannot be read.
+
+        """
+        key = (mode, path)
+        try:
+            return self._fingerprints[key]
+        except KeyError:
+            pass
+        if mode == 'mtime':
+            result = str(self._get_mtime(path))
+        elif mode in MODES:
+            if stat.S_ISDIR(self.stat(path).st_mode):
+                hasher = sha_hash()
+                self._hash_directory(path, '', mode, hasher)
+                result = hasher.hexdigest()
+            else:
+                result = self._file_fingerprint(path, mode)
+        else:
+            raise ValueError("Unknown path signature mode %r" % mode)
+        self._fingerprints[key] = result
+        return result
+
+    def _get_mtime(self, path):
+        t = int(self.stat(path).st_mtime)
+        if stat.S_ISDIR(self.stat(path).st_mode):
+            for subpath in self.listdir(path):
+                subpath = os.path.join(path, subpath)
+                try:
+                    is_dir = stat.S_ISDIR(self.stat(subpath).st_mode)
+                except OSError:
+                    continue
+                if is_dir:
+                    t = max(t, self._get_mtime(subpath))
+        return t
+
+    def _hash_directory(self, path, relpath, mode, hasher):
+        for entry in self.listdir(path):
+            subpath = os.path.join(path, entry)
+            subrelpath = relpath + '/' + entry
+            try:
+                st = self.stat(subpath)
+            except OSError:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                hasher.update('d%s\0' % subrelpath)
+                self._hash_directory(subpath, subrelpath, mode, hasher)
+            else:
+                hasher.update('f%s\0%s\0' % (
+                        subrelpath, self._file_fingerprint(subpath, mode)))
+
+    def _file_fingerprint(self, path, mode):
+        st = self.stat(path)
+        mtime_ns = getattr(st, 'st_mtime_ns', None)
+        if mtime_ns is None:
+            mtime_ns = int(st.st_mtime * 1000000000)
+        if mode == 'stat':
+            return '%d:%d' % (st.st_size, mtime_ns)
+        elif mode == 'sample':
+            return '%d:%d:%s' % (st.st_size, mtime_ns,
+                                 self._content_hash(path, st, mtime_ns, True))
+        else:
+            return '%d:%s' % (st.st_size,
+                              self._content_hash(path, st, mtime_ns, False))
+
+    def _content_hash(self, path, st, mtime_ns, sampled):
+        key = (sampled, path, st.st_ino, st.st_size, mtime_ns)
+        try:
+            return self._hashes[key]
+        except KeyError:
+            pass
+        hasher = sha_hash()
+        with open(path, 'rb') as f:
+            if sampled and st.st_size > 3 * self.sample_size:
+                for offset in (0, (st.st_size - self.sample_size) // 2,
+                               st.st_size - self.sample_size):
+                    f.seek(offset)
+                    hasher.update(f.read(self.sample_size))
+            else:
+                while True:
+                    block = f.read(self.sample_size)
+                    if not block:
+                        break
+                    hasher.update(block)
+        digest = hasher.hexdigest()
+        if len(self._hashes) >= self.max_hashes:
+            self._hashes.clear()
+        self._hashes[key] = digest
+        return digest
+
+_fingerprinter = PathFingerprinter()
+
+def get_path_fingerprinter():
+    return _fingerprinter
+
+##############################################################################
+
+class TestPathFingerprinter(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp(prefix='vt_fingerprint')
+        os.mkdir(os.path.join(self.directory, 'sub'))
+        self.fname = os.path.join(self.directory, 'sub', 'data')
+        self.write('some data', 1000000000)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def write(self, data, mtime):
+        with open(self.fname, 'wb') as f:
+            f.write(data)
+        os.utime(self.fname, (mtime, mtime))
+
+    def fingerprints(self, fingerprinter):
+        fingerprinter.new_execution()
+        return dict(((mode, path), fingerprinter.fingerprint(path, mode))
+                    for mode in MODES
+                    for path in (self.fname, self.directory))
+
+    def test_modes(self):
+        fingerprinter = PathFingerprinter()
+        before = self.fingerprints(fingerprinter)
+        self.assertEqual(before, self.fingerprints(fingerprinter))
+
+        # same size, sub-second change of the modification time
+        self.write('same data', 1000000000.5)
+        after = self.fingerprints(fingerprinter)
+        self.assertEqual(before['mtime', self.fname],
+                         after['mtime', self.fname])
+        for mode in ('stat', 'sample', 'content'):
+            self.assertNotEqual(before[mode, self.fname],
+                                after[mode, self.fname])
+            self.assertNotEqual(before[mode, self.directory],
+                                after[mode, self.directory])
+
+        # content only depends on the data
+        self.write('some data', 1000000005)
+        self.assertEqual(before['content', self.directory],
+                         self.fingerprints(fingerprinter)['content',
+                                                         self.directory])
+
+    def test_memoized(self):
+        fingerprinter = PathFingerprinter()
+        first = fingerprinter.fingerprint(self.fname, 'stat')
+        self.write('other data', 1000000010)
+        self.assertEqual(fingerprinter.fingerprint(self.fname, 'stat'), first)
+        fingerprinter.new_execution()
+        self.assertNotEqual(fingerprinter.fingerprint(self.fname, 'stat'),
+                            first)
+
+    def test_sampled(self):
+        fingerprinter = PathFingerprinter(sample_size=4)
+        self.write('a' * 100, 1000000000)
+        first = fingerprinter.fingerprint(self.fname, 'sample')
+        content = fingerprinter.fingerprint(self.fname, 'content')
+        # a change outside of the sampled blocks is not seen...
+        self.write('a' * 10 + 'b' + 'a' * 89, 1000000000)
+        fingerprinter.new_execution()
+        self.assertEqual(fingerprinter.fingerprint(self.fname, 'sample'),
+                         first)
+        # ...but the full content hash sees it (once the stat changes)
+        self.write('a' * 10 + 'b' + 'a' * 89, 1000000001)
+        fingerprinter.new_execution()
+        self.assertNotEqual(fingerprinter.fingerprint(self.fname, 'content'),
+                            content)
+
+    def test_missing(self):
+        fingerprinter = PathFingerprinter()
+        self.assertRaises(OSError, fingerprinter.fingerprint,
+                          os.path.join(self.directory, 'missing'), 'stat')
+
+if __name__ == '__main__':
+    unittest.main()
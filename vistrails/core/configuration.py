@@ -181,6 +181,8 @@ def default():
         'alwaysShowDebugPopup': False,
         'autoConnect': True,
         'autosave': True,
+        'cacheMaxModules': (None, int),
+        'cacheMaxOutputSize': (None, int),
         'dataDirectory': (None, str),
         'dbDefault': False,
 #        'debugSignals': False,
@@ -193,9 +195,12 @@ def default():
         'errorOnVariantTypeerror': True,
 #        'evolutionGraph': (None, str),
         'executeWorkflows': False,
+        'executionThreads': (None, int),
+        'explorationProcesses': (None, int),
         'fileDirectory': (None, str),
         'fixedCustomVersionColorSaturation': False,
         'handlerDontAsk': False,
+        'incrementalSave': False,
         'installBundles': True,
         'installBundlesWithPip': False,
         'interactiveMode': True,
@@ -205,6 +210,7 @@ def default():
         'jobList': False,
         'logFile': (None, str),
         'logger': default_logger(),
+        'loopThreads': (None, int),
         'maxMemory': (None, int),
         'maximizeWindows': False,
         'maxRecentVistrails': 5,
@@ -214,10 +220,13 @@ def default():
         'nologger': True,
         'nologfile': False,
         'packageDirectory': (None, str),
+        'pathSignature': 'mtime',
         'pythonPrompt': False,
         'recentVistrailList': (None, str),
         'repositoryLocalPath': (None, str),
         'repositoryHTTPURL': "http://www.vistrails.org/packages",
+        'resultCacheDirectory': (None, str),
+        'resultCacheSize': 1024,
         'reviewMode': False,
         'rootDirectory': (None, str),
         'shell': default_shell(),
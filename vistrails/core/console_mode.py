@@ -281,9 +281,33 @@ def run_parameter_exploration(locator, pe_id, extra_info = {},
                                  reason: str) -> (pe_id, [error msg])
     Run parameter exploration in w, and returns an interpreter result object.
     version can be a tag name or a version id.
+    Without the GUI, the cells are run on a pool of worker processes (see
+    ParameterExplorationRunner).
     
     """
-    if is_running_gui():
+    if not is_running_gui():
+        from vistrails.core.param_explore import ParameterExplorationRunner
+        try:
+            (v, abstractions, thumbnails, mashups) = load_vistrail(locator)
+            controller = VistrailController(v, locator, abstractions,
+                                            thumbnails, mashups)
+            try:
+                pe_id = int(pe_id)
+                pe = controller.vistrail.get_paramexp(pe_id)
+            except ValueError:
+                pe = controller.vistrail.get_named_paramexp(pe_id)
+            runner = ParameterExplorationRunner(controller)
+            results = runner.run(pe, extra_info=extra_info, reason=reason)
+        except Exception, e:
+            import traceback
+            return (locator, pe_id,
+                    debug.format_exception(e), traceback.format_exc())
+        errors = ["%s_%s_%s: %s" % (result.position + (msg,))
+                  for result in results
+                  for msg in result.errors.itervalues()]
+        if errors:
+            return (locator, pe_id, '\n'.join(errors), '')
+    else:
         from vistrails.gui.vistrail_controller import VistrailController as \
              GUIVistrailController
         try:
@@ -493,8 +493,18 @@ class ZIPFileLocator(_ZIPFileLocator, CoreLocator):
             obj.locator = self
         return save_bundle
 
-    def save(self, save_bundle):
-        save_bundle = _ZIPFileLocator.save(self, save_bundle, False)
+    def save(self, save_bundle, incremental=None):
+        """save(save_bundle: SaveBundle, incremental: bool) -> SaveBundle
+        Saves the bundle to the file it was opened from. An incremental save
+        only appends the changes to the file, see the 'incrementalSave'
+        configuration option; a regular save also merges them.
+
+        """
+        if incremental is None:
+            incremental = get_vistrails_configuration().check(
+                'incrementalSave')
+        save_bundle = _ZIPFileLocator.save(self, save_bundle, False,
+                                           incremental=incremental)
         for obj in save_bundle.get_db_objs():
             klass = self.get_convert_klass(obj.vtType)
             klass.convert(obj)
@@ -189,6 +189,7 @@ class BaseInterpreter(object):
                 info = pipeline.aliases[alias]
                 param = pipeline.db_get_object(info[0],info[1])
                 param.strValue = str(aliases[alias])
+                pipeline.invalidate_object_signatures(info[2], info[3])
             except KeyError:
                 pass
                     
@@ -207,6 +208,7 @@ class BaseInterpreter(object):
                 try:
                     param = pipeline.db_get_object(vttype,oId)
                     param.strValue = str(strval)
+                    pipeline.invalidate_object_signatures(vttype, oId)
                 except Exception, e:
                     debug.debug("Problem when updating params", e)
 
@@ -220,6 +222,7 @@ class BaseInterpreter(object):
                 for func in m.functions:
                     if func.name == 'value':
                         func.params[0].strValue = strValue
+                pipeline.invalidate_signatures([m.id])
 
     def set_done_summon_hook(self, hook):
         """ set_done_summon_hook(hook: function(pipeline, objects)) -> None
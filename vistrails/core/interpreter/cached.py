@@ -36,18 +36,27 @@
 import base64
 import copy
 import gc
+import heapq
+import itertools
 import cPickle as pickle
 
+from vistrails.core.cache.path_fingerprint import get_path_fingerprinter
 from vistrails.core.common import InstanceObject, VistrailsInternalError
+from vistrails.core.configuration import get_vistrails_configuration
 from vistrails.core.data_structures.bijectivedict import Bidict
 from vistrails.core import debug
 import vistrails.core.interpreter.base
 from vistrails.core.interpreter.base import AbortExecution
 from vistrails.core.interpreter.job import JobMonitor
+from vistrails.core.interpreter.parallel import ParallelScheduler, \
+    QueuedModuleLogging, ThreadCalls
+from vistrails.core.interpreter.result_store import ResultStore, \
+    serialize_outputs, deserialize_outputs
 import vistrails.core.interpreter.utils
+from vistrails.core.interpreter.utils import estimate_size
 from vistrails.core.log.controller import DummyLogController
 from vistrails.core.modules.basic_modules import identifier as basic_pkg, \
-                                                 Generator
+                                                 Constant, Generator
 from vistrails.core.modules.module_registry import get_module_registry
 from vistrails.core.modules.vistrails_module import ModuleBreakpoint, \
     ModuleConnector, ModuleError, ModuleErrors, ModuleHadError, \
@@ -213,6 +222,82 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         self._executed = {}
         self.filePool = self._file_pool
         self._streams = []
+        self._result_store = self._create_result_store()
+        self._profiler = None
+        # eviction bookkeeping, keyed by persistent module id
+        self._last_used = {}
+        self._output_sizes = {}
+        self._total_output_size = 0
+        self._execution_count = 0
+        self._cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        conf = get_vistrails_configuration()
+        if conf is not None:
+            max_modules = conf.check('cacheMaxModules') or None
+            max_output_size = conf.check('cacheMaxOutputSize') or None
+            if max_output_size is not None:
+                max_output_size *= 1024 * 1024
+        else:
+            max_modules = max_output_size = None
+        self.set_eviction_policy(max_modules, max_output_size)
+
+    def set_eviction_policy(self, max_modules=None, max_output_size=None):
+        """set_eviction_policy(max_modules: int or None,
+                               max_output_size: int or None) -> None
+
+        Bounds the persistent pipeline. After each execution, modules that
+        were not used by it are evicted, least recently used first, until
+        there are at most max_modules modules and their estimated output
+        size is at most max_output_size bytes. None means no limit.
+        """
+        self._max_modules = max_modules
+        self._max_output_size = max_output_size
+
+    def get_cache_stats(self):
+        """get_cache_stats() -> dict
+
+        Returns counters for modules reused from the persistent pipeline
+        ('hits'), modules that had to be added ('misses'), modules removed
+        by the eviction policy ('evictions'), and the current number of
+        modules and estimated output size.
+        """
+        stats = dict(self._cache_stats)
+        stats['modules'] = len(self._persistent_pipeline.modules)
+        stats['output_size'] = self._total_output_size
+        return stats
+
+    @staticmethod
+    def _create_result_store():
+        """_create_result_store() -> ResultStore or None
+
+        Returns the on-disk result store if 'resultCacheDirectory' is set in
+        the configuration.
+        """
+        conf = get_vistrails_configuration()
+        if conf is None or not conf.check('resultCacheDirectory'):
+            return None
+        return ResultStore(conf.resultCacheDirectory,
+                           conf.resultCacheSize * 1024 * 1024)
+
+    def set_result_store(self, result_store):
+        """set_result_store(result_store: ResultStore or None) -> None
+
+        Sets the on-disk store used to persist the outputs of cacheable
+        modules across interpreter instances.
+        """
+        self._result_store = result_store
+
+    def set_profiler(self, profiler):
+        """set_profiler(profiler: Profiler or None) -> None
+
+        Sets the profiler that records the timings of the modules of the
+        following executions. None disables profiling.
+        """
+        self._profiler = profiler
+
+    def get_profiler(self):
+        """get_profiler() -> Profiler or None
+        """
+        return self._profiler
 
     def clear(self):
         self._file_pool.cleanup()
@@ -221,6 +306,9 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
             obj.clear()
         self._objects = {}
         self._executed = {}
+        self._last_used = {}
+        self._output_sizes = {}
+        self._total_output_size = 0
 
     def __del__(self):
         self.clear()
@@ -239,6 +327,62 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         for v in dependencies:
             self._persistent_pipeline.delete_module(v)
             del self._objects[v]
+            self._last_used.pop(v, None)
+            self._total_output_size -= self._output_sizes.pop(v, 0)
+
+    def _over_budget(self):
+        return ((self._max_modules is not None and
+                 len(self._persistent_pipeline.modules) >
+                     self._max_modules) or
+                (self._max_output_size is not None and
+                 self._total_output_size > self._max_output_size))
+
+    def evict_modules(self):
+        """evict_modules() -> None
+
+        Applies the eviction policy to the persistent pipeline. Only modules
+        that nothing downstream depends on can be evicted; evicting a module
+        may make its upstream modules candidates in turn. Modules used by
+        the latest execution are always kept.
+        """
+        if not self._over_budget():
+            return
+        g = self._persistent_pipeline.graph
+        current = self._execution_count
+        def is_candidate(v):
+            return (g.out_degree(v) == 0 and
+                    self._last_used.get(v, 0) < current)
+        heap = [(self._last_used.get(v, 0), v)
+                for v in self._persistent_pipeline.modules.iterkeys()
+                if is_candidate(v)]
+        heapq.heapify(heap)
+        while heap and self._over_budget():
+            _, v = heapq.heappop(heap)
+            if v not in self._persistent_pipeline.modules or \
+                    not is_candidate(v):
+                continue
+            upstream = set(frm for (frm, _) in g.edges_to(v))
+            self._objects[v].clear()
+            self.clean_modules([v])
+            self._cache_stats['evictions'] += 1
+            for u in upstream:
+                if u in self._persistent_pipeline.modules and \
+                        is_candidate(u):
+                    heapq.heappush(heap, (self._last_used.get(u, 0), u))
+
+    def _non_cacheable_modules(self):
+        """_non_cacheable_modules() -> set
+
+        Returns the ids of the modules of the persistent pipeline that are
+        not cacheable, and of the modules that depend on them.
+        """
+        non_cacheable_modules = [i for
+                                 (i, mod) in self._objects.iteritems()
+                                 if not mod.is_cacheable()]
+        if not non_cacheable_modules:
+            return set()
+        g = self._persistent_pipeline.graph
+        return set(g.vertices_topological_sort(non_cacheable_modules))
 
     def clean_non_cacheable_modules(self):
         """clean_non_cacheable_modules() -> None
@@ -251,17 +395,86 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
                                  if not mod.is_cacheable()]
         self.clean_modules(non_cacheable_modules)
 
-    def _clear_package(self, identifier):
-        """clear_package(identifier: str) -> None
+    def clean_package_modules(self, identifier):
+        """clean_package_modules(identifier: str) -> None
 
         Removes all modules from the given package from the persistent
-        pipeline.
+        pipeline, and the modules that depend on them.
         """
         modules = [mod.id
                    for mod in self._persistent_pipeline.module_list
                    if mod.module_descriptor.identifier == identifier]
         self.clean_modules(modules)
 
+    def _clear_package(self, identifier):
+        """clear_package(identifier: str) -> None
+
+        Removes all modules from the given package from the persistent
+        pipeline and the result store.
+        """
+        self.clean_package_modules(identifier)
+        if self._result_store is not None:
+            self._result_store.invalidate_package(identifier)
+
+    def _upstream_modules(self, persistent_id):
+        """_upstream_modules(persistent_id: int) -> set
+
+        Returns the ids of a module and all the modules upstream of it in
+        the persistent pipeline.
+        """
+        g = self._persistent_pipeline.graph
+        upstream = set([persistent_id])
+        stack = [persistent_id]
+        while stack:
+            for (frm, _) in g.edges_to(stack.pop()):
+                if frm not in upstream:
+                    upstream.add(frm)
+                    stack.append(frm)
+        return upstream
+
+    def restore_outputs(self, obj):
+        """restore_outputs(obj: Module) -> bool
+
+        Loads the outputs of a newly summoned module from the result store.
+        Returns True if the module doesn't need to be computed.
+        """
+        if isinstance(obj, Constant) or not obj.is_cacheable():
+            return False
+        data = self._result_store.get(obj.signature)
+        if data is None:
+            return False
+        try:
+            outputs = deserialize_outputs(data['outputs'])
+        except Exception, e:
+            debug.warning("Could not restore cached outputs of module %s" %
+                          obj.id, e)
+            self._result_store.remove(obj.signature)
+            return False
+        for port_name, value in outputs.iteritems():
+            obj.set_output(port_name, value)
+        obj.upToDate = True
+        return True
+
+    def store_outputs(self, obj):
+        """store_outputs(obj: Module) -> None
+
+        Writes the outputs of a computed module to the result store if it
+        and everything upstream of it is cacheable.
+        """
+        if isinstance(obj, Constant) or obj.signature in self._result_store:
+            return
+        upstream = self._upstream_modules(obj.id)
+        if not all(self._objects[i].is_cacheable() for i in upstream):
+            return
+        outputs = serialize_outputs(obj)
+        if not outputs:
+            return
+        packages = set(self._persistent_pipeline.modules[i] \
+                           .module_descriptor.identifier
+                       for i in upstream)
+        self._result_store.put(obj.signature, {'packages': sorted(packages),
+                                               'outputs': outputs})
+
     def setup_pipeline(self, pipeline, **kwargs):
         """setup_pipeline(controller, pipeline, locator, currentVersion,
                           view, aliases, **kwargs)
@@ -286,6 +499,8 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         module_executed_hook = fetch('module_executed_hook', [])
         stop_on_error = fetch('stop_on_error', True)
         parent_exec = fetch('parent_exec', None)
+        parallel_workers = fetch('parallel_workers', None)
+        fetch('profiler', None)
 
         reg = get_module_registry()
 
@@ -338,7 +553,14 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
          module_added_set,
          conn_added_set) = self.add_to_persistent_pipeline(pipeline)
 
+        for persistent_id in tmp_to_persistent_module_map.itervalues():
+            self._last_used[persistent_id] = self._execution_count
+        self._cache_stats['misses'] += len(module_added_set)
+        self._cache_stats['hits'] += (len(tmp_to_persistent_module_map) -
+                                      len(module_added_set))
+
         # Create the new objects
+        restored = set()
         for i in module_added_set:
             persistent_id = tmp_to_persistent_module_map[i]
             module = self._persistent_pipeline.modules[persistent_id]
@@ -400,10 +622,16 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
                 if connector:
                     obj.set_input_port(f.name, connector, is_method=True)
 
+            if self._result_store is not None and self.restore_outputs(obj):
+                restored.add(persistent_id)
+
         # Create the new connections
+        # Modules restored from the result store don't need their inputs
         for i in conn_added_set:
             persistent_id = conn_map[i]
             conn = self._persistent_pipeline.connections[persistent_id]
+            if conn.destinationId in restored:
+                continue
             src = self._objects[conn.sourceId]
             dst = self._objects[conn.destinationId]
             conn.makeConnection(src, dst)
@@ -440,6 +668,8 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         clean_pipeline = fetch('clean_pipeline', False)
         stop_on_error = fetch('stop_on_error', True)
         parent_exec = fetch('parent_exec', None)
+        parallel_workers = fetch('parallel_workers', None)
+        profiler = fetch('profiler', self._profiler)
 
         if len(kwargs) > 0:
             raise VistrailsInternalError('Wrong parameters passed '
@@ -464,10 +694,22 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         def make_change_parameter(obj):
             return lambda *args: change_parameter(obj, *args)
 
+        # Modules updated on worker threads report to the view from this
+        # thread
+        if parallel_workers and parallel_workers > 1:
+            calls = ThreadCalls()
+            module_logging = QueuedModuleLogging(logging_obj, calls)
+        else:
+            calls = None
+            module_logging = logging_obj
+        if profiler is not None:
+            module_logging = profiler.wrap(module_logging, current_version,
+                                           get_remapped_id)
+
         # Update **all** modules in the current pipeline
         for i, obj in tmp_id_to_module_map.iteritems():
             obj.in_pipeline = True # set flag to indicate in pipeline
-            obj.logging = logging_obj
+            obj.logging = module_logging
             obj.change_parameter = make_change_parameter(obj)
             
             # Update object pipeline information
@@ -487,16 +729,22 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         # Note that we accept any module in 'sinks', even if it's not actually
         # a sink in the graph
         if sinks is not None:
-            persistent_sinks = [tmp_id_to_module_map[sink]
-                                for sink in sinks
-                                if sink in tmp_id_to_module_map]
+            sinks = [sink for sink in sinks if sink in tmp_id_to_module_map]
         else:
-            persistent_sinks = [tmp_id_to_module_map[sink]
-                                for sink in pipeline.graph.sinks()]
+            sinks = pipeline.graph.sinks()
+        persistent_sinks = [tmp_id_to_module_map[sink] for sink in sinks]
 
         self._streams.append(Generator.generators)
         Generator.generators = []
 
+        # Update independent modules concurrently first; the loop over the
+        # sinks below then only finds computed modules
+        if parallel_workers and parallel_workers > 1:
+            if not self._update_parallel(pipeline, tmp_id_to_module_map,
+                                         sinks, parallel_workers,
+                                         logging_obj, stop_on_error, calls):
+                persistent_sinks = []
+
         # Update new sinks
         for obj in persistent_sinks:
             abort = False
@@ -605,6 +853,69 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
 
         return (to_delete, objs, errs, execs, suspends, caches, parameter_changes)
 
+    def _update_parallel(self, pipeline, tmp_id_to_module_map, sinks,
+                         max_workers, logging_obj, stop_on_error, calls):
+        """_update_parallel(...) -> bool
+
+        Updates the given sinks and everything upstream of them, running
+        independent thread-safe modules concurrently. Errors are reported
+        the same way as in the sequential update of the sinks. The logging
+        calls of the modules, queued to calls, are run in this thread.
+        Returns False if the execution should stop.
+        """
+        g = pipeline.graph
+        objects = {}
+        upstream = {}
+        seen = set(sinks)
+        stack = list(sinks)
+        while stack:
+            v = stack.pop()
+            obj = tmp_id_to_module_map[v]
+            objects[obj.id] = obj
+            deps = upstream.setdefault(obj.id, set())
+            for (frm, _) in g.edges_to(v):
+                deps.add(tmp_id_to_module_map[frm].id)
+                if frm not in seen:
+                    seen.add(frm)
+                    stack.append(frm)
+
+        reg = get_module_registry()
+        def is_concurrent(obj):
+            return (not obj.upToDate and
+                    reg.get_descriptor(obj.__class__).thread_safe)
+
+        def handle_exception(e):
+            abort = False
+            if isinstance(e, ModuleWasSuspended):
+                return False
+            elif isinstance(e, ModuleHadError):
+                pass
+            elif isinstance(e, AbortExecution):
+                return True
+            elif isinstance(e, ModuleSuspended):
+                e.module.logging.end_update(e.module, e, was_suspended=True)
+                return False
+            elif isinstance(e, ModuleErrors):
+                for me in e.module_errors:
+                    me.module.logging.end_update(me.module, me)
+                    logging_obj.signalError(me.module, me)
+                    abort = abort or me.abort
+            elif isinstance(e, ModuleError):
+                e.module.logging.end_update(e.module, e, e.errorTrace)
+                logging_obj.signalError(e.module, e)
+                abort = e.abort
+            elif isinstance(e, ModuleBreakpoint):
+                e.module.logging.end_update(e.module)
+                logging_obj.signalError(e.module, e)
+                abort = True
+            else:
+                raise e
+            return stop_on_error or abort
+
+        scheduler = ParallelScheduler(max_workers, calls)
+        return scheduler.run(objects, upstream, is_concurrent,
+                             handle_exception)
+
     def finalize_pipeline(self, pipeline, to_delete, objs, errs, execs,
                           suspended, cached, **kwargs):
         def fetch(name, default):
@@ -614,6 +925,15 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
 
         self.clean_modules(to_delete)
 
+        for obj in objs.itervalues():
+            if obj.id in self._persistent_pipeline.modules:
+                size = sum(estimate_size(value)
+                           for port_name, value in obj.outputPorts.iteritems()
+                           if port_name != 'self')
+                self._total_output_size += \
+                    size - self._output_sizes.get(obj.id, 0)
+                self._output_sizes[obj.id] = size
+
         def dict2set(s):
             return set(k for k, v in s.iteritems() if v)
         if view is not None:
@@ -642,6 +962,8 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
           actions = fetch('actions', None)
           done_summon_hooks = fetch('done_summon_hooks', [])
           module_executed_hook = fetch('module_executed_hook', [])
+          parallel_workers = fetch('parallel_workers', None)
+          profiler = fetch('profiler', None)
 
         Executes a pipeline using caching. Caching works by reusing
         pipelines directly.  This means that there exists one global
@@ -661,7 +983,16 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         whether they were executed or not.
 
         If modules have no error associated with but were not executed, it
-        means they were cached."""
+        means they were cached.
+
+        If parallel_workers (or the 'executionThreads' configuration option)
+        is greater than one, modules whose upstream modules are done are
+        updated on a pool of that many threads when their descriptor is
+        marked thread_safe. The view and logging callbacks of the modules
+        updated on worker threads are queued and run in the calling thread.
+
+        If profiler (or the one given to set_profiler()) is a Profiler,
+        the timings of every module update are recorded in it."""
 
         # Setup named arguments. We don't use named parameters so
         # that positional parameter calls fail earlier
@@ -685,11 +1016,23 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         module_executed_hook = fetch('module_executed_hook', [])
         stop_on_error = fetch('stop_on_error', True)
         parent_exec = fetch('parent_exec', None)
+        parallel_workers = fetch('parallel_workers', None)
+        profiler = fetch('profiler', self._profiler)
 
         if len(kwargs) > 0:
             raise VistrailsInternalError('Wrong parameters passed '
                                          'to execute: %s' % kwargs)
+        if parallel_workers is None:
+            conf = get_vistrails_configuration()
+            if conf is not None and conf.check('executionThreads'):
+                new_kwargs['parallel_workers'] = conf.executionThreads
         self.clean_non_cacheable_modules()
+        self._execution_count += 1
+
+        # Signatures are kept on the pipeline between executions; the ones
+        # depending on files are checked against the disk again when the
+        # pipeline is matched with the persistent one
+        get_path_fingerprinter().new_execution()
 
 
 #         if controller is not None:
@@ -718,11 +1061,16 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         errors = res[5]
         if len(errors) == 0:
             res = self.execute_pipeline(pipeline, *(res[:2]), **new_kwargs)
+            if self._result_store is not None:
+                for tmp_id, obj in res[1].iteritems():
+                    if res[3].get(tmp_id) and tmp_id not in res[2]:
+                        self.store_outputs(obj)
         else:
             res = (to_delete, res[0], errors, {}, {}, {}, [])
             for (i, error) in errors.iteritems():
                 view.set_module_error(i, error)
         self.finalize_pipeline(pipeline, *(res[:-1]), **new_kwargs)
+        self.evict_modules()
 
         result = InstanceObject(objects=res[1],
                               errors=res[2],
@@ -736,6 +1084,231 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
 
         return result
 
+    _batch_shared_kwargs = ('controller', 'done_summon_hooks',
+                            'stop_on_error', 'parallel_workers', 'profiler')
+    _batch_pipeline_kwargs = ('locator', 'current_version', 'view',
+                              'vistrail_variables', 'aliases', 'params',
+                              'extra_info', 'logger', 'sinks', 'reason',
+                              'actions', 'module_executed_hook',
+                              'parent_exec')
+
+    def execute_batch(self, pipelines, pipeline_kwargs=None, **kwargs):
+        """execute_batch(pipelines: [Pipeline], pipeline_kwargs: [dict],
+                         **kwargs) -> [InstanceObject]
+
+        Executes several pipelines, e.g. the cells of a parameter
+        exploration, together. The pipelines are merged into a single DAG
+        keyed by subpipeline signature, which is matched with the
+        persistent pipeline once: the modules they share upstream are
+        created and computed exactly once, and each pipeline then only
+        computes the modules that differ. Modules that are not cacheable,
+        and the ones downstream of them, are created and computed again
+        for each pipeline using them.
+
+        kwargs are the same as for execute() and apply to every pipeline.
+        pipeline_kwargs optionally gives a dictionary per pipeline
+        overriding the ones that don't affect how the modules are created:
+        locator, current_version, view, vistrail_variables, aliases, params,
+        extra_info, logger, sinks, reason, actions, module_executed_hook
+        and parent_exec. Each pipeline is logged as its own workflow
+        execution.
+
+        Returns the results of the pipelines, in order, as execute() does.
+        Modules that failed in a pipeline are not run again for the
+        following ones; their errors are reported for each of them.
+        """
+        pipelines = list(pipelines)
+        if pipeline_kwargs is None:
+            pipeline_kwargs = [{}] * len(pipelines)
+        elif len(pipeline_kwargs) != len(pipelines):
+            raise VistrailsInternalError('Wrong number of pipeline_kwargs '
+                                         'passed to execute_batch')
+        wrong = set(kwargs) - set(self._batch_shared_kwargs +
+                                  self._batch_pipeline_kwargs)
+        for overrides in pipeline_kwargs:
+            wrong.update(set(overrides) - set(self._batch_pipeline_kwargs))
+        if wrong:
+            raise VistrailsInternalError('Wrong parameters passed '
+                                         'to execute_batch: %s' %
+                                         ', '.join(sorted(wrong)))
+        if kwargs.get('parallel_workers') is None:
+            conf = get_vistrails_configuration()
+            if conf is not None and conf.check('executionThreads'):
+                kwargs['parallel_workers'] = conf.executionThreads
+        controller = kwargs.get('controller')
+        self.clean_non_cacheable_modules()
+        self._execution_count += 1
+        get_path_fingerprinter().new_execution()
+
+        cells = []
+        for pipeline, overrides in itertools.izip(pipelines, pipeline_kwargs):
+            cell_kwargs = dict(kwargs)
+            cell_kwargs.update(overrides)
+            cells.append(cell_kwargs)
+            if controller is not None:
+                controller.validate(pipeline)
+            else:
+                pipeline.validate()
+            self.resolve_aliases(pipeline, cell_kwargs.get('aliases'))
+            if cell_kwargs.get('vistrail_variables'):
+                self.resolve_variables(cell_kwargs['vistrail_variables'],
+                                       pipeline)
+            self.update_params(pipeline, cell_kwargs.get('params'))
+
+        union, module_maps, connection_maps = self.merge_pipelines(pipelines)
+        (union_objects, _, union_modules_added, union_conns_added,
+         to_delete, setup_errors) = self.setup_pipeline(
+                union,
+                done_summon_hooks=kwargs.get('done_summon_hooks', []))
+        to_delete = set(to_delete)
+
+        if controller is not None:
+            vistrail = controller.vistrail
+        else:
+            vistrail = None
+        failed = {}
+        ran_non_cacheable = set()
+        claimed_modules = set()
+        claimed_conns = set()
+        results = []
+        for pipeline, module_map, connection_map, cell_kwargs in \
+                itertools.izip(pipelines, module_maps, connection_maps, cells):
+            view = cell_kwargs.setdefault('view', DummyView())
+            logger = cell_kwargs.get('logger', DummyLogController)
+            logger = logger.start_workflow_execution(
+                    cell_kwargs.get('parent_exec'),
+                    vistrail, pipeline, cell_kwargs.get('current_version'))
+            cell_kwargs['logger'] = logger
+            self.annotate_workflow_execution(logger,
+                                             cell_kwargs.get('reason'),
+                                             cell_kwargs.get('aliases'),
+                                             cell_kwargs.get('params'))
+
+            # modules and connections are reported as added for the first
+            # pipeline using them
+            modules_added = set(i for i, j in module_map.iteritems()
+                                if j in union_modules_added and
+                                   j not in claimed_modules)
+            claimed_modules.update(module_map[i] for i in modules_added)
+            conns_added = set(i for i, j in connection_map.iteritems()
+                              if j in union_conns_added and
+                                 j not in claimed_conns)
+            claimed_conns.update(connection_map[i] for i in conns_added)
+
+            tmp_id_to_module_map = dict((i, union_objects[j])
+                                        for i, j in module_map.iteritems())
+            errors = dict((i, setup_errors[j])
+                          for i, j in module_map.iteritems()
+                          if j in setup_errors)
+            # modules that are not cacheable, and the ones downstream of
+            # them, are not shared: a previous pipeline ran them, so they
+            # are created again, like execute() would
+            persistent_ids = set(obj.id
+                                 for obj in tmp_id_to_module_map.itervalues())
+            if (persistent_ids & ran_non_cacheable or
+                    not persistent_ids <= set(self._objects)):
+                if ran_non_cacheable:
+                    self.clean_non_cacheable_modules()
+                    ran_non_cacheable = set()
+                (tmp_id_to_module_map, _, cell_modules_added,
+                 cell_conns_added, cell_to_delete, errors) = \
+                    self.setup_pipeline(
+                        pipeline,
+                        done_summon_hooks=kwargs.get('done_summon_hooks',
+                                                     []))
+                to_delete.update(cell_to_delete)
+                modules_added.update(cell_modules_added)
+                conns_added.update(cell_conns_added)
+                persistent_ids = set(
+                        obj.id for obj in tmp_id_to_module_map.itervalues())
+            ran_non_cacheable.update(persistent_ids &
+                                     self._non_cacheable_modules())
+            persistent_to_tmp_id_map = dict(
+                    (obj.id, i)
+                    for i, obj in tmp_id_to_module_map.iteritems())
+            if len(errors) == 0:
+                res = self.execute_pipeline(pipeline, tmp_id_to_module_map,
+                                            persistent_to_tmp_id_map,
+                                            **cell_kwargs)
+                to_delete.update(res[0])
+                errors = res[2]
+                for i, error in errors.iteritems():
+                    failed[tmp_id_to_module_map[i].id] = error
+                for i, obj in tmp_id_to_module_map.iteritems():
+                    if obj.id in failed and i not in errors:
+                        errors[i] = failed[obj.id]
+                if self._result_store is not None:
+                    for tmp_id, obj in res[1].iteritems():
+                        if res[3].get(tmp_id) and tmp_id not in errors:
+                            self.store_outputs(obj)
+            else:
+                res = ([], tmp_id_to_module_map, errors, {}, {}, {}, [])
+                for (i, error) in errors.iteritems():
+                    view.set_module_error(i, error)
+            # errored modules are only removed once all pipelines ran
+            self.finalize_pipeline(pipeline, [], *(res[1:-1]), view=view)
+
+            result = InstanceObject(objects=res[1],
+                                    errors=errors,
+                                    executed=res[3],
+                                    suspended=res[4],
+                                    parameter_changes=res[6],
+                                    modules_added=modules_added,
+                                    conns_added=conns_added)
+            logger.finish_workflow_execution(result.errors,
+                                             suspended=result.suspended)
+            results.append(result)
+
+        self.clean_modules(to_delete)
+        self.evict_modules()
+        return results
+
+    def merge_pipelines(self, pipelines):
+        """merge_pipelines(pipelines: [Pipeline]) -> (Pipeline, [dict], [dict])
+
+        Builds the union of the given pipelines, where modules with the
+        same subpipeline signature (and connections with the same
+        signature) appear only once. Returns it along with, for each
+        pipeline, the mappings from its module and connection ids to the
+        ones in the union.
+        """
+        union = vistrails.core.vistrail.pipeline.Pipeline()
+        module_ids = {}
+        connection_ids = {}
+        module_maps = []
+        connection_maps = []
+        for pipeline in pipelines:
+            pipeline.refresh_constant_signatures()
+            pipeline.compute_signatures()
+            module_map = {}
+            for module_id in pipeline.graph.vertices_topological_sort():
+                sig = pipeline.subpipeline_signature(module_id)
+                try:
+                    module_map[module_id] = module_ids[sig]
+                except KeyError:
+                    module = copy.copy(pipeline.modules[module_id])
+                    module.id = union.fresh_module_id()
+                    union.add_module(module)
+                    module_map[module_id] = module_ids[sig] = module.id
+            connection_map = {}
+            for connection in pipeline.connections.itervalues():
+                sig = pipeline.connection_signature(connection.id)
+                try:
+                    connection_map[connection.id] = connection_ids[sig]
+                except KeyError:
+                    union_connection = copy.copy(connection)
+                    union_connection.id = union.fresh_connection_id()
+                    union_connection.sourceId = module_map[
+                        connection.sourceId]
+                    union_connection.destinationId = module_map[
+                        connection.destinationId]
+                    union.add_connection(union_connection)
+                    connection_map[connection.id] = \
+                        connection_ids[sig] = union_connection.id
+            module_maps.append(module_map)
+            connection_maps.append(connection_map)
+        return union, module_maps, connection_maps
+
     def annotate_workflow_execution(self, logger, reason, aliases, params):
         """annotate_workflow_Execution(logger: LogController, reason:str,
                                         aliases:dict, params:list)-> None
@@ -767,7 +1340,8 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         connection_id_map = Bidict()
         modules_added = set()
         connections_added = set()
-        pipeline.refresh_signatures()
+        pipeline.refresh_constant_signatures()
+        pipeline.compute_signatures()
         # we must traverse vertices in topological sort order
         verts = pipeline.graph.vertices_topological_sort()
         for new_module_id in verts:
@@ -816,7 +1390,8 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         object_map = {}
         module_id_map = {}
         connection_id_map = {}
-        pipeline.refresh_signatures()
+        pipeline.refresh_constant_signatures()
+        pipeline.compute_signatures()
         # we must traverse vertices in topological sort order
         verts = pipeline.graph.vertices_topological_sort()
         for module_id in verts:
@@ -915,6 +1490,339 @@ class TestCachedInterpreter(unittest.TestCase):
         finally:
             StandardOutput.compute = old_compute
 
+    def test_eviction(self):
+        """Test if cold modules are evicted from the persistent pipeline."""
+        from vistrails.core.modules.basic_modules import StandardOutput
+        old_compute = StandardOutput.compute
+        StandardOutput.compute = lambda s: None
+
+        try:
+            from vistrails.core.db.locator import XMLFileLocator
+            from vistrails.core.vistrail.controller import VistrailController
+            from vistrails.core.db.io import load_vistrail
+
+            locator = XMLFileLocator(vistrails.core.system.vistrails_root_directory() +
+                                '/tests/resources/dummy.xml')
+            (v, abstractions, thumbnails, mashups) = load_vistrail(locator)
+            controller = VistrailController(v, locator, abstractions,
+                                            thumbnails,  mashups)
+            interpreter = CachedInterpreter()
+            interpreter.set_eviction_policy(max_modules=1)
+            view = DummyView()
+            sizes = []
+            for tag in ['int chain', 'float chain', 'int chain']:
+                n = v.get_version_number(tag)
+                controller.change_selected_version(n)
+                controller.flush_delayed_actions()
+                p = controller.current_pipeline
+                result = interpreter.execute(p, locator=v,
+                                             current_version=n, view=view)
+                self.assertFalse(result.errors)
+                sizes.append(len(p.modules))
+                # only modules of the last execution are kept
+                self.assertEqual(interpreter.get_cache_stats()['modules'],
+                                 len(p.modules))
+            stats = interpreter.get_cache_stats()
+            self.assertEqual(stats['misses'], sum(sizes))
+            # everything from 'int chain' was evicted before it was rerun
+            self.assertEqual(stats['hits'], 0)
+            self.assertGreater(stats['evictions'], 0)
+            interpreter.clear()
+        finally:
+            StandardOutput.compute = old_compute
+
+    def test_result_store(self):
+        """Test if results are reused from the on-disk store."""
+        import shutil
+        import tempfile
+        from vistrails.core.interpreter.noncached import Interpreter
+        from vistrails.core.modules.basic_modules import StandardOutput
+        from vistrails.tests.utils import execute
+
+        modules = [
+            ('Float', 'org.vistrails.vistrails.basic', [
+                ('value', [('Float', '44.0')]),
+            ]),
+            ('PythonCalc', 'org.vistrails.vistrails.pythoncalc', [
+                ('value2', [('Float', '2.0')]),
+                ('op', [('String', '-')]),
+            ]),
+            ('StandardOutput', 'org.vistrails.vistrails.basic', []),
+        ]
+        connections = [
+            (0, 'value', 1, 'value1'),
+            (1, 'value', 2, 'value'),
+        ]
+        old_compute = StandardOutput.compute
+        StandardOutput.compute = lambda s: None
+        directory = tempfile.mkdtemp(prefix='vt_results_')
+        interpreter = Interpreter.get()
+        interpreter.set_result_store(ResultStore(directory))
+        try:
+            result = execute(modules, connections, full_results=True)
+            self.assertFalse(result.errors)
+            self.assertTrue(result.executed[1])
+            self.assertEqual(len(interpreter._result_store), 1)
+
+            # the non-cached interpreter throws away its modules, the
+            # result of PythonCalc now comes from the store
+            result = execute(modules, connections, full_results=True)
+            self.assertFalse(result.errors)
+            self.assertNotIn(1, result.executed)
+            self.assertEqual(result.objects[1].get_output('value'), 42.0)
+        finally:
+            interpreter.set_result_store(None)
+            shutil.rmtree(directory)
+            StandardOutput.compute = old_compute
+
+    def test_parallel(self):
+        """Test updating independent branches on worker threads."""
+        import threading
+        from vistrails.core.configuration import get_vistrails_configuration
+        from vistrails.core.db.locator import XMLFileLocator
+        from vistrails.core.modules.module_registry import get_module_registry
+        from vistrails.tests.utils import build_pipeline, intercept_result
+
+        class RecordingView(DummyView):
+            def __init__(self):
+                self.threads = set()
+
+            def set_module_computing(self, id):
+                self.threads.add(threading.current_thread())
+
+        view = RecordingView()
+
+        descriptor = get_module_registry().get_descriptor_by_name(
+                'org.vistrails.vistrails.pythoncalc', 'PythonCalc')
+        configuration = get_vistrails_configuration()
+        old_threads = configuration.executionThreads
+        descriptor.thread_safe = True
+        configuration.executionThreads = 4
+        try:
+            with intercept_result(descriptor.module, 'value') as results:
+                pipeline = build_pipeline([
+                        ('PythonCalc', 'org.vistrails.vistrails.pythoncalc', [
+                            ('value1', [('Float', '1.0')]),
+                            ('value2', [('Float', '2.0')]),
+                            ('op', [('String', '+')]),
+                        ]),
+                        ('PythonCalc', 'org.vistrails.vistrails.pythoncalc', [
+                            ('value1', [('Float', '3.0')]),
+                            ('value2', [('Float', '4.0')]),
+                            ('op', [('String', '*')]),
+                        ]),
+                        ('PythonCalc', 'org.vistrails.vistrails.pythoncalc', [
+                            ('op', [('String', '-')]),
+                        ]),
+                    ],
+                    [
+                        (0, 'value', 2, 'value1'),
+                        (1, 'value', 2, 'value2'),
+                    ])
+                result = CachedInterpreter.get().execute(
+                        pipeline,
+                        locator=XMLFileLocator('foo.xml'),
+                        current_version=1,
+                        view=view)
+            self.assertFalse(result.errors)
+            self.assertEqual(len(result.executed), 3)
+            self.assertEqual(sorted(results), [-9.0, 3.0, 12.0])
+            # the view is only used from this thread
+            self.assertEqual(view.threads, set([threading.current_thread()]))
+        finally:
+            descriptor.thread_safe = False
+            configuration.executionThreads = old_threads
+
+    def test_profiler(self):
+        """Test recording the module timings of executions."""
+        import json
+        from vistrails.core.interpreter.profiler import Profiler
+        from vistrails.core.modules.basic_modules import StandardOutput
+        old_compute = StandardOutput.compute
+        StandardOutput.compute = lambda s: None
+
+        try:
+            from vistrails.core.db.locator import XMLFileLocator
+            from vistrails.core.vistrail.controller import VistrailController
+            from vistrails.core.db.io import load_vistrail
+
+            locator = XMLFileLocator(vistrails.core.system.vistrails_root_directory() +
+                                '/tests/resources/dummy.xml')
+            (v, abstractions, thumbnails, mashups) = load_vistrail(locator)
+            controller = VistrailController(v, locator, abstractions,
+                                            thumbnails,  mashups)
+            n = v.get_version_number('int chain')
+            controller.change_selected_version(n)
+            controller.flush_delayed_actions()
+            p = controller.current_pipeline
+            interpreter = CachedInterpreter()
+            profiler = Profiler()
+            for i in xrange(2):
+                result = interpreter.execute(p, locator=v, current_version=n,
+                                             view=DummyView(),
+                                             profiler=profiler)
+                self.assertFalse(result.errors)
+            interpreter.clear()
+        finally:
+            StandardOutput.compute = old_compute
+
+        first = profiler.get_records(execution=1)
+        self.assertEqual(len(first), len(p.modules))
+        self.assertFalse(any(r.cached for r in first))
+        self.assertTrue(all(r.wall >= r.compute >= 0 for r in first))
+        self.assertTrue(all(r.version == n for r in first))
+        second = profiler.get_records(execution=2)
+        self.assertEqual(len(second), len(p.modules))
+        # StandardOutput is not cacheable, everything else is reused
+        self.assertEqual([r.module_name for r in second if not r.cached],
+                         ['StandardOutput'])
+        summary = profiler.summary()
+        self.assertEqual(len(summary), len(p.modules))
+        self.assertEqual(sum(s['updates'] for s in summary.itervalues()),
+                         2 * len(p.modules))
+        self.assertEqual(sum(s['cache_hits'] for s in summary.itervalues()),
+                         len(p.modules) - 1)
+        trace = json.loads(profiler.to_chrome_trace())
+        # one event per update, plus a 'compute' event per computed module
+        self.assertEqual(len(trace['traceEvents']), 3 * len(p.modules) + 1)
+
+    def test_modified_file(self):
+        """Test that a file changed on disk is not matched with its
+        previous version in the persistent pipeline."""
+        import os
+        import tempfile
+        from vistrails.core.cache.path_fingerprint import \
+            get_path_fingerprinter
+        from vistrails.tests.utils import build_pipeline
+
+        (fd, fname) = tempfile.mkstemp(prefix='vt_cached')
+        os.close(fd)
+        interpreter = CachedInterpreter()
+        try:
+            os.utime(fname, (1000000000, 1000000000))
+            pipeline = build_pipeline([
+                    ('File', 'org.vistrails.vistrails.basic', [
+                        ('value', [('File', fname)]),
+                    ]),
+                ])
+            result = interpreter.execute(pipeline, view=DummyView())
+            self.assertFalse(result.errors)
+            objects = interpreter.find_persistent_entities(pipeline)[0]
+            self.assertIsNotNone(objects[0])
+
+            os.utime(fname, (1000000010, 1000000010))
+            get_path_fingerprinter().new_execution()
+            objects = interpreter.find_persistent_entities(pipeline)[0]
+            self.assertIsNone(objects[0])
+            result = interpreter.execute(pipeline, view=DummyView())
+            self.assertEqual(sorted(result.modules_added), [0])
+        finally:
+            interpreter.clear()
+            os.remove(fname)
+
+    def test_execute_batch(self):
+        """Test sharing the upstream modules of a batch of pipelines."""
+        from vistrails.core.modules.module_registry import get_module_registry
+        from vistrails.tests.utils import build_pipeline, intercept_result
+
+        def pipeline(factor):
+            return build_pipeline([
+                    ('Float', 'org.vistrails.vistrails.basic', [
+                        ('value', [('Float', '44.0')]),
+                    ]),
+                    ('PythonCalc', 'org.vistrails.vistrails.pythoncalc', [
+                        ('value2', [('Float', '2.0')]),
+                        ('op', [('String', '-')]),
+                    ]),
+                    ('PythonCalc', 'org.vistrails.vistrails.pythoncalc', [
+                        ('value2', [('Float', factor)]),
+                        ('op', [('String', '*')]),
+                    ]),
+                ],
+                [
+                    (0, 'value', 1, 'value1'),
+                    (1, 'value', 2, 'value1'),
+                ])
+        pipelines = [pipeline(factor) for factor in ('1.0', '2.0', '3.0')]
+
+        interpreter = CachedInterpreter()
+        union, module_maps, connection_maps = \
+            interpreter.merge_pipelines(pipelines)
+        self.assertEqual(len(union.modules), 5)
+        self.assertEqual(len(union.connections), 4)
+        self.assertEqual(len(set(m[1] for m in module_maps)), 1)
+        self.assertEqual(len(set(m[2] for m in module_maps)), 3)
+
+        descriptor = get_module_registry().get_descriptor_by_name(
+                'org.vistrails.vistrails.pythoncalc', 'PythonCalc')
+        try:
+            with intercept_result(descriptor.module, 'value') as values:
+                results = interpreter.execute_batch(
+                        pipelines,
+                        [{'reason': 'cell %d' % i} for i in xrange(3)],
+                        view=DummyView())
+            self.assertFalse(any(r.errors for r in results))
+            # the shared prefix is only computed for the first pipeline
+            self.assertEqual(sorted(values), [42.0, 42.0, 84.0, 126.0])
+            self.assertEqual(sorted(results[0].executed), [0, 1, 2])
+            self.assertEqual(sorted(results[1].executed), [2])
+            self.assertEqual(sorted(results[0].modules_added), [0, 1, 2])
+            self.assertEqual(sorted(results[2].modules_added), [2])
+            self.assertEqual(results[2].objects[2].get_output('value'),
+                             126.0)
+            self.assertEqual(interpreter.get_cache_stats()['modules'], 5)
+        finally:
+            interpreter.clear()
+
+    def test_execute_batch_non_cacheable(self):
+        """Test that non-cacheable modules are not shared in a batch."""
+        from vistrails.core.modules.module_registry import get_module_registry
+        from vistrails.tests.utils import build_pipeline, intercept_result
+
+        def pipeline(factor):
+            p = build_pipeline([
+                    ('Float', 'org.vistrails.vistrails.basic', [
+                        ('value', [('Float', '44.0')]),
+                    ]),
+                    ('PythonCalc', 'org.vistrails.vistrails.pythoncalc', [
+                        ('value2', [('Float', '2.0')]),
+                        ('op', [('String', '-')]),
+                    ]),
+                    ('PythonCalc', 'org.vistrails.vistrails.pythoncalc', [
+                        ('value2', [('Float', factor)]),
+                        ('op', [('String', '*')]),
+                    ]),
+                ],
+                [
+                    (0, 'value', 1, 'value1'),
+                    (1, 'value', 2, 'value1'),
+                ])
+            p.modules[1].cache = 0
+            return p
+        pipelines = [pipeline(factor) for factor in ('1.0', '2.0', '3.0')]
+
+        interpreter = CachedInterpreter()
+        descriptor = get_module_registry().get_descriptor_by_name(
+                'org.vistrails.vistrails.pythoncalc', 'PythonCalc')
+        try:
+            with intercept_result(descriptor.module, 'value') as values:
+                results = interpreter.execute_batch(pipelines,
+                                                    view=DummyView())
+            self.assertFalse(any(r.errors for r in results))
+            # the non-cacheable module is computed for each pipeline
+            self.assertEqual(sorted(values),
+                             [42.0, 42.0, 42.0, 42.0, 84.0, 126.0])
+            self.assertEqual(sorted(results[0].executed), [0, 1, 2])
+            self.assertEqual(sorted(results[1].executed), [1, 2])
+            self.assertEqual(sorted(results[2].executed), [1, 2])
+            self.assertEqual(sorted(results[1].modules_added), [1, 2])
+            self.assertEqual(results[2].objects[2].get_output('value'),
+                             126.0)
+            self.assertIs(results[0].objects[0], results[2].objects[0])
+            self.assertIsNot(results[0].objects[1], results[2].objects[1])
+        finally:
+            interpreter.clear()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,360 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+""" Contains the scheduler used to update independent modules concurrently
+
+"""
+
+from collections import deque
+import Queue
+import sys
+import threading
+import unittest
+
+
+class _Call(object):
+    def __init__(self, function, args, kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+    def run(self):
+        try:
+            self.result = self.function(*self.args, **self.kwargs)
+        except Exception:
+            self.exc_info = sys.exc_info()
+        finally:
+            self.done.set()
+
+
+class ThreadCalls(object):
+    """Runs calls made from worker threads in the thread that created this
+    object, for instance the callbacks updating the view, which can't be
+    used from other threads with Qt.
+
+    A call made from another thread blocks until the owning thread runs it
+    from get(), which it uses to wait for the results of its workers.
+
+    """
+    def __init__(self):
+        self.thread = threading.current_thread()
+        self._queue = Queue.Queue()
+
+    def call(self, function, *args, **kwargs):
+        if threading.current_thread() is self.thread:
+            return function(*args, **kwargs)
+        call = _Call(function, args, kwargs)
+        self._queue.put(call)
+        call.done.wait()
+        if call.exc_info is not None:
+            raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+        return call.result
+
+    def put(self, result):
+        """Sends a result to the owning thread, from any thread.
+        """
+        self._queue.put(result)
+
+    def get(self):
+        """Waits for the next result sent with put(), running the calls
+        made in the meantime. Only the owning thread can use this.
+        """
+        while True:
+            item = self._queue.get()
+            if isinstance(item, _Call):
+                item.run()
+            else:
+                return item
+
+
+class QueuedModuleLogging(object):
+    """Forwards the calls made by modules on their logging object to the
+    thread owning a ThreadCalls, so that modules running in worker threads
+    can report their progress.
+
+    """
+    def __init__(self, logging, calls):
+        self._logging = logging
+        self._calls = calls
+
+    def __getattr__(self, name):
+        attr = getattr(self._logging, name)
+        if not callable(attr):
+            return attr
+        def queued(*args, **kwargs):
+            result = self._calls.call(attr, *args, **kwargs)
+            if name == 'begin_loop_execution':
+                result = QueuedModuleLogging(result, self._calls)
+            return result
+        return queued
+
+
+class ParallelScheduler(object):
+    """Updates the modules of a DAG as soon as their upstream modules are
+    done. Modules that can run concurrently are sent to a pool of worker
+    threads, the others are updated in the calling thread.
+
+    calls is the ThreadCalls used by the logging object of the modules; it
+    has to be owned by the thread calling run().
+
+    """
+    def __init__(self, max_workers, calls=None):
+        self.max_workers = max_workers
+        self.calls = calls
+
+    @staticmethod
+    def _update(obj):
+        try:
+            obj.update()
+        except Exception:
+            return sys.exc_info()
+        return None
+
+    def _worker(self, tasks, results):
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            v, obj = task
+            results.put((v, self._update(obj)))
+
+    def run(self, objects, upstream, is_concurrent, handle_exception):
+        """run(objects: dict, upstream: dict, is_concurrent: callable,
+               handle_exception: callable) -> bool
+
+        objects maps ids to modules and upstream maps ids to the set of ids
+        they depend on. handle_exception is called in the calling thread
+        with the exception raised by a module and returns True if the
+        execution should stop. Modules downstream of a module that raised
+        are not updated. Returns False if the execution was stopped.
+        """
+        remaining = dict((v, set(upstream.get(v, ())) & set(objects))
+                         for v in objects)
+        downstream = dict((v, []) for v in objects)
+        for v, deps in remaining.iteritems():
+            for u in deps:
+                downstream[u].append(v)
+        ready = deque(sorted(v for v, deps in remaining.iteritems()
+                             if not deps))
+
+        tasks = Queue.Queue()
+        results = self.calls
+        if results is None:
+            results = ThreadCalls()
+        workers = []
+        for i in xrange(self.max_workers):
+            t = threading.Thread(target=self._worker, args=(tasks, results))
+            t.daemon = True
+            t.start()
+            workers.append(t)
+
+        stopped = False
+        running = 0
+        try:
+            while (ready and not stopped) or running:
+                done = []
+                while ready and not stopped:
+                    v = ready.popleft()
+                    if is_concurrent(objects[v]):
+                        tasks.put((v, objects[v]))
+                        running += 1
+                    else:
+                        done.append((v, self._update(objects[v])))
+                        break
+                if not done and running:
+                    done.append(results.get())
+                    running -= 1
+                for v, exc_info in done:
+                    if exc_info is not None:
+                        if handle_exception(exc_info[1]):
+                            stopped = True
+                        continue
+                    for w in downstream[v]:
+                        remaining[w].discard(v)
+                        if not remaining[w]:
+                            ready.append(w)
+        finally:
+            # If handle_exception raised, the tasks still running might be
+            # waiting on a call that only get() runs: drop the tasks that
+            # didn't start and wait for the others before stopping the
+            # workers
+            while running:
+                try:
+                    tasks.get_nowait()
+                except Queue.Empty:
+                    results.get()
+                running -= 1
+            for t in workers:
+                tasks.put(None)
+            for t in workers:
+                t.join()
+        return not stopped
+
+
+class TestParallelScheduler(unittest.TestCase):
+    class Task(object):
+        def __init__(self, name, log, concurrent=True, fail=False):
+            self.name = name
+            self.log = log
+            self.concurrent = concurrent
+            self.fail = fail
+
+        def update(self):
+            if self.fail:
+                raise ValueError(self.name)
+            self.log.append(self.name)
+
+    def test_order(self):
+        log = []
+        objects = dict((c, self.Task(c, log, c != 'c')) for c in 'abcde')
+        upstream = {'c': set('ab'), 'd': set('c'), 'e': set()}
+        errors = []
+        scheduler = ParallelScheduler(3)
+        self.assertTrue(scheduler.run(objects, upstream,
+                                      lambda obj: obj.concurrent,
+                                      errors.append))
+        self.assertEqual(sorted(log), list('abcde'))
+        self.assertLess(log.index('a'), log.index('c'))
+        self.assertLess(log.index('b'), log.index('c'))
+        self.assertLess(log.index('c'), log.index('d'))
+        self.assertEqual(errors, [])
+
+    def test_error(self):
+        log = []
+        objects = dict((c, self.Task(c, log, fail=(c == 'b')))
+                       for c in 'abc')
+        upstream = {'c': set('ab')}
+        errors = []
+        def handle(e):
+            errors.append(e)
+            return False
+        self.assertTrue(ParallelScheduler(2).run(objects, upstream,
+                                                 lambda obj: True, handle))
+        self.assertEqual(log, ['a'])
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(str(errors[0]), 'b')
+
+        log = []
+        self.assertFalse(ParallelScheduler(2).run(objects, upstream,
+                                                  lambda obj: True,
+                                                  lambda e: True))
+
+    def test_calls(self):
+        """Calls made through ThreadCalls run in the calling thread.
+        """
+        calls = ThreadCalls()
+        threads = []
+        def record(name):
+            threads.append((name, threading.current_thread()))
+        class Task(object):
+            def __init__(self, name):
+                self.name = name
+
+            def update(self):
+                self.thread = threading.current_thread()
+                calls.call(record, self.name)
+        objects = dict((c, Task(c)) for c in 'abcd')
+        self.assertTrue(ParallelScheduler(3, calls).run(objects, {},
+                                                        lambda obj: True,
+                                                        lambda e: True))
+        self.assertEqual(sorted(name for name, thread in threads),
+                         list('abcd'))
+        main = threading.current_thread()
+        self.assertTrue(all(thread is main for name, thread in threads))
+        self.assertTrue(all(obj.thread is not main
+                            for obj in objects.itervalues()))
+
+    def test_call_error(self):
+        """Exceptions raised by queued calls are raised in the worker.
+        """
+        calls = ThreadCalls()
+        def fail():
+            raise KeyError('fail')
+        class Task(object):
+            def update(self):
+                calls.call(fail)
+        errors = []
+        def handle(e):
+            errors.append(e)
+            return False
+        self.assertTrue(ParallelScheduler(2, calls).run({'a': Task()}, {},
+                                                        lambda obj: True,
+                                                        handle))
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], KeyError)
+
+    def test_handler_error(self):
+        """A handler raising doesn't block workers waiting on a call.
+        """
+        calls = []
+        log = []
+        started = threading.Event()
+        handled = threading.Event()
+        class Task(object):
+            def __init__(self, name, fail):
+                self.name = name
+                self.fail = fail
+
+            def update(self):
+                if self.fail:
+                    started.wait()
+                    raise ValueError(self.name)
+                started.set()
+                handled.wait()
+                calls[0].call(log.append, self.name)
+        objects = {'a': Task('a', True), 'b': Task('b', False)}
+        def handle(e):
+            handled.set()
+            raise e
+        result = []
+        def run():
+            calls.append(ThreadCalls())
+            try:
+                ParallelScheduler(2, calls[0]).run(objects, {},
+                                                lambda obj: True, handle)
+            except ValueError:
+                result.append('raised')
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(result, ['raised'])
+        self.assertEqual(log, ['b'])
+
+if __name__ == '__main__':
+    unittest.main()
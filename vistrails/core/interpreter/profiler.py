@@ -0,0 +1,327 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+
+""" Contains the per-module execution profiler of the interpreter
+
+A Profiler is given to CachedInterpreter (set_profiler() or the 'profiler'
+argument of execute()). The interpreter then wraps the logging object of
+the modules in a ProfilingModuleLogging, which timestamps the calls that
+Module.update() makes on it: begin_update, begin_compute, update_cached and
+end_update. Nothing is wrapped when no profiler is set, so profiling costs
+nothing when disabled.
+
+"""
+
+import json
+import os
+import threading
+import time
+
+from vistrails.core.interpreter.utils import estimate_size
+from vistrails.core.modules.module_registry import get_module_registry
+
+try:
+    import resource
+except ImportError: # pragma: no cover
+    resource = None
+
+import unittest
+
+
+def _peak_memory():
+    """Returns the peak resident size of the process in kilobytes, or None.
+    """
+    if resource is None: # pragma: no cover
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class ModuleProfile(object):
+    """The measures for one update of one module.
+
+    module_id is the id in the executed pipeline. Times are in seconds.
+    start is relative to the creation of the profiler. upstream is the
+    time spent updating upstream modules and compute the time spent in the
+    module itself; cached modules report their whole wall time as upstream
+    and 0 compute. cpu is the CPU time of the whole process during compute, so it also
+    counts other threads when modules run in parallel. memory_delta is the
+    growth of the peak resident size during compute, in kilobytes.
+    """
+    __slots__ = ['module_id', 'module_name', 'execution', 'version',
+                 'iteration', 'thread', 'start', 'wall', 'upstream',
+                 'compute', 'cpu', 'cached', 'error', 'memory_delta',
+                 'output_size']
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.get(name))
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __repr__(self):
+        return '<ModuleProfile %s %r wall=%.6f%s>' % (
+                self.module_id, self.module_name, self.wall,
+                ' cached' if self.cached else '')
+
+
+class Profiler(object):
+    """Collects ModuleProfile records across executions.
+
+    The records are kept in the order modules finished. They can be
+    queried with get_records() and summary(), and exported as JSON or as a
+    Chrome trace (chrome://tracing, Perfetto).
+    """
+    def __init__(self, measure_outputs=True):
+        self.measure_outputs = measure_outputs
+        self.records = []
+        self._origin = time.time()
+        self._executions = 0
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self.records = []
+
+    def wrap(self, logging, version=None, remap_id=None):
+        """wrap(logging, version, remap_id) -> ProfilingModuleLogging
+
+        Returns the logging object to give to the modules of one
+        execution. remap_id maps the ids of the persistent modules to the
+        ids of the executed pipeline.
+        """
+        with self._lock:
+            self._executions += 1
+            execution = self._executions
+        return ProfilingModuleLogging(logging, self, execution, version,
+                                      remap_id)
+
+    def add_record(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def now(self):
+        return time.time() - self._origin
+
+    def get_records(self, module_id=None, module_name=None, execution=None,
+                    cached=None):
+        """Returns the records matching all the given criteria.
+        """
+        return [r for r in self.records
+                if (module_id is None or r.module_id == module_id) and
+                   (module_name is None or r.module_name == module_name) and
+                   (execution is None or r.execution == execution) and
+                   (cached is None or bool(r.cached) == cached)]
+
+    def summary(self):
+        """summary() -> dict
+
+        Aggregates the records per module id: number of updates, cache
+        hits, errors, and total wall, compute and upstream times.
+        """
+        result = {}
+        for r in self.records:
+            try:
+                s = result[r.module_id]
+            except KeyError:
+                s = result[r.module_id] = {'module_name': r.module_name,
+                                           'updates': 0, 'cache_hits': 0,
+                                           'errors': 0, 'wall': 0.0,
+                                           'compute': 0.0, 'upstream': 0.0}
+            s['updates'] += 1
+            if r.cached:
+                s['cache_hits'] += 1
+            if r.error is not None:
+                s['errors'] += 1
+            s['wall'] += r.wall
+            s['compute'] += r.compute
+            s['upstream'] += r.upstream
+        return result
+
+    def to_json(self):
+        return json.dumps({'records': [r.to_dict() for r in self.records]},
+                          indent=1)
+
+    def to_chrome_trace(self):
+        """Returns the records in the Chrome trace event format.
+
+        Each update is a complete event spanning the whole update; modules
+        that were computed get a nested 'compute' event.
+        """
+        events = []
+        pid = os.getpid()
+        for r in self.records:
+            args = r.to_dict()
+            start = int(r.start * 1e6)
+            events.append({'name': r.module_name or str(r.module_id),
+                           'cat': 'cached' if r.cached else 'update',
+                           'ph': 'X', 'ts': start,
+                           'dur': int(r.wall * 1e6),
+                           'pid': pid, 'tid': r.thread, 'args': args})
+            if not r.cached:
+                events.append({'name': 'compute', 'cat': 'compute',
+                               'ph': 'X',
+                               'ts': start + int(r.upstream * 1e6),
+                               'dur': int(r.compute * 1e6),
+                               'pid': pid, 'tid': r.thread})
+        return json.dumps({'traceEvents': events,
+                           'displayTimeUnit': 'ms'})
+
+    def save_json(self, filename):
+        with open(filename, 'w') as f:
+            f.write(self.to_json())
+
+    def save_chrome_trace(self, filename):
+        with open(filename, 'w') as f:
+            f.write(self.to_chrome_trace())
+
+
+class ProfilingModuleLogging(object):
+    """Records the progress of the modules of one execution in a Profiler,
+    then forwards the calls to the actual logging object.
+
+    """
+    def __init__(self, logging, profiler, execution, version=None,
+                 remap_id=None):
+        self._logging = logging
+        self._profiler = profiler
+        self._execution = execution
+        self._version = version
+        self._remap_id = remap_id
+        # id(module) -> [begin_update, begin_compute, cpu, memory]
+        self._pending = {}
+
+    def __getattr__(self, name):
+        return getattr(self._logging, name)
+
+    def begin_update(self, obj):
+        self._pending[id(obj)] = [self._profiler.now(), None, None, None]
+        return self._logging.begin_update(obj)
+
+    def begin_compute(self, obj):
+        now = self._profiler.now()
+        # loop iterations are computed without begin_update
+        times = self._pending.setdefault(id(obj), [now, None, None, None])
+        times[1:] = [now, time.clock(), _peak_memory()]
+        return self._logging.begin_compute(obj)
+
+    def update_cached(self, obj):
+        self._finish(obj, cached=True)
+        return self._logging.update_cached(obj)
+
+    def end_update(self, obj, error=None, *args, **kwargs):
+        self._finish(obj, error=error)
+        return self._logging.end_update(obj, error, *args, **kwargs)
+
+    def _finish(self, obj, cached=False, error=None):
+        end = self._profiler.now()
+        cpu = time.clock()
+        memory = _peak_memory()
+        times = self._pending.pop(id(obj), None)
+        if times is None:
+            # end_update for an error raised before begin_update
+            times = [end, None, None, None]
+        (start, compute_start, cpu_start, memory_start) = times
+        if compute_start is None:
+            compute_start = end
+            cpu_start = cpu
+            memory_start = memory
+        if memory is not None and memory_start is not None:
+            memory_delta = memory - memory_start
+        else: # pragma: no cover
+            memory_delta = None
+        output_size = None
+        if self._profiler.measure_outputs and not cached and error is None:
+            output_size = sum(estimate_size(value)
+                              for value in obj.outputPorts.itervalues()
+                              if value is not obj)
+        try:
+            module_name = get_module_registry().get_descriptor(
+                    obj.__class__).name
+        except Exception:
+            module_name = obj.__class__.__name__
+        module_id = obj.id
+        if self._remap_id is not None:
+            try:
+                module_id = self._remap_id(obj.id)
+            except KeyError:
+                pass
+        iteration = None
+        if hasattr(self._logging, 'log') and \
+                hasattr(self._logging.log, 'get_iteration_from_module'):
+            iteration = self._logging.log.get_iteration_from_module(obj)
+        self._profiler.add_record(ModuleProfile(
+                module_id=module_id,
+                module_name=module_name,
+                execution=self._execution,
+                version=self._version,
+                iteration=iteration,
+                thread=threading.current_thread().ident,
+                start=start,
+                wall=end - start,
+                upstream=compute_start - start,
+                compute=end - compute_start,
+                cpu=cpu - cpu_start,
+                cached=cached,
+                error=None if error is None else str(error),
+                memory_delta=memory_delta,
+                output_size=output_size))
+
+
+class TestProfiler(unittest.TestCase):
+
+    def test_export(self):
+        profiler = Profiler()
+        profiler.add_record(ModuleProfile(
+                module_id=1, module_name='Float', execution=1, thread=1,
+                start=0.5, wall=0.25, upstream=0.0, compute=0.25,
+                cpu=0.2, cached=False))
+        profiler.add_record(ModuleProfile(
+                module_id=1, module_name='Float', execution=2, thread=1,
+                start=1.5, wall=0.01, upstream=0.01, compute=0.0,
+                cpu=0.0, cached=True))
+        self.assertEqual(len(profiler.get_records(cached=True)), 1)
+        self.assertEqual(profiler.summary()[1]['updates'], 2)
+        self.assertAlmostEqual(profiler.summary()[1]['wall'], 0.26)
+
+        events = json.loads(profiler.to_chrome_trace())['traceEvents']
+        self.assertEqual([(e['name'], e['ts'], e['dur']) for e in events],
+                         [('Float', 500000, 250000),
+                          ('compute', 500000, 250000),
+                          ('Float', 1500000, 10000)])
+        records = json.loads(profiler.to_json())['records']
+        self.assertEqual([r['execution'] for r in records], [1, 2])
+        profiler.clear()
+        self.assertEqual(profiler.records, [])
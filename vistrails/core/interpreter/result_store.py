@@ -0,0 +1,298 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+""" Contains an on-disk store for the outputs of cacheable modules
+
+Entries are keyed by the subpipeline signature of the module that produced
+them, so they can be reused across processes and after the in-memory cache
+of the interpreter has been flushed. Only outputs whose type is a Constant
+that can be translated to a string and back without loss are stored.
+
+"""
+
+from vistrails.core import debug
+from vistrails.core.modules.module_registry import get_module_registry
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class StoreEntry(object):
+    def __init__(self, filename, time, size, packages=None):
+        self.filename = filename
+        self.time = time
+        self.size = size
+        # packages used by the subpipeline, None until the file is read
+        self.packages = packages
+
+
+class ResultStore(object):
+    """ResultStore keeps one JSON file per subpipeline signature in a
+    directory. The total size is bounded; least recently used entries are
+    removed first.
+
+    """
+    EXTENSION = '.json'
+
+    def __init__(self, directory, max_size=1024*1024*1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.elements = {}
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.init_store()
+
+    def init_store(self):
+        self.elements = {}
+        for f in os.listdir(self.directory):
+            if not f.endswith(self.EXTENSION):
+                continue
+            fname = os.path.join(self.directory, f)
+            statinfo = os.stat(fname)
+            signature = f[:-len(self.EXTENSION)]
+            self.elements[signature] = StoreEntry(fname,
+                                                  statinfo.st_mtime,
+                                                  statinfo.st_size)
+
+    def size(self):
+        return sum(entry.size for entry in self.elements.itervalues())
+
+    def __len__(self):
+        return len(self.elements)
+
+    def __contains__(self, signature):
+        return signature in self.elements
+
+    def _filename(self, signature):
+        return os.path.join(self.directory, signature + self.EXTENSION)
+
+    def get(self, signature):
+        """get(signature: str) -> dict or None
+        Returns the stored entry for a signature or None.
+
+        """
+        entry = self.elements.get(signature)
+        if entry is None:
+            self.misses += 1
+            return None
+        try:
+            with open(entry.filename, 'rb') as f:
+                data = json.load(f)
+            entry.packages = data['packages']
+            os.utime(entry.filename, None)
+            entry.time = os.stat(entry.filename).st_mtime
+        except (IOError, OSError, ValueError, KeyError), e:
+            debug.warning("Could not read cached result %s" % signature, e)
+            self.remove(signature)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, signature, data):
+        """put(signature: str, data: dict) -> None
+        Stores an entry, evicting old entries if the store is full.
+
+        """
+        fname = self._filename(signature)
+        tmp_fname = fname + '.tmp'
+        try:
+            with open(tmp_fname, 'wb') as f:
+                json.dump(data, f)
+            if os.path.exists(fname):
+                os.unlink(fname)
+            os.rename(tmp_fname, fname)
+            statinfo = os.stat(fname)
+        except (IOError, OSError), e:
+            debug.warning("Could not write cached result %s" % signature, e)
+            return
+        self.elements[signature] = StoreEntry(fname, statinfo.st_mtime,
+                                              statinfo.st_size,
+                                              data['packages'])
+        self.remove_lru()
+
+    def remove_lru(self):
+        total = self.size()
+        if total <= self.max_size:
+            return
+        elements = sorted(self.elements.iteritems(),
+                          key=lambda item: item[1].time)
+        for signature, entry in elements:
+            if total <= self.max_size:
+                break
+            total -= entry.size
+            self.remove(signature)
+
+    def remove(self, signature):
+        entry = self.elements.pop(signature, None)
+        if entry is not None:
+            try:
+                os.unlink(entry.filename)
+            except OSError, e:
+                debug.warning("Could not remove file %s" % entry.filename, e)
+
+    def invalidate_package(self, identifier):
+        """invalidate_package(identifier: str) -> None
+        Removes all entries computed by subpipelines that use the given
+        package.
+
+        """
+        for signature, entry in self.elements.items():
+            if entry.packages is None:
+                # read the file without counting it as a use
+                try:
+                    with open(entry.filename, 'rb') as f:
+                        entry.packages = json.load(f)['packages']
+                except (IOError, OSError, ValueError, KeyError):
+                    self.remove(signature)
+                    continue
+            if identifier in entry.packages:
+                self.remove(signature)
+
+    def clear(self):
+        for signature in self.elements.keys():
+            self.remove(signature)
+
+
+def serialize_outputs(obj):
+    """serialize_outputs(obj: Module) -> dict or None
+    Returns a dictionary mapping output port names to
+    (identifier, name, namespace, string) tuples, or None if one of the
+    outputs can't be stored.
+
+    """
+    from vistrails.core.modules.basic_modules import Constant, Path
+    outputs = {}
+    for port_name, value in obj.outputPorts.iteritems():
+        if port_name == 'self':
+            continue
+        spec = obj.output_specs.get(port_name)
+        if spec is None:
+            return None
+        descs = spec.descriptors()
+        if len(descs) != 1:
+            return None
+        desc = descs[0]
+        # paths may point to temporary files that won't survive
+        if not issubclass(desc.module, Constant) or \
+                issubclass(desc.module, Path):
+            return None
+        try:
+            s = desc.module.translate_to_string(value)
+            if desc.module.translate_to_python(s) != value:
+                return None
+        except Exception:
+            return None
+        outputs[port_name] = (desc.identifier, desc.name,
+                              desc.namespace or '', s)
+    return outputs
+
+
+def deserialize_outputs(outputs):
+    """deserialize_outputs(outputs: dict) -> dict
+    Translates the result of serialize_outputs() back to Python values.
+
+    """
+    reg = get_module_registry()
+    values = {}
+    for port_name, (identifier, name, namespace, s) in outputs.iteritems():
+        desc = reg.get_descriptor_by_name(identifier, name, namespace or None)
+        values[port_name] = desc.module.translate_to_python(s)
+    return values
+
+
+class TestResultStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='vt_results_')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put_get(self):
+        store = ResultStore(self.directory)
+        data = {'packages': ['org.vistrails.vistrails.basic'],
+                'outputs': {'value': ['org.vistrails.vistrails.basic',
+                                      'Float', '', '4.0']}}
+        store.put('abcd', data)
+        self.assertEqual(store.get('abcd'), data)
+        self.assertIsNone(store.get('ef01'))
+        self.assertEqual((store.hits, store.misses), (1, 1))
+
+        # a new store finds existing entries
+        store = ResultStore(self.directory)
+        self.assertIn('abcd', store)
+        store.put('ef01', {'packages': [], 'outputs': {}})
+        mtime = int(os.stat(store._filename('abcd')).st_mtime) - 10
+        os.utime(store._filename('abcd'), (mtime, mtime))
+        store.invalidate_package('org.vistrails.vistrails.pythoncalc')
+        self.assertEqual(len(store), 2)
+        # checking the packages is not a use of the entry
+        self.assertEqual((store.hits, store.misses), (0, 0))
+        self.assertEqual(os.stat(store._filename('abcd')).st_mtime, mtime)
+        store.invalidate_package('org.vistrails.vistrails.basic')
+        self.assertNotIn('abcd', store)
+        self.assertEqual(os.listdir(self.directory),
+                         ['ef01' + ResultStore.EXTENSION])
+
+    def test_eviction(self):
+        store = ResultStore(self.directory, max_size=300)
+        for i in xrange(10):
+            store.put('sig%d' % i, {'packages': [], 'outputs': {},
+                                    'padding': 'x' * 50})
+        self.assertLessEqual(store.size(), 300)
+        self.assertIn('sig9', store)
+
+    def test_serialize_outputs(self):
+        from vistrails.core.modules.basic_modules import Float
+        reg = get_module_registry()
+        desc = reg.get_descriptor(Float)
+        obj = Float()
+        obj.output_specs = dict(
+            (name, reg.get_port_spec_from_descriptor(desc, name, 'output'))
+            for name in ('value', 'value_as_string'))
+        obj.set_output('value', 2.5)
+        obj.set_output('value_as_string', '2.5')
+        outputs = serialize_outputs(obj)
+        self.assertEqual(deserialize_outputs(outputs),
+                         {'value': 2.5, 'value_as_string': '2.5'})
+        obj.set_output('value', 0.1 + 0.2)
+        self.assertIsNone(serialize_outputs(obj))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -32,3 +32,46 @@
 ## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
 ##
 ###############################################################################
+"""Helper functions for the interpreters."""
+
+import sys
+import unittest
+
+##############################################################################
+
+def estimate_size(value, max_depth=3):
+    """estimate_size(value, max_depth: int) -> int
+
+    Returns a rough estimate of the memory held by a value, in bytes.
+    Arrays are measured through their 'nbytes' attribute; containers are
+    walked down to max_depth levels.
+    """
+    nbytes = getattr(value, 'nbytes', None)
+    if isinstance(nbytes, (int, long)):
+        return nbytes
+    try:
+        size = sys.getsizeof(value)
+    except TypeError:
+        return 0
+    if max_depth > 0:
+        if isinstance(value, (list, tuple, set, frozenset)):
+            size += sum(estimate_size(v, max_depth - 1) for v in value)
+        elif isinstance(value, dict):
+            size += sum(estimate_size(k, max_depth - 1) +
+                        estimate_size(v, max_depth - 1)
+                        for k, v in value.iteritems())
+    return size
+
+##############################################################################
+
+class TestEstimateSize(unittest.TestCase):
+    def test_containers(self):
+        s = 'x' * 1000
+        self.assertGreater(estimate_size([s, s]), 2000)
+        self.assertGreater(estimate_size({'a': s}), 1000)
+        self.assertLess(estimate_size([[[[s]]]]), 1000)
+
+    def test_nbytes(self):
+        class Array(object):
+            nbytes = 8000
+        self.assertEqual(estimate_size(Array()), 8000)
@@ -35,6 +35,8 @@
 """basic_modules defines basic VisTrails Modules that are used in most
 pipelines."""
 import vistrails.core.cache.hasher
+from vistrails.core.cache.path_fingerprint import get_path_fingerprinter
+from vistrails.core.configuration import get_vistrails_configuration
 from vistrails.core.debug import format_exception
 from vistrails.core.modules.module_registry import get_module_registry
 from vistrails.core.modules.vistrails_module import Module, new_module, \
@@ -333,24 +335,26 @@ class Path(Constant):
 Path.default_value = PathObject('')
 
 def path_parameter_hasher(p):
-    def get_mtime(path):
-        t = int(os.path.getmtime(path))
-        if os.path.isdir(path):
-            for subpath in os.listdir(path):
-                subpath = os.path.join(path, subpath)
-                if os.path.isdir(subpath):
-                    t = max(t, get_mtime(subpath))
-        return t
+    """Signature of a File or Directory parameter, which also depends on
+    the state of the path on disk according to the 'pathSignature'
+    configuration option (see vistrails.core.cache.path_fingerprint).
 
+    """
     h = vistrails.core.cache.hasher.Hasher.parameter_signature(p)
+    mode = 'mtime'
+    conf = get_vistrails_configuration()
+    if conf is not None and conf.check('pathSignature'):
+        mode = conf.pathSignature
     try:
         # FIXME: This will break with aliases - I don't really care that much
-        t = get_mtime(p.strValue)
-    except OSError:
+        t = get_path_fingerprinter().fingerprint(p.strValue, mode)
+    except (OSError, IOError):
         return h
     hasher = sha_hash()
     hasher.update(h)
-    hasher.update(str(t))
+    if mode != 'mtime':
+        hasher.update(mode)
+    hasher.update(t)
     return hasher.digest()
 
 class File(Path):
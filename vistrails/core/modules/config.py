@@ -301,6 +301,14 @@ _documentation = \
       specified namespace instead of the 'namespace' attribute of the
       descriptor.
 
+   ModuleSettings.thread_safe: Boolean
+
+      If True, the interpreter may compute this module in a worker
+      thread, concurrently with other modules, when parallel execution
+      is enabled. Only set this if compute() doesn't depend on shared
+      mutable state (I/O bound modules such as downloads and external
+      commands are good candidates).
+
    Port.name: String
 
       The name of the of the port
@@ -478,7 +486,8 @@ ModuleSettings = namedtuple('ModuleSettings',
                            (('is_root', False),),
                            (('ghost_package', None),),
                            (('ghost_package_version', None),),
-                           (('ghost_namespace', None),),])
+                           (('ghost_namespace', None),),
+                           (('thread_safe', False),),])
 
 Port = namedtuple('Port', 
                      [("name",),
@@ -140,6 +140,7 @@ class ModuleDescriptor(DBModuleDescriptor):
             self._is_hidden = False
             self._namespace_hidden = False
             self._widget_classes = {}
+            self.thread_safe = False
             self.children = []
             # The ghost attributes represent the original values
             # for the descriptor of an upgraded package subworkflow
@@ -167,6 +168,7 @@ class ModuleDescriptor(DBModuleDescriptor):
             self._widget_classes = dict((k,copy.copy(v)) for k, v in \
                                          other._widget_classes.iteritems())
             self._namespace_hidden = other._namespace_hidden
+            self.thread_safe = other.thread_safe
             self.ghost_identifier = other.ghost_identifier
             self.ghost_package_version = other.ghost_package_version
             self.ghost_namespace = other.ghost_namespace
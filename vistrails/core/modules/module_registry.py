@@ -927,6 +927,21 @@ class ModuleRegistry(DBRegistry):
         else:
             return vistrails.core.cache.hasher.Hasher.module_signature(module, chm)
 
+    def has_constant_hasher(self, module):
+        """has_constant_hasher(module: Module) -> bool
+        Returns True if the signature of the given core.vistrail.Module
+        uses a custom constant hasher, which might depend on something
+        else than the pipeline (e.g. the modification time of a file).
+        """
+        chm = self._constant_hasher_map
+        if not chm:
+            return False
+        for function in module.functions:
+            for p in function.params:
+                if (p.identifier, p.type, p.namespace) in chm:
+                    return True
+        return False
+
     def get_module_color(self, identifier, name, namespace=None):
         return self.get_descriptor_by_name(identifier, name, namespace).module_color()
 
@@ -1218,6 +1233,7 @@ class ModuleRegistry(DBRegistry):
         # descriptor.set_configuration_widget(configureWidget)
         descriptor.is_hidden = settings.hide_descriptor
         descriptor.namespace_hidden = settings.hide_namespace
+        descriptor.thread_safe = settings.thread_safe
 
         if settings.signature:
             descriptor.set_hasher_callable(settings.signature)
@@ -593,6 +593,18 @@ class Package(DBPackage):
                                "%s: %s" % (self.name, type(e).__name__,
                                            ', '.join(e.args)))
 
+    def has_forkedProcessHook(self):
+        return hasattr(self._init_module, 'forkedProcessHook')
+
+    def forkedProcessHook(self):
+        if hasattr(self._init_module, 'forkedProcessHook'):
+            try:
+                self._init_module.forkedProcessHook()
+            except Exception, e:
+                debug.critical("Got exception in %s's forkedProcessHook(): "
+                               "%s: %s" % (self.name, type(e).__name__,
+                                           ', '.join(e.args)))
+
     def check_requirements(self):
         try:
             callable_ = self._module.package_requirements
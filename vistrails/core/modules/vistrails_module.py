@@ -36,12 +36,18 @@ from base64 import b16encode, b16decode
 
 import copy
 import json
+from multiprocessing.pool import ThreadPool
+import sys
+import threading
 import time
 from itertools import izip, product
 import warnings
 
+from vistrails.core.configuration import get_vistrails_configuration
 from vistrails.core.data_structures.bijectivedict import Bidict
 from vistrails.core import debug
+from vistrails.core.interpreter.parallel import QueuedModuleLogging, \
+    ThreadCalls
 from vistrails.core.modules.config import ModuleSettings, IPort, OPort
 from vistrails.core.vistrail.module_control_param import ModuleControlParam
 from vistrails.core.utils import VistrailsDeprecation, deprecated, \
@@ -53,6 +59,56 @@ except ImportError:
     import sha
     sha1_hash = sha.new
 
+def map_iterations(function, num_iterations, max_workers=1, calls=None):
+    """map_iterations(function: callable, num_iterations: int,
+                      max_workers: int, calls: ThreadCalls) -> iterator
+
+    Yields function(i) for each iteration i of a loop, in order. If
+    max_workers is greater than 1, the iterations run on a pool of that
+    many threads, and function has to be thread-safe. The calls the
+    iterations make through calls, which has to be owned by the calling
+    thread, are run in this thread while waiting for them. An exception
+    raised by an iteration is raised when its result is reached; the
+    iterations that didn't start yet are then cancelled.
+    """
+    if max_workers <= 1 or num_iterations <= 1:
+        for i in xrange(num_iterations):
+            yield function(i)
+        return
+    if calls is None:
+        calls = ThreadCalls()
+    cancelled = []
+    def run(i):
+        if cancelled:
+            return i, None, None
+        try:
+            return i, function(i), None
+        except Exception:
+            return i, None, sys.exc_info()
+
+    pool = ThreadPool(min(max_workers, num_iterations))
+    finished = {}
+    received = 0
+    try:
+        for i in xrange(num_iterations):
+            pool.apply_async(run, (i,), callback=calls.put)
+        for i in xrange(num_iterations):
+            while i not in finished:
+                j, result, exc_info = calls.get()
+                received += 1
+                finished[j] = result, exc_info
+            result, exc_info = finished.pop(i)
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            yield result
+    finally:
+        # running iterations might be waiting on calls
+        cancelled.append(True)
+        while received < num_iterations:
+            calls.get()
+            received += 1
+        pool.terminate()
+
 class NeedsInputPort(Exception):
     def __init__(self, obj, port):
         self.obj = obj
@@ -275,12 +331,29 @@ class Module(Serializable):
     consult its documentation for usage. Notably, using the file pool
     will make temporary files work correctly with caching, and will
     make sure the temporaries are correctly removed.
+
+    *Implicit Looping*
+
+    When a list is connected to a port expecting single values, the
+    module is computed once for each element (or combination of elements)
+    by compute_all(). Modules that can process all the elements at once,
+    e.g. as NumPy arrays, can implement compute_batch(columns). It
+    receives a dict mapping the name of each iterated port to the list of
+    its values, one per iteration, and should set each output port to the
+    list of its results, in the same order. The other ports are read with
+    get_input() as usual.
+
+    The iterations of modules whose descriptor is thread_safe run on a
+    pool of threads, see get_loop_threads().
     
     """
 
     _settings = ModuleSettings(is_root=True, abstract=True)
     _output_ports = [OPort("self", "Module", optional=True)]
 
+    # compute_batch(columns), see 'Implicit Looping' above
+    compute_batch = None
+
     def __init__(self):
         self.inputPorts = {}
         self.outputPorts = {}
@@ -620,6 +693,13 @@ class Module(Serializable):
             port_names = custom_order[1:]
                     
         elements, port_names = self.do_combine(combine_type, inputs, port_names)
+        if self.compute_batch is not None and self.list_depth == 1:
+            return self.compute_all_batch(port_names, elements)
+        if self.list_depth == 1:
+            max_workers = self.get_loop_threads([self])
+            if max_workers > 1 and len(elements) > 1:
+                return self.compute_all_concurrently(port_names, elements,
+                                                     max_workers)
         num_inputs = len(elements)
         loop = self.logging.begin_loop_execution(self, num_inputs)
         ## Update everything for each value inside the list
@@ -672,6 +752,109 @@ class Module(Serializable):
             self.set_output(nameOutput, outputs[nameOutput])
         loop.end_loop_execution()
 
+    def get_loop_threads(self, looped_modules):
+        """get_loop_threads(looped_modules: [Module]) -> int
+
+        Returns the number of threads the iterations of a loop over the
+        given modules can run on: the 'loop_threads' control parameter of
+        this module, else the 'loopThreads' configuration option. This is
+        1 unless all the looped modules are marked thread_safe.
+        """
+        from vistrails.core.modules.module_registry import \
+            get_module_registry
+        reg = get_module_registry()
+        if not all(reg.get_descriptor(module.__class__).thread_safe
+                   for module in looped_modules):
+            return 1
+        if ModuleControlParam.LOOP_THREADS_KEY in self.control_params:
+            value = self.control_params[ModuleControlParam.LOOP_THREADS_KEY]
+            try:
+                return int(value)
+            except ValueError:
+                raise ModuleError(self, "Invalid number of loop threads: %r" %
+                                        value)
+        conf = get_vistrails_configuration()
+        if conf is not None and conf.check('loopThreads'):
+            return conf.loopThreads
+        return 1
+
+    def compute_all_concurrently(self, port_names, elements, max_workers):
+        """Executes the module once for each combination of inputs, like
+        compute_all(), running the iterations on a pool of max_workers
+        threads. Each iteration updates its own copy of the module.
+
+        """
+        num_inputs = len(elements)
+        calls = ThreadCalls()
+        logging = QueuedModuleLogging(self.logging, calls)
+        loop = logging.begin_loop_execution(self, num_inputs)
+        if not self.upToDate: # pragma: no partial
+            self.typeChecking(self, port_names, elements)
+
+        def iteration(i):
+            module = copy.copy(self)
+            module.list_depth = self.list_depth - 1
+            module.logging = logging
+            module.had_error = False
+            module.upToDate = False
+            module.computed = False
+            module.setInputValues(module, port_names, elements[i], i)
+            loop.begin_iteration(module, i)
+            try:
+                module.update()
+            except ModuleSuspended, e:
+                e.loop_iteration = i
+                loop.end_iteration(module)
+                return e, None
+            loop.end_iteration(module)
+            return None, [(nameOutput, module.get_output(nameOutput))
+                          for nameOutput in module.outputPorts]
+
+        suspended = []
+        outputs = {}
+        for i, (suspension, values) in enumerate(
+                map_iterations(iteration, num_inputs, max_workers, calls)):
+            logging.update_progress(self, (i + 1.0) / num_inputs)
+            if suspension is not None:
+                suspended.append(suspension)
+                continue
+            for nameOutput, output in values:
+                outputs.setdefault(nameOutput, []).append(output)
+
+        if suspended:
+            raise ModuleSuspended(
+                    self,
+                    "function module suspended in %d/%d iterations" % (
+                            len(suspended), num_inputs),
+                    children=suspended)
+        # set final outputs
+        for nameOutput in outputs:
+            self.set_output(nameOutput, outputs[nameOutput])
+        loop.end_loop_execution()
+
+    def compute_all_batch(self, port_names, elements):
+        """Computes all the combinations of inputs with a single call to
+        compute_batch(). The loop is logged without its iterations.
+
+        """
+        num_inputs = len(elements)
+        loop = self.logging.begin_loop_execution(self, num_inputs)
+        self.typeChecking(self, port_names, elements)
+        if elements:
+            columns = dict((port_name, list(column))
+                           for port_name, column in izip(port_names,
+                                                         izip(*elements)))
+        else:
+            columns = dict((port_name, []) for port_name in port_names)
+        # the other ports are read as for a single iteration
+        list_depth, self.list_depth = self.list_depth, 0
+        try:
+            self.compute_batch(columns)
+        finally:
+            self.list_depth = list_depth
+        self.logging.update_progress(self, 1.0)
+        loop.end_loop_execution()
+
     def build_stream(self):
         """Determines and builds correct generator type.
 
@@ -1776,3 +1959,142 @@ class TestImplicitLooping(unittest.TestCase):
         
     def test_list_custom(self):
         self.run_vt("test-list-custom.vt")
+
+    def test_compute_batch(self):
+        from vistrails.core.db.locator import XMLFileLocator
+        from vistrails.core.interpreter.noncached import Interpreter
+        from vistrails.core.modules.module_registry import get_module_registry
+        from vistrails.core.utils import DummyView
+        from vistrails.tests.utils import build_pipeline, intercept_result
+
+        descriptor = get_module_registry().get_descriptor_by_name(
+                'org.vistrails.vistrails.pythoncalc', 'PythonCalc')
+        def compute(module):
+            self.fail("PythonCalc was computed for each element")
+        checked = []
+        def typeChecking(module, checked_module, port_names, elements):
+            if checked_module is module:
+                checked.append(list(elements))
+        old_compute = descriptor.module.compute
+        descriptor.module.compute = compute
+        descriptor.module.typeChecking = typeChecking
+        try:
+            for combine_type, expected in [
+                    (None, [10.0, 20.0, 20.0, 40.0, 30.0, 60.0]),
+                    ('pairwise', [10.0, 40.0])]:
+                pipeline = build_pipeline([
+                        ('List', 'org.vistrails.vistrails.basic', [
+                            ('value', [('List', '[1.0, 2.0, 3.0]')]),
+                        ]),
+                        ('List', 'org.vistrails.vistrails.basic', [
+                            ('value', [('List', '[10.0, 20.0]')]),
+                        ]),
+                        ('PythonCalc', 'org.vistrails.vistrails.pythoncalc', [
+                            ('op', [('String', '*')]),
+                        ]),
+                    ],
+                    [
+                        (0, 'value', 2, 'value1'),
+                        (1, 'value', 2, 'value2'),
+                    ])
+                if combine_type is not None:
+                    pipeline.modules[2].add_control_parameter(
+                            ModuleControlParam(
+                                    name=ModuleControlParam.LOOP_KEY,
+                                    value=combine_type))
+                with intercept_result(descriptor.module, 'value') as results:
+                    result = Interpreter.get().execute(
+                            pipeline,
+                            locator=XMLFileLocator('foo.xml'),
+                            current_version=1,
+                            view=DummyView())
+                self.assertFalse(result.errors)
+                self.assertEqual(results, [expected])
+                # every combination is type-checked
+                self.assertEqual(len(checked[-1]), len(expected))
+        finally:
+            descriptor.module.compute = old_compute
+            del descriptor.module.typeChecking
+
+    def test_concurrent_loop(self):
+        import time
+        from vistrails.core.db.locator import XMLFileLocator
+        from vistrails.core.interpreter.noncached import Interpreter
+        from vistrails.core.modules.module_registry import get_module_registry
+        from vistrails.core.utils import DummyView
+        from vistrails.tests.utils import build_pipeline, intercept_result
+
+        descriptor = get_module_registry().get_descriptor_by_name(
+                'org.vistrails.vistrails.pythoncalc', 'PythonCalc')
+        threads = set()
+        view_threads = set()
+        def compute(module):
+            v1 = module.get_input('value1')
+            threads.add(threading.current_thread().ident)
+            if v1 < 0:
+                raise ModuleSuspended(module, "waiting on %s" % v1)
+            # later iterations finish first
+            time.sleep(0.01 * (6 - v1))
+            module.set_output('value', v1 * module.get_input('value2'))
+        old_compute = descriptor.module.compute
+        old_compute_batch = descriptor.module.compute_batch
+        old_thread_safe = descriptor.thread_safe
+        descriptor.module.compute = compute
+        # iterations are only run concurrently without compute_batch()
+        descriptor.module.compute_batch = None
+        descriptor.thread_safe = True
+        suspensions = []
+        class View(DummyView):
+            def set_module_computing(self, module_id):
+                view_threads.add(threading.current_thread().ident)
+
+            def set_module_suspended(self, module_id, error):
+                suspensions.append(error)
+        try:
+            def run(values):
+                pipeline = build_pipeline([
+                        ('List', 'org.vistrails.vistrails.basic', [
+                            ('value', [('List', values)]),
+                        ]),
+                        ('PythonCalc', 'org.vistrails.vistrails.pythoncalc', [
+                            ('value2', [('Float', '10.0')]),
+                            ('op', [('String', '*')]),
+                        ]),
+                    ],
+                    [
+                        (0, 'value', 1, 'value1'),
+                    ])
+                pipeline.modules[1].add_control_parameter(
+                        ModuleControlParam(
+                                name=ModuleControlParam.LOOP_THREADS_KEY,
+                                value='3'))
+                with intercept_result(descriptor.module, 'value') as results:
+                    result = Interpreter.get().execute(
+                            pipeline,
+                            locator=XMLFileLocator('foo.xml'),
+                            current_version=1,
+                            view=View())
+                return result, results
+
+            result, results = run('[1.0, 2.0, 3.0, 4.0, 5.0, 6.0]')
+            self.assertFalse(result.errors)
+            self.assertEqual(results[-1],
+                             [10.0, 20.0, 30.0, 40.0, 50.0, 60.0])
+            self.assertGreater(len(threads), 1)
+            # the view is only used from this thread
+            self.assertEqual(view_threads,
+                             set([threading.current_thread().ident]))
+
+            result, results = run('[-1.0, 2.0, -3.0, 4.0, -5.0]')
+            self.assertFalse(result.errors)
+            self.assertIn(1, result.suspended)
+            # the loop module is reported first, then its iterations
+            suspended = suspensions[0]
+            self.assertEqual([e.loop_iteration for e in suspended.children],
+                             [0, 2, 4])
+            self.assertEqual(str(suspended),
+                             "function module suspended in 3/5 iterations")
+        finally:
+            descriptor.module.compute = old_compute
+            descriptor.module.compute_batch = old_compute_batch
+            descriptor.thread_safe = old_thread_safe
@@ -36,9 +36,18 @@
 This module handles Parameter Exploration in VisTrails
 """
 from vistrails.core import debug
+from vistrails.core.configuration import get_vistrails_configuration
+from vistrails.core.utils import InstanceObject
 from vistrails.core.vistrail.module_function import ModuleFunction
 from vistrails.core.vistrail.module_param import ModuleParam
+from vistrails.core.vistrail.operation import ChangeOp
 import copy
+import itertools
+import multiprocessing
+import operator
+import os
+import sys
+import uuid
 
 import unittest
 
@@ -173,6 +182,7 @@ class InterpolateDiscreteParam(object):
             p.strValue = str(v)
             f.params.append(p)
         m.functions.append(f)
+        pipeline.invalidate_signatures([m.id])
 
 class ActionBasedParameterExploration(object):
     """
@@ -206,38 +216,111 @@ class ActionBasedParameterExploration(object):
         """
         results = []
         resultActions = []
+        for pipeline, performedActions in self.iter_explore(pipeline, actions,
+                                                            pre_actions):
+            results.append(pipeline)
+            resultActions.append(performedActions)
+        return (results, resultActions)
+
+    def iter_explore(self, pipeline, actions, pre_actions=[],
+                     copy_pipelines=True, indexes=None):
+        """ iter_explore(pipeline: Pipeline, actions: [action set],
+                         pre_actions: [action set],
+                         copy_pipelines: bool,
+                         indexes: [int]) -> iter((pipeline, actions))
+        Generator version of explore(), yielding the same pipelines and
+        actions in the same order, one at a time. If indexes is given,
+        only the combinations at these positions are generated.
+
+        A single working pipeline is kept. Moving to the next combination
+        only switches the objects changed by the dimensions that moved, so
+        the rest of the pipeline is neither copied nor rehashed. If
+        copy_pipelines is False, that working pipeline is yielded itself:
+        it is then only valid until the next iteration, e.g. to execute it
+        right away. Explorations using other operations than changes are
+        replayed on a copy of the pipeline for each combination.
         
-        def exploreDimension(pipeline, performedActions, dim):
-            """ exploreDimension(pipeline: Pipeline, performedActions: [actions],
-                                 dim: int) -> None
-            Start applying actions to the pipeline at dimension
-            dim. 'pipeline' will not be modified in the function
-            
-            """
-            if dim<0:
-                results.append(pipeline)
-                resultActions.append(performedActions)
-                return
-            currentActions = actions[dim]
-            if len(currentActions)==0:
-                # Ignore empty dimension
-                exploreDimension(pipeline, performedActions, dim-1)
-                return
-            for actionSet in currentActions:
-                currentPipeline = copy.copy(pipeline)
-                currentPeformedActions = copy.copy(performedActions)
-                for action in actionSet:
-                    currentPipeline.perform_action(action)
-                    currentPeformedActions.append(action)
-                exploreDimension(currentPipeline, currentPeformedActions, dim-1)
-        
-        # perform pre_actions
-        currentPipeline = copy.copy(pipeline)
+        """
+        dims = [dimActions for dimActions in actions if dimActions]
+        incremental = all(op.vtType == 'change'
+                          for dimActions in dims
+                          for actionSet in dimActions
+                          for action in actionSet
+                          for op in action.operations)
+
+        basePipeline = copy.copy(pipeline)
         for action in pre_actions:
-            currentPipeline.perform_action(action)
-        
-        exploreDimension(currentPipeline, pre_actions, len(actions)-1)
-        return (results, resultActions)
+            basePipeline.perform_action(action)
+        # (what, id in basePipeline) -> id in basePipeline
+        currentIds = {}
+
+        # the first dimension changes fastest
+        sizes = [len(dimActions) for dimActions in reversed(dims)]
+        if indexes is None:
+            allSteps = itertools.product(*[xrange(size) for size in sizes])
+        else:
+            allSteps = (self._decode_index(index, sizes)
+                        for index in indexes)
+        for steps in allSteps:
+            actionSets = [dimActions[step]
+                          for dimActions, step in zip(reversed(dims), steps)]
+            performedActions = list(pre_actions)
+            for actionSet in actionSets:
+                performedActions.extend(actionSet)
+            if incremental:
+                for actionSet in actionSets:
+                    for action in actionSet:
+                        self._switch(basePipeline, action, currentIds)
+                currentPipeline = basePipeline
+                if copy_pipelines:
+                    currentPipeline = copy.copy(currentPipeline)
+            else:
+                currentPipeline = copy.copy(basePipeline)
+                for actionSet in actionSets:
+                    for action in actionSet:
+                        currentPipeline.perform_action(action)
+            yield (currentPipeline, performedActions)
+
+    @staticmethod
+    def _decode_index(index, sizes):
+        """ _decode_index(index: int, sizes: [int]) -> tuple
+        Returns the element at position index in the product of
+        xrange(size) for each size, by reading index as a mixed-radix
+        number whose last digit is in base sizes[-1].
+
+        """
+        if not 0 <= index < reduce(operator.mul, sizes, 1):
+            raise IndexError("combination index out of range: %d" % index)
+        steps = []
+        for size in reversed(sizes):
+            index, step = divmod(index, size)
+            steps.append(step)
+        steps.reverse()
+        return tuple(steps)
+
+    @staticmethod
+    def _switch(pipeline, action, currentIds):
+        """ _switch(pipeline: Pipeline, action: Action,
+                    currentIds: dict) -> None
+        Performs the change operations of action on a pipeline where
+        another step of the same dimension might have been performed
+        already; currentIds maps the objects of the original pipeline to
+        the ones that replaced them.
+
+        """
+        for op in action.operations:
+            key = (op.what, op.oldObjId)
+            currentId = currentIds.get(key, op.oldObjId)
+            if currentId == op.newObjId:
+                continue
+            pipeline.perform_operation(ChangeOp(id=-1,
+                                                what=op.what,
+                                                oldObjId=currentId,
+                                                newObjId=op.newObjId,
+                                                parentObjId=op.parentObjId,
+                                                parentObjType=op.parentObjType,
+                                                data=op.data))
+            currentIds[key] = op.newObjId
 
 def _pipelinePositions(sheetCount, rowCount, colCount,
                        pipelines):
@@ -259,6 +342,209 @@ def _pipelinePositions(sheetCount, rowCount, colCount,
         pipelinePositions.append((row, col, sheet))
     return pipelinePositions
 
+# State of the exploration being run, inherited by forked worker processes
+_worker_runner = None
+
+def _init_worker():
+    """Runs in each worker process once it is forked.
+
+    The packages holding resources that can't be shared with the parent
+    process, such as database connections, reopen them from their
+    forkedProcessHook(). Their modules are dropped from the interpreter
+    cache, as their outputs might be using these resources.
+    """
+    from vistrails.core.interpreter.default import get_default_interpreter
+    from vistrails.core.packagemanager import get_package_manager
+    interpreter = get_default_interpreter()
+    for package in get_package_manager().enabled_package_list():
+        if package.has_forkedProcessHook():
+            package.forkedProcessHook()
+            interpreter.clean_package_modules(package.identifier)
+
+def _run_cells_in_worker(indexes):
+    return _worker_runner.run_cells(indexes, merge_log=False)
+
+class ParameterExplorationRunner(object):
+    """
+    ParameterExplorationRunner executes the cells of a parameter
+    exploration without the GUI, on a pool of worker processes.
+
+    The workers are forked from the current process, so they start with
+    its module registry and interpreter cache, and keep their own
+    interpreter (and cache) for all the cells they run. Contiguous cells,
+    which share most of their parameters, are sent to the same worker.
+    The workflow executions they log are merged back into the log of the
+    controller. Cells are executed batch_size at a time with
+    CachedInterpreter.execute_batch(), so the modules they share are only
+    computed once.
+
+    """
+    batch_size = 16
+
+    def __init__(self, controller, processes=None):
+        """ ParameterExplorationRunner(controller: VistrailController,
+                                       processes: int)
+        processes defaults to the 'explorationProcesses' configuration
+        option, or to the number of CPUs. Cells are run in the current
+        process if it is 1, or on Windows where processes can't be forked.
+
+        """
+        if processes is None:
+            conf = get_vistrails_configuration()
+            if conf is not None and conf.check('explorationProcesses'):
+                processes = conf.explorationProcesses
+            else:
+                processes = multiprocessing.cpu_count()
+        self.controller = controller
+        self.processes = processes
+
+    def run(self, pe, extra_info=None,
+            reason='Parameter Exploration'):
+        """ run(pe: ParameterExploration, extra_info: dict,
+                reason: str) -> [InstanceObject]
+        Executes every cell of the parameter exploration, returning for
+        each of them an object with its 'position' (row, column, sheet),
+        its 'errors' (module id -> message) and, if cells are dumped
+        (extra_info['pathDumpCells']), the name of its 'image'.
+
+        """
+        controller = self.controller
+        if pe.action_id != controller.current_version:
+            controller.change_selected_version(pe.action_id)
+        pipeline = controller.current_pipeline
+        actions, pre_actions, vistrail_vars = \
+            pe.collectParameterActions(pipeline)
+        if not pipeline or not actions:
+            return []
+        if extra_info is None:
+            extra_info = {}
+
+        self.pipeline = pipeline
+        self.actions = actions
+        self.pre_actions = pre_actions
+        self.extra_info = extra_info
+        self.reason = reason
+        self.log_id = uuid.uuid1()
+        dim = [max(1, len(a)) for a in actions]
+        count = reduce(operator.mul, dim, 1)
+        self.positions = _pipelinePositions(dim[2], dim[1], dim[0],
+                                            xrange(count))
+        self.vistrail_variables = None
+        if controller.get_vistrail_variables():
+            # remove vars used in pe
+            variables = dict((v.uuid, v)
+                             for v in controller.get_vistrail_variables()
+                             if v.uuid not in vistrail_vars)
+            self.vistrail_variables = lambda x: variables.get(x, None)
+
+        processes = min(self.processes, count)
+        if processes <= 1 or sys.platform == 'win32':
+            results = self.run_cells(range(count), merge_log=True)
+        else:
+            results = self.run_in_pool(count, processes)
+        if controller.logging_on():
+            controller.set_changed(True)
+        return [InstanceObject(position=self.positions[index],
+                               errors=errors,
+                               image=image)
+                for index, errors, image in results]
+
+    def run_in_pool(self, count, processes):
+        """ run_in_pool(count: int, processes: int) -> list
+        Runs the cells on forked workers, merging the workflow executions
+        they logged into the log of the controller.
+
+        """
+        global _worker_runner
+        # a few chunks per worker, to balance the load
+        chunk_size = max(1, count // (processes * 4))
+        chunks = [range(i, min(i + chunk_size, count))
+                  for i in xrange(0, count, chunk_size)]
+        _worker_runner = self
+        pool = multiprocessing.Pool(processes, _init_worker)
+        try:
+            chunk_results = pool.map(_run_cells_in_worker, chunks)
+        finally:
+            pool.terminate()
+            pool.join()
+            _worker_runner = None
+
+        results = []
+        log = self.controller.log
+        for cells, workflow_execs in chunk_results:
+            results.extend(cells)
+            for workflow_exec in workflow_execs:
+                log.add_workflow_exec(
+                    workflow_exec.do_copy(True, log.id_scope, {}))
+        return results
+
+    def run_cells(self, indexes, merge_log=True):
+        """ run_cells(indexes: [int], merge_log: bool) -> list
+        Executes the given cells in this process. If merge_log is False,
+        returns the results along with the workflow executions logged,
+        which are then to be merged into another process's log.
+
+        """
+        from vistrails.core.interpreter.default import get_default_interpreter
+        controller = self.controller
+        interpreter = get_default_interpreter()
+        explorer = ActionBasedParameterExploration()
+        log = controller.log
+        nb_workflow_execs = len(log.workflow_execs)
+        cells = itertools.izip(indexes,
+                               explorer.iter_explore(self.pipeline,
+                                                     self.actions,
+                                                     self.pre_actions,
+                                                     indexes=indexes))
+        results = []
+        while True:
+            batch = list(itertools.islice(cells, self.batch_size))
+            if not batch:
+                break
+            results.extend(self._run_batch(interpreter, batch))
+        if merge_log:
+            return results
+        return results, log.workflow_execs[nb_workflow_execs:]
+
+    def _run_batch(self, interpreter, batch):
+        """ _run_batch(interpreter: CachedInterpreter,
+                       batch: [(int, (Pipeline, [Action]))]) -> list
+        Executes a batch of cells together.
+
+        """
+        controller = self.controller
+        pipelines = []
+        pipeline_kwargs = []
+        results = []
+        for index, (pipeline, performedActions) in batch:
+            position = self.positions[index]
+            extra_info = dict(self.extra_info)
+            image = None
+            if 'pathDumpCells' in extra_info:
+                name = os.path.splitext(controller.name)[0] + \
+                    ("_%s_%s_%s" % position)
+                extra_info['nameDumpCells'] = name
+                image = os.path.join(extra_info['pathDumpCells'], name)
+            kwargs = {'locator': controller.locator,
+                      'current_version': controller.current_version,
+                      'reason': '%s %s %s_%s_%s' % (
+                              (self.reason, self.log_id) + position),
+                      'logger': controller.get_logger(),
+                      'actions': performedActions,
+                      'extra_info': extra_info}
+            if self.vistrail_variables is not None:
+                kwargs['vistrail_variables'] = self.vistrail_variables
+            pipelines.append(pipeline)
+            pipeline_kwargs.append(kwargs)
+            results.append((index, image))
+        batch_results = interpreter.execute_batch(pipelines, pipeline_kwargs)
+        return [(index,
+                 dict((module_id, str(error))
+                      for module_id, error in result.errors.iteritems()),
+                 image)
+                for (index, image), result in itertools.izip(results,
+                                                             batch_results)]
+
 
 ################################################################################
         
@@ -280,5 +566,161 @@ class TestParameterExploration(unittest.TestCase):
                           (5, 5.0, 'two'),
                           (10, 10.0, 'three')])
 
+    def create_exploration(self):
+        """Creates a pipeline with two String modules and a 3 x 2
+        exploration of their values.
+
+        """
+        from vistrails.core.db.action import create_action
+        from vistrails.core.system import get_vistrails_basic_pkg_id
+        from vistrails.core.vistrail.module import Module
+        from vistrails.core.vistrail.pipeline import Pipeline
+        from vistrails.db.domain import IdScope
+
+        id_scope = IdScope()
+        def new_param(value):
+            return ModuleParam(id=id_scope.getNewId(ModuleParam.vtType),
+                               type='String', val=value)
+        modules = []
+        for value in ('first', 'second'):
+            function = ModuleFunction(
+                    id=id_scope.getNewId(ModuleFunction.vtType),
+                    name='value',
+                    parameters=[new_param(value)])
+            modules.append(Module(id=id_scope.getNewId(Module.vtType),
+                                  package=get_vistrails_basic_pkg_id(),
+                                  name='String',
+                                  functions=[function]))
+        pipeline = Pipeline(id=id_scope.getNewId(Pipeline.vtType),
+                            modules=modules)
+        actions = []
+        for module, values in zip(modules, [('a', 'b', 'c'), ('x', 'y')]):
+            function = module.functions[0]
+            actions.append([(create_action([('change', function.params[0],
+                                             new_param(v), function.vtType,
+                                             function.real_id)]),)
+                            for v in values])
+        return pipeline, modules, actions
+
+    @staticmethod
+    def values(pipeline, modules):
+        return tuple(pipeline.modules[m.id].functions[0].params[0].strValue
+                     for m in modules)
+
+    def test_iter_explore(self):
+        pipeline, modules, actions = self.create_exploration()
+        expected = [(v1, v2) for v2 in 'xy' for v1 in 'abc']
+        explorer = ActionBasedParameterExploration()
+
+        results = list(explorer.iter_explore(pipeline, actions))
+        self.assertEqual([self.values(p, modules) for p, a in results],
+                         expected)
+        self.assertEqual([[action.operations[0].data.strValue
+                           for action in a]
+                          for p, a in results],
+                         [[v2, v1] for v1, v2 in expected])
+        self.assertEqual(self.values(pipeline, modules), ('first', 'second'))
+
+        (pipelines, _) = explorer.explore(pipeline, actions)
+        self.assertEqual([self.values(p, modules) for p in pipelines],
+                         expected)
+
+        results = explorer.iter_explore(pipeline, actions,
+                                        indexes=[4, 1, 5, 0])
+        self.assertEqual([self.values(p, modules) for p, a in results],
+                         [expected[4], expected[1], expected[5], expected[0]])
+        with self.assertRaises(IndexError):
+            list(explorer.iter_explore(pipeline, actions, indexes=[6]))
+
+    def test_iter_explore_shared(self):
+        pipeline, modules, actions = self.create_exploration()
+        explorer = ActionBasedParameterExploration()
+        signatures = []
+        for p, a in explorer.iter_explore(pipeline, actions,
+                                          copy_pipelines=False):
+            # the second module is only rehashed when its value changes
+            if signatures:
+                changed = signatures[-1][0] != self.values(p, modules)[1]
+                self.assertEqual(modules[1].id in p._module_signatures,
+                                 not changed)
+            signatures.append((self.values(p, modules)[1],
+                               p.module_signature(modules[1].id)))
+        self.assertEqual(len(signatures), 6)
+        self.assertEqual(len(set(s for v, s in signatures)), 2)
+
+class TestParameterExplorationRunner(unittest.TestCase):
+    def create_exploration(self):
+        """Loads the 'int chain' workflow and creates an exploration of the
+        value of its first Integer module.
+
+        """
+        from vistrails.core.db.io import load_vistrail
+        from vistrails.core.db.locator import XMLFileLocator
+        from vistrails.core.paramexplore.function import PEFunction
+        from vistrails.core.paramexplore.param import PEParam
+        from vistrails.core.paramexplore.paramexplore import \
+            ParameterExploration
+        from vistrails.core.system import vistrails_root_directory
+        from vistrails.core.vistrail.controller import VistrailController
+
+        locator = XMLFileLocator(vistrails_root_directory() +
+                                 '/tests/resources/dummy.xml')
+        (v, abstractions, thumbnails, mashups) = load_vistrail(locator)
+        controller = VistrailController(v, locator, abstractions,
+                                        thumbnails, mashups)
+        version = v.get_version_number('int chain')
+        controller.change_selected_version(version)
+        # module ids depend on the upgrade of the workflow
+        module, = [m for m in controller.current_pipeline.modules.itervalues()
+                   if m.name == 'Integer' and m.functions]
+        param = PEParam(pos=0, interpolator='List', dimension=0,
+                        value="['1', '2', '3']")
+        function = PEFunction(module_id=module.id, port_name='value',
+                              is_alias=0, parameters=[param])
+        pe = ParameterExploration(action_id=version,
+                                  dims='[3, 1, 1, 1]', layout='{}',
+                                  functions=[function])
+        return controller, pe
+
+    def test_run(self):
+        from vistrails.core.modules.basic_modules import StandardOutput
+        controller, pe = self.create_exploration()
+        values = []
+        def compute(module):
+            values.append(module.get_input('value'))
+        orig_compute = StandardOutput.compute
+        StandardOutput.compute = compute
+        try:
+            runner = ParameterExplorationRunner(controller, processes=1)
+            results = runner.run(pe)
+        finally:
+            StandardOutput.compute = orig_compute
+        self.assertEqual(values, [1, 2, 3])
+        self.assertEqual([(r.position, r.errors) for r in results],
+                         [((0, 0, 0), {}), ((0, 1, 0), {}), ((0, 2, 0), {})])
+
+    @unittest.skipIf(sys.platform == 'win32', "processes can't be forked")
+    def test_run_in_pool(self):
+        from vistrails.core.modules.basic_modules import StandardOutput
+        controller, pe = self.create_exploration()
+        if not controller.logging_on():
+            self.skipTest("logging is disabled")
+        nb_workflow_execs = len(controller.log.workflow_execs)
+        orig_compute = StandardOutput.compute
+        StandardOutput.compute = lambda module: None
+        try:
+            runner = ParameterExplorationRunner(controller, processes=2)
+            results = runner.run(pe)
+        finally:
+            StandardOutput.compute = orig_compute
+        self.assertEqual(sorted(r.position for r in results),
+                         [(0, 0, 0), (0, 1, 0), (0, 2, 0)])
+        self.assertFalse(any(r.errors for r in results))
+        workflow_execs = controller.log.workflow_execs[nb_workflow_execs:]
+        self.assertEqual(len(workflow_execs), 3)
+        self.assertEqual(len(set(w.id for w in controller.log.workflow_execs)),
+                         len(controller.log.workflow_execs))
+        self.assertTrue(all(w.completed == 1 for w in workflow_execs))
+
 if __name__ == '__main__':
     unittest.main()
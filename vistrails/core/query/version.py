@@ -409,6 +409,9 @@ class RegexEnabledSearchStmt(SearchStmt):
         self.use_regex = use_regex
         if self.use_regex:
             self.regex = re.compile(content, re.MULTILINE | re.IGNORECASE)
+        self._index = None
+        self._generation = None
+        self._versions = None
 
     def _content_matches(self, v):
         if self.use_regex:
@@ -416,36 +419,55 @@ class RegexEnabledSearchStmt(SearchStmt):
         else:
             return v in self.content
 
-class UserSearchStmt(RegexEnabledSearchStmt):
+    def find_versions(self, index):
+        """find_versions(index: VersionSearchIndex) -> set(version)
+        Returns the versions matched by this statement, looked up in
+        the vistrail's search index
+
+        """
+        return set()
+
+    def matching_versions(self, vistrail):
+        """matching_versions(vistrail) -> set(version)
+        Same as find_versions() but only queries the index again
+        after it has changed
+
+        """
+        index = vistrail.get_search_index()
+        if self._index is not index or self._generation != index.generation:
+            self._versions = self.find_versions(index)
+            self._index = index
+            self._generation = index.generation
+        return self._versions
+
     def match(self, vistrail, action):
-        if not action.user:
-            return False
-        return self._content_matches(action.user)
+        return action.timestep in self.matching_versions(vistrail)
+
+    def run(self, vistrail, name):
+        self.matching_versions(vistrail)
+
+class UserSearchStmt(RegexEnabledSearchStmt):
+    def find_versions(self, index):
+        return index.find_users(self._content_matches)
 
 class NotesSearchStmt(RegexEnabledSearchStmt):
-    def match(self, vistrail, action):
-        if vistrail.has_notes(action.id):
-            plainNotes = extract_text(vistrail.get_notes(action.id))
-            return self._content_matches(plainNotes)
-        return False
+    def find_versions(self, index):
+        return index.find_notes(
+            lambda notes: self._content_matches(extract_text(notes)))
 
 class NameSearchStmt(RegexEnabledSearchStmt):
+    def find_versions(self, index):
+        return index.find_tags(self._content_matches)
+
     def match(self, vistrail, action):
-        m = 0
-        tm = vistrail.get_tagMap()
-        if action.timestep in tm:
-            m = self._content_matches(tm[action.timestep])
-        if bool(m) == False:
-            m = self._content_matches(vistrail.get_description(action.timestep))
-        return bool(m)
+        if RegexEnabledSearchStmt.match(self, vistrail, action):
+            return True
+        return bool(self._content_matches(
+                vistrail.get_description(action.timestep)))
 
 class ModuleSearchStmt(RegexEnabledSearchStmt):
-    def match(self, vistrail, action):
-        pipeline = vistrail.getPipeline(action.timestep)
-        for module in pipeline.modules.itervalues():
-            if self._content_matches(module.name):
-                return True
-        return False
+    def find_versions(self, index):
+        return index.find_modules(self._content_matches)
 
 class AndSearchStmt(SearchStmt):
     def __init__(self, lst):
@@ -455,6 +477,9 @@ class AndSearchStmt(SearchStmt):
             if not s.match(vistrail, action):
                 return False
         return True
+    def run(self, vistrail, name):
+        for s in self.matchList:
+            s.run(vistrail, name)
 
 class OrSearchStmt(SearchStmt):
     def __init__(self, lst):
@@ -464,12 +489,17 @@ class OrSearchStmt(SearchStmt):
             if s.match(vistrail, action):
                 return True
         return False
+    def run(self, vistrail, name):
+        for s in self.matchList:
+            s.run(vistrail, name)
 
 class NotSearchStmt(SearchStmt):
     def __init__(self, stmt):
         self.stmt = stmt
     def match(self, vistrail, action):
-        return not self.stmt.match(action)
+        return not self.stmt.match(vistrail, action)
+    def run(self, vistrail, name):
+        self.stmt.run(vistrail, name)
 
 class TrueSearch(SearchStmt):
     def __init__(self):
@@ -518,7 +548,7 @@ class SearchCompiler(object):
         while len(tokStream):
             tok = tokStream[0]
             if ':' in tok:
-                return (AndSearchStmt(lst, use_regex), tokStream)
+                return (AndSearchStmt(lst), tokStream)
             lst.append(NotesSearchStmt(tok, use_regex))
             tokStream = tokStream[1:]
         return (AndSearchStmt(lst), [])
@@ -700,5 +730,48 @@ class TestSearch(unittest.TestCase):
         SearchCompiler('before')
         SearchCompiler('after')
 
+    def load_dummy(self):
+        from vistrails.core.db.locator import XMLFileLocator
+        import vistrails.core.system
+        return XMLFileLocator(vistrails.core.system.vistrails_root_directory() +
+                              '/tests/resources/dummy.xml').load()
+
+    def test_module_index(self):
+        v = self.load_dummy()
+        for name in ['Float', 'PythonCalc', 'Integer', 'String']:
+            stmt = ModuleSearchStmt(name, False)
+            for version, action in v.actionMap.iteritems():
+                pipeline = v.getPipeline(version)
+                expected = any(m.name == name
+                               for m in pipeline.modules.itervalues())
+                self.assertEqual(stmt.match(v, action), expected)
+
+    def test_annotation_index(self):
+        v = self.load_dummy()
+        version = max(v.actionMap)
+        action = v.actionMap[version]
+        stmt = SearchCompiler('name:searchme notes:findme').searchStmt
+        not_stmt = NotSearchStmt(NameSearchStmt('searchme', False))
+        stmt.run(v, '')
+        self.assertFalse(stmt.match(v, action))
+        self.assertTrue(not_stmt.match(v, action))
+        v.set_tag(version, 'searchme')
+        v.set_notes(version, 'findme')
+        self.assertTrue(stmt.match(v, action))
+        self.assertFalse(not_stmt.match(v, action))
+        v.set_tag(version, None)
+        self.assertFalse(stmt.match(v, action))
+        self.assertTrue(not_stmt.match(v, action))
+
+    def test_user_index(self):
+        v = self.load_dummy()
+        index = v.get_search_index()
+        users = set(a.user for a in v.actionMap.itervalues() if a.user)
+        for user in users:
+            stmt = UserSearchStmt(user, False)
+            self.assertEqual(set(version for version, a in v.actionMap.iteritems()
+                                 if stmt.match(v, a)),
+                             index.users[user])
+
 if __name__ == '__main__':
     unittest.main()
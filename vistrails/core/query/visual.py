@@ -37,6 +37,7 @@ from vistrails.core.modules.module_registry import get_module_registry
 from vistrails.core.utils import append_to_dict_of_lists
 import copy
 import re
+import unittest
 
 ################################################################################
 
@@ -84,54 +85,123 @@ class VisualQuery(query.Query):
             target_ids = nextTargetIds
             template_ids = nextTemplateIds
 
+    def getRequirements(self):
+        """getRequirements() -> list
+        Returns, for each source of the query pipeline, the structure
+        that heuristicDAGIsomorphism requires from a version for that
+        source to match: (source name, names of all modules reached from
+        the source, [(names of a BFS level, name of a module of the
+        next level)]). The latter means that a version needs a
+        connection to a module of that name from one of those modules.
+
+        """
+        template = self.queryPipeline
+        requirements = []
+        if template is None:
+            return requirements
+        for sourceId in template.graph.sources():
+            names = set()
+            edges = set()
+            levelIds = set([sourceId])
+            while levelIds:
+                levelNames = frozenset(template.modules[i].name
+                                       for i in levelIds)
+                names.update(levelNames)
+                nextIds = set()
+                for i in levelIds:
+                    nextIds.update(moduleId for (moduleId, edgeId)
+                                   in template.graph.edges_from(i))
+                for i in nextIds:
+                    edges.add((levelNames, template.modules[i].name))
+                levelIds = nextIds
+            requirements.append((template.modules[sourceId].name,
+                                 names, list(edges)))
+        return requirements
+
+    def findCandidates(self, vistrail, versions):
+        """findCandidates(vistrail, versions) -> list
+        Returns the versions that may match the query, using the
+        vistrail's search index to reject the others without building
+        their pipelines. Follows the same rules as run(): a source
+        whose name is missing clears the matches so far, a source that
+        cannot match rejects the version.
+
+        """
+        index = vistrail.get_search_index()
+        requirements = self.getRequirements()
+        candidates = []
+        for version in versions:
+            modules = index.module_counts(version)
+            connections = index.connection_counts(version)
+            possible = False
+            for (sourceName, names, edges) in requirements:
+                if sourceName not in modules:
+                    possible = False
+                    continue
+                if (not all(n in modules for n in names) or
+                    not all(any((s, name) in connections for s in sources)
+                            for (sources, name) in edges)):
+                    possible = False
+                    break
+                possible = True
+            if possible:
+                candidates.append(version)
+        return candidates
+
     def run(self, vistrail, name):
         result = []
         self.tupleLength = 2
-        for version in self.versions_to_check:
-            p = vistrail.getPipeline(version)
-            matches = set()
-            queryModuleNameIndex = {}
-            for moduleId, module in p.modules.iteritems():
-                append_to_dict_of_lists(queryModuleNameIndex, module.name, moduleId)
-            for querySourceId in self.queryPipeline.graph.sources():
-                querySourceName = self.queryPipeline.modules[querySourceId].name
-                if not queryModuleNameIndex.has_key(querySourceName):
-                    # need to reset matches here!
-                    matches = set()
-                    continue
-                candidates = queryModuleNameIndex[querySourceName]
-                atLeastOneMatch = False
-                for candidateSourceId in candidates:
-                    querySource = self.queryPipeline.modules[querySourceId]
-                    candidateSource = p.modules[candidateSourceId]
-                    if not self.matchQueryModule(candidateSource,
-                                                 querySource):
-                        continue
-                    (match, targetIds) = self.heuristicDAGIsomorphism \
-                                             (template = self.queryPipeline, 
-                                              target = p,
-                                              template_ids = [querySourceId],
-                                              target_ids = [candidateSourceId])
-                    if match:
-                        atLeastOneMatch = True
-                        matches.update(targetIds)
-                        
-                # We always perform AND operation
-                if not atLeastOneMatch:
-                    matches = set()
-                    break
-                
-            for m in matches:
+        for version in self.findCandidates(vistrail, self.versions_to_check):
+            for m in self.matchVersion(vistrail, version):
                 result.append((version, m))
         self.queryResult = result
         self.computeIndices()
         return result
-                
+
+    def matchVersion(self, vistrail, version):
+        """matchVersion(vistrail, version) -> set(module_id)
+        Returns the ids of the modules of version matched by the query
+
+        """
+        p = vistrail.getPipeline(version)
+        matches = set()
+        queryModuleNameIndex = {}
+        for moduleId, module in p.modules.iteritems():
+            append_to_dict_of_lists(queryModuleNameIndex, module.name, moduleId)
+        for querySourceId in self.queryPipeline.graph.sources():
+            querySourceName = self.queryPipeline.modules[querySourceId].name
+            if not queryModuleNameIndex.has_key(querySourceName):
+                # need to reset matches here!
+                matches = set()
+                continue
+            candidates = queryModuleNameIndex[querySourceName]
+            atLeastOneMatch = False
+            for candidateSourceId in candidates:
+                querySource = self.queryPipeline.modules[querySourceId]
+                candidateSource = p.modules[candidateSourceId]
+                if not self.matchQueryModule(candidateSource,
+                                             querySource):
+                    continue
+                (match, targetIds) = self.heuristicDAGIsomorphism \
+                                         (template = self.queryPipeline, 
+                                          target = p,
+                                          template_ids = [querySourceId],
+                                          target_ids = [candidateSourceId])
+                if match:
+                    atLeastOneMatch = True
+                    matches.update(targetIds)
+                        
+            # We always perform AND operation
+            if not atLeastOneMatch:
+                matches = set()
+                break
+        return matches
+
     def __call__(self):
         """Returns a copy of itself. This needs to be implemented so that
         a visualquery object looks like a class that can be instantiated
         once per vistrail."""
-        return VisualQuery(self.queryPipeline)
+        return VisualQuery(self.queryPipeline, self.versions_to_check)
 
     def matchQueryModule(self, template, target):
         """ matchQueryModule(template, target: Module) -> bool        
@@ -237,3 +307,26 @@ class VisualQuery(query.Query):
         #             except:
         #                 print 'Invalid query "%s".' % template.strValue
         #                 return False
+
+################################################################################
+
+class TestVisualQuery(unittest.TestCase):
+    def make_query(self, vistrail, version):
+        pipeline = copy.copy(vistrail.getPipeline(version))
+        for module in pipeline.modules.itervalues():
+            module.functions = []
+        return pipeline
+
+    def test_find_candidates(self):
+        from vistrails.core.db.locator import XMLFileLocator
+        import vistrails.core.system
+        v = XMLFileLocator(vistrails.core.system.vistrails_root_directory() +
+                           '/tests/resources/dummy.xml').load()
+        versions = sorted(v.actionMap)
+        for query_version in versions[::5]:
+            query = VisualQuery(self.make_query(v, query_version), versions)
+            candidates = set(query.findCandidates(v, versions))
+            self.assertIn(query_version, candidates)
+            for version in versions:
+                if query.matchVersion(v, version):
+                    self.assertIn(version, candidates)
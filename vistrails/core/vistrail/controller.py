@@ -155,6 +155,7 @@ class VistrailController(object):
         self.flush_pipeline_cache()
         self._current_full_graph = None
         self._current_terse_graph = None
+        self._terse_graph_state = None
         self.num_versions_always_shown = 1
 
         # if self.search is True, vistrail is currently being searched
@@ -585,7 +586,7 @@ class VistrailController(object):
                 self.vistrail.change_description(description, action.id)
             self.current_version = action.db_id
             self.set_changed(True)
-            self.recompute_terse_graph()
+            self.update_terse_graph([action.db_id])
             
     def create_module_from_descriptor(self, *args, **kwargs):
         return self.create_module_from_descriptor_static(self.id_scope,
@@ -2742,33 +2743,150 @@ class VistrailController(object):
         fullVersionTree = self.vistrail.tree.getVersionTree()
 
         # create tersed tree
-        x = [(0,None)]
         tersedVersionTree = Graph()
 
-        # cache actionMap and tagMap because they're properties, sort
-        # of slow
-        am = self.vistrail.actionMap
+        # cache tagMap because it's a property, sort of slow
         tm = self.vistrail.get_tagMap()
-        last_n = self.vistrail.getLastActions(self.num_versions_always_shown)
+        state = self._get_terse_graph_state()
+        self._walk_terse_graph(tersedVersionTree, [(0, None)],
+                               fullVersionTree, tm.__contains__, state[5])
+
+        self._current_terse_graph = tersedVersionTree
+        self._current_full_graph = fullVersionTree
+        self._terse_graph_state = state
+
+    def update_terse_graph(self, versions):
+        """update_terse_graph(versions: list of version numbers) -> None
 
+        Patches the terse version graph after the given versions were
+        added, tagged, pruned, expanded or collapsed. Only the chains of
+        versions around them are walked, not the whole version tree as
+        in recompute_terse_graph(). Changes of the current version and of
+        the latest versions are picked up automatically.
+
+        """
+        graph = self._current_terse_graph
+        old_state = self._terse_graph_state
+        state = self._get_terse_graph_state()
+        if graph is None or old_state is None or state[:4] != old_state[:4]:
+            self.recompute_terse_graph()
+            return
+
+        full = self.vistrail.tree.getVersionTree()
+        am = self.vistrail.actionMap
+        changed = set(versions)
+        changed.update(state[5] ^ old_state[5])
+        if state[4] != old_state[4]:
+            changed.update(v for v in (state[4], old_state[4]) if v >= 0)
+
+        # versions whose place in the terse graph might have changed: the
+        # changed ones and their parents, whose number of visible
+        # children might have changed
+        dirty = set()
+        for v in changed:
+            if v not in full.vertices or (v != 0 and v not in am):
+                self.recompute_terse_graph()
+                return
+            dirty.add(v)
+            if v != 0:
+                dirty.add(full.parent(v))
+
+        # the walks start from the closest unchanged ancestors that are
+        # in the terse graph
+        roots = set()
+        for v in dirty:
+            while v != 0:
+                v = full.parent(v)
+                if v in dirty:
+                    break
+                if v in graph.vertices:
+                    roots.add(v)
+                    break
+            else:
+                roots.add(0)
+
+        # parents have lower ids than their children
+        for root in sorted(roots):
+            if root not in graph.vertices:
+                # hidden by the walk from a previous root
+                continue
+            # remove the dirty versions below root, down to the next
+            # unchanged versions
+            region = []
+            boundary = []
+            stack = [root]
+            while stack:
+                for (child, _) in graph.edges_from(stack.pop()):
+                    if child in dirty:
+                        region.append(child)
+                        stack.append(child)
+                    else:
+                        boundary.append(child)
+            for v in boundary:
+                for (parent, edge_id) in graph.edges_to(v)[:]:
+                    graph.delete_edge(parent, v, edge_id)
+            for v in region:
+                graph.delete_vertex(v)
+
+            children = self._get_terse_children(root, full, am)
+            reached = self._walk_terse_graph(
+                    graph, [(child, root) for child in reversed(children)],
+                    full, self.vistrail.has_tag, state[5])
+
+            # unchanged versions that are not reachable anymore
+            stack = [v for v in boundary if v not in reached]
+            while stack:
+                v = stack.pop()
+                stack.extend(child for (child, _) in graph.edges_from(v))
+                graph.delete_vertex(v)
+
+        self._current_full_graph = full
+        self._terse_graph_state = state
+
+    def _get_terse_graph_state(self):
+        """Returns the settings the terse graph depends on, besides the
+        version tree: full_tree, refine, search, num_versions_always_shown,
+        current_version and the latest versions.
+
+        """
+        return (self.full_tree, self.refine, self.search,
+                self.num_versions_always_shown, self.current_version,
+                frozenset(self.vistrail.getLastActions(
+                        self.num_versions_always_shown)))
+
+    def _get_terse_children(self, current, full, am):
+        if current in am and self.vistrail.is_pruned(current):
+            return []
+        return [to for (to, _) in full.adjacency_list[current]
+                if (to in am) and (not self.vistrail.is_pruned(to) or \
+                                       to == self.current_version)]
+
+    def _walk_terse_graph(self, graph, stack, full, has_tag, last_n):
+        """Adds to graph the versions reached from the (version, parent in
+        the terse graph) pairs in stack. The walk stops at the versions
+        that are already in graph; these are returned.
+
+        """
+        am = self.vistrail.actionMap
+        reached = set()
         while 1:
             try:
-                (current,parent)=x.pop()
+                (current,parent)=stack.pop()
             except IndexError:
                 break
 
+            if current in graph.vertices:
+                # unchanged version, its subtree is already there
+                graph.add_edge(parent,current,0)
+                reached.add(current)
+                continue
+
             # mount childs list
-            if current in am and self.vistrail.is_pruned(current):
-                children = []
-            else:
-                children = \
-                    [to for (to, _) in fullVersionTree.adjacency_list[current]
-                     if (to in am) and (not self.vistrail.is_pruned(to) or \
-                                            to == self.current_version)]
+            children = self._get_terse_children(current, full, am)
 
             if (self.full_tree or
                 (current == 0) or  # is root
-                (current in tm) or # hasTag:
+                has_tag(current) or # hasTag:
                 (len(children) <> 1) or # not oneChild:
                 (current == self.current_version) or # isCurrentVersion
                 (am[current].expand) or  # forced expansion
@@ -2784,11 +2902,11 @@ class VistrailController(object):
                      self.search.match(self.vistrail,am[current]) or
                      current == self.current_version)):
                     # add vertex...
-                    tersedVersionTree.add_vertex(current)
+                    graph.add_vertex(current)
 
                     # ...and the parent
                     if parent is not None:
-                        tersedVersionTree.add_edge(parent,current,0)
+                        graph.add_edge(parent,current,0)
 
                     # update the parent info that will be used by the
                     # childs of this node
@@ -2799,10 +2917,8 @@ class VistrailController(object):
                 parentToChildren = parent
 
             for child in reversed(children):
-                x.append((child, parentToChildren))
-
-        self._current_terse_graph = tersedVersionTree
-        self._current_full_graph = self.vistrail.tree.getVersionTree()
+                stack.append((child, parentToChildren))
+        return reached
 
     def save_version_graph(self, filename, tersed=True):
         if tersed:
@@ -4016,5 +4132,72 @@ class VistrailController(object):
                 
         #return module move operations
         return self.move_modules_ops(moves)
-        
-            
+
+
+import unittest
+
+
+class TestVistrailController(unittest.TestCase):
+
+    def assertTerseGraphUpToDate(self, controller):
+        graph = controller._current_terse_graph
+        controller.recompute_terse_graph()
+        expected = controller._current_terse_graph
+        self.assertEqual(set(graph.vertices), set(expected.vertices))
+        self.assertEqual(set(graph.iter_all_edges()),
+                         set(expected.iter_all_edges()))
+
+    def test_update_terse_graph(self):
+        import random
+        from vistrails.core.vistrail.vistrail import Vistrail
+
+        rng = random.Random(4)
+        controller = VistrailController(Vistrail(), None)
+        controller.change_selected_version(0)
+        for i in xrange(150):
+            versions = sorted(controller.vistrail.actionMap)
+            r = rng.random() if versions else 1.0
+            if r < 0.15:
+                controller.change_selected_version(rng.choice([0] + versions))
+                # the current version is picked up by the next update
+                controller.update_terse_graph([])
+            elif r < 0.25:
+                v = rng.choice(versions)
+                controller.vistrail.set_tag(v, 'tag %d' % i)
+                controller.update_terse_graph([v])
+            elif r < 0.3:
+                v = rng.choice(versions)
+                controller.vistrail.set_tag(v, '')
+                controller.update_terse_graph([v])
+            elif r < 0.35:
+                v = rng.choice(versions)
+                controller.vistrail.hideVersion(v)
+                controller.update_terse_graph([v])
+            elif r < 0.4:
+                v = rng.choice(versions)
+                controller.vistrail.showVersion(v)
+                controller.update_terse_graph([v])
+            elif r < 0.45:
+                v = rng.choice(versions)
+                controller.vistrail.expandVersion(v)
+                controller.update_terse_graph([v])
+            else:
+                if controller.vistrail.is_pruned(controller.current_version):
+                    controller.change_selected_version(0)
+                controller.add_module(basic_pkg, 'Float')
+            self.assertTerseGraphUpToDate(controller)
+        self.assertGreater(len(controller.vistrail.actionMap), 50)
+
+    def test_update_terse_graph_settings(self):
+        from vistrails.core.vistrail.vistrail import Vistrail
+
+        controller = VistrailController(Vistrail(), None)
+        controller.change_selected_version(0)
+        for i in xrange(5):
+            controller.add_module(basic_pkg, 'Float')
+        controller.num_versions_always_shown = 3
+        controller.update_terse_graph([])
+        self.assertTerseGraphUpToDate(controller)
+        controller.full_tree = True
+        controller.update_terse_graph([])
+        self.assertEqual(len(controller._current_terse_graph.vertices), 6)
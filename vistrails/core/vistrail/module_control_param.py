@@ -46,6 +46,7 @@ class ModuleControlParam(DBControlParameter):
     WHILE_OUTPUT_KEY = 'while_output'
     WHILE_MAX_KEY = 'while_max'
     WHILE_DELAY_KEY = 'while_delay'
+    LOOP_THREADS_KEY = 'loop_threads'
 
     ##########################################################################
     # Constructors and copy
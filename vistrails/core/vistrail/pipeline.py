@@ -156,6 +156,7 @@ class Pipeline(DBWorkflow):
             self._module_signatures = \
                 Bidict([(k,copy.copy(v))
                         for (k,v) in other._module_signatures.iteritems()])
+        self._signature_parents = None
 
         self.graph = Graph()
         for module in self.module_list:
@@ -271,6 +272,7 @@ class Pipeline(DBWorkflow):
         self._subpipeline_signatures = Bidict()
         self._module_signatures = Bidict()
         self._connection_signatures = Bidict()
+        self._signature_parents = None
 
     def get_tmp_id(self, type):
         """get_tmp_id(type: str) -> long
@@ -403,6 +405,16 @@ class Pipeline(DBWorkflow):
         elif op.vtType == 'change':
             f(op.oldObjId, op.data, op.parentObjType, op.parentObjId)
 
+        # the specialized methods above keep signatures up to date, the
+        # generic db_*_object ones don't know about them
+        if what == ModuleFunction.vtType or \
+                what == ModuleControlParam.vtType:
+            if op.vtType != 'delete':
+                self._add_signature_parents(op.data, op.parentObjType,
+                                            op.parentObjId)
+            self.invalidate_object_signatures(op.parentObjType,
+                                              op.parentObjId)
+
     def add_module(self, m, *args):
         """add_module(m: Module) -> None 
         Add new module to pipeline
@@ -415,13 +427,18 @@ class Pipeline(DBWorkflow):
 #             m.abstraction = self.abstraction_map[m.abstraction_id]
         self.db_add_object(m)
         self.graph.add_vertex(m.id)
+        self.invalidate_signatures([m.id])
+        self._add_signature_parents(m)
 
     def change_module(self, old_id, m, *args):
         if not self.has_module_with_id(old_id):
             raise VistrailsInternalError("module %s doesn't exist" % old_id)
+        self.invalidate_signatures([old_id])
         self.db_change_object(old_id, m)
         self.graph.delete_vertex(old_id)
         self.graph.add_vertex(m.id)
+        self.invalidate_signatures([m.id])
+        self._add_signature_parents(m)
 
     def delete_module(self, id, *args):
         """delete_module(id:int) -> None 
@@ -430,6 +447,7 @@ class Pipeline(DBWorkflow):
         """
         if not self.has_module_with_id(id):
             raise VistrailsInternalError("id missing in modules")
+        self.invalidate_signatures([id])
 
         # we're hiding the necessary operations by doing this!
         for (_, conn_id) in self.graph.adjacency_list[id][:]:
@@ -440,10 +458,6 @@ class Pipeline(DBWorkflow):
         # self.modules.pop(id)
         self.db_delete_object(id, Module.vtType)
         self.graph.delete_vertex(id)
-        if id in self._module_signatures:
-            del self._module_signatures[id]
-        if id in self._subpipeline_signatures:
-            del self._subpipeline_signatures[id]
 
     def add_connection(self, c, *args):
         """add_connection(c: Connection) -> None 
@@ -458,6 +472,7 @@ class Pipeline(DBWorkflow):
             assert(c.sourceId != c.destinationId)        
             self.graph.add_edge(c.sourceId, c.destinationId, c.id)
             self.ensure_connection_specs([c.id])
+            self.invalidate_signatures([c.destinationId])
 
             source_name = c.source.name
             output_ports = self.modules[c.sourceId].connected_output_ports
@@ -481,6 +496,7 @@ class Pipeline(DBWorkflow):
 
         old_conn = self.connections[old_id]
         if old_conn.source is not None and old_conn.destination is not None:
+            self.invalidate_signatures([old_conn.destinationId])
             self.graph.delete_edge(old_conn.sourceId, old_conn.destinationId,
                                    old_conn.id)
             if self.graph.out_degree(old_conn.sourceId) < 1:
@@ -498,6 +514,7 @@ class Pipeline(DBWorkflow):
             assert(c.sourceId != c.destinationId)
             self.graph.add_edge(c.sourceId, c.destinationId, c.id)
             self.ensure_connection_specs([c.id])
+            self.invalidate_signatures([c.destinationId])
             self.modules[c.sourceId].connected_output_ports.add(c.source.name)
             self.modules[c.destinationId].connected_input_ports.add(
                 c.destination.name)
@@ -516,6 +533,7 @@ class Pipeline(DBWorkflow):
         if conn.source is not None and conn.destination is not None and \
                 (conn.destinationId, conn.id) in \
                 self.graph.edges_from(conn.sourceId):
+            self.invalidate_signatures([conn.destinationId])
             self.graph.delete_edge(conn.sourceId, conn.destinationId, conn.id)
 
             c = conn
@@ -527,11 +545,10 @@ class Pipeline(DBWorkflow):
             input_ports = self.modules[c.destinationId].connected_input_ports
             input_ports[dest_name] -= 1
 
-        if id in self._connection_signatures:
-            del self._connection_signatures[id]
-        
     def add_parameter(self, param, parent_type, parent_id):
         self.db_add_object(param, parent_type, parent_id)
+        self._add_signature_parents(param, parent_type, parent_id)
+        self.invalidate_object_signatures(parent_type, parent_id)
         if not self.has_alias(param.alias):
             self.change_alias(param.alias, 
                               param.vtType, 
@@ -543,6 +560,7 @@ class Pipeline(DBWorkflow):
     def delete_parameter(self, param_id, param_type, parent_type, parent_id):
         self.db_delete_object(param_id, ModuleParam.vtType,
                               parent_type, parent_id)
+        self.invalidate_object_signatures(parent_type, parent_id)
         self.remove_alias(ModuleParam.vtType, param_id, parent_type, 
                           parent_id, None)
 
@@ -551,6 +569,8 @@ class Pipeline(DBWorkflow):
                           parent_type, parent_id, None)
         self.db_change_object(old_param_id, param,
                               parent_type, parent_id)
+        self._add_signature_parents(param, parent_type, parent_id)
+        self.invalidate_object_signatures(parent_type, parent_id)
         if not self.has_alias(param.alias):
             self.change_alias(param.alias, 
                               param.vtType, 
@@ -567,6 +587,7 @@ class Pipeline(DBWorkflow):
             self.graph.add_edge(connection.sourceId, 
                                 connection.destinationId, 
                                 connection.id)
+            self.invalidate_signatures([connection.destinationId])
             c = connection
             source_name = c.source.name
             output_ports = self.modules[c.sourceId].connected_output_ports
@@ -583,6 +604,7 @@ class Pipeline(DBWorkflow):
     def delete_port(self, port_id, port_type, parent_type, parent_id):
         conn = self.connections[parent_id]
         if len(conn.ports) >= 2:
+            self.invalidate_signatures([conn.destinationId])
             self.graph.delete_edge(conn.sourceId, 
                                    conn.destinationId, 
                                    conn.id)
@@ -600,6 +622,7 @@ class Pipeline(DBWorkflow):
     def change_port(self, old_port_id, port, parent_type, parent_id):
         connection = self.connections[parent_id]
         if len(connection.ports) >= 2:
+            self.invalidate_signatures([connection.destinationId])
             source_list = self.graph.adjacency_list[connection.sourceId]
             source_list.remove((connection.destinationId, connection.id))
             dest_list = \
@@ -612,6 +635,7 @@ class Pipeline(DBWorkflow):
             dest_list = \
                 self.graph.inverse_adjacency_list[connection.destinationId]
             dest_list.append((connection.sourceId, connection.id))
+            self.invalidate_signatures([connection.destinationId])
 
     def add_port_to_registry(self, portSpec, moduleId):
         m = self.get_module_by_id(moduleId)
@@ -620,6 +644,7 @@ class Pipeline(DBWorkflow):
     def add_portSpec(self, port_spec, parent_type, parent_id):
         # self.db_add_object(port_spec, parent_type, parent_id)
         self.add_port_to_registry(port_spec, parent_id)
+        self.invalidate_signatures([parent_id])
         
     def delete_port_from_registry(self, id, moduleId):
         m = self.get_module_by_id(moduleId)
@@ -628,12 +653,14 @@ class Pipeline(DBWorkflow):
 
     def delete_portSpec(self, spec_id, portSpec_type, parent_type, parent_id):
         self.delete_port_from_registry(spec_id, parent_id)
+        self.invalidate_signatures([parent_id])
         # self.db_delete_object(spec_id, PortSpec.vtType, parent_type, parent_id)
 
     def change_portSpec(self, old_spec_id, port_spec, parent_type, parent_id):
         self.delete_port_from_registry(old_spec_id, parent_id)
         # self.db_change_object(old_spec_id, port_spec, parent_type, parent_id)
         self.add_port_to_registry(port_spec, parent_id)
+        self.invalidate_signatures([parent_id])
 
     def add_alias(self, name, type, oId, parentType, parentId, mId):
         """add_alias(name: str, oId: int, parentType:str, parentId: int, 
@@ -727,6 +754,7 @@ class Pipeline(DBWorkflow):
                 #FIXME: check if a change parameter action needs to be generated
                 parameter = self.db_get_object(what, oId)
                 parameter.strValue = str(value)
+                self.invalidate_object_signatures(parentType, parentId)
             else:
                 raise VistrailsInternalError("only parameters are supported")
         
@@ -874,19 +902,134 @@ class Pipeline(DBWorkflow):
         return signature in self._connection_signatures.inverse
 
     def refresh_signatures(self):
-        self._connection_signatures = {}
-        self._subpipeline_signatures = {}
-        self._module_signatures = {}
+        self.invalidate_signatures()
         self.compute_signatures()
 
+    def refresh_constant_signatures(self):
+        """refresh_constant_signatures() -> [int]
+        Recomputes the signatures of the modules whose parameters use a
+        custom constant hasher (e.g. files, whose signature changes when
+        they are modified on disk) and invalidates the signatures of the
+        ones that changed. Returns the ids of these modules."""
+        registry = get_module_registry()
+        changed = []
+        for module_id, sig in self._module_signatures.items():
+            m = self.modules.get(module_id)
+            if m is None or not registry.has_constant_hasher(m):
+                continue
+            if registry.module_signature(self, m) != sig:
+                changed.append(module_id)
+        if changed:
+            self.invalidate_signatures(changed)
+        return changed
+
     def compute_signatures(self):
         """compute_signatures(): compute all module and subpipeline signatures
-        for this pipeline."""
+        for this pipeline.
+
+        Only the signatures that are not known yet are computed; the ones
+        affected by changes to the pipeline have been discarded by
+        invalidate_signatures()."""
         for i in self.modules.iterkeys():
             self.subpipeline_signature(i)
         for c in self.connections.iterkeys():
             self.connection_signature(c)
 
+    # Invalidation
+
+    def invalidate_signatures(self, module_ids=None):
+        """invalidate_signatures(module_ids: [int]) -> None
+        Discards the signatures of the given modules, of the subpipelines
+        downstream of them and of the connections feeding these
+        subpipelines. Every signature is discarded if module_ids is None."""
+        if module_ids is None:
+            self._connection_signatures = Bidict()
+            self._subpipeline_signatures = Bidict()
+            self._module_signatures = Bidict()
+            return
+        module_sigs = self._module_signatures
+        subpipeline_sigs = self._subpipeline_signatures
+        connection_sigs = self._connection_signatures
+        vertices = self.graph.vertices
+        visited = set()
+        to_visit = []
+        for module_id in module_ids:
+            if module_id in module_sigs:
+                del module_sigs[module_id]
+            if module_id in vertices:
+                to_visit.append(module_id)
+        while to_visit:
+            module_id = to_visit.pop()
+            if module_id in visited:
+                continue
+            visited.add(module_id)
+            if module_id in subpipeline_sigs:
+                del subpipeline_sigs[module_id]
+            for (_, conn_id) in self.graph.edges_to(module_id):
+                if conn_id in connection_sigs:
+                    del connection_sigs[conn_id]
+            to_visit.extend(m for (m, _) in self.graph.edges_from(module_id))
+
+    def invalidate_object_signatures(self, obj_type, obj_id):
+        """invalidate_object_signatures(obj_type: str, obj_id: int) -> None
+        Discards the signatures that depend on the given module, function,
+        parameter, control parameter or connection (see
+        invalidate_signatures)."""
+        module_id = self._find_signature_module(obj_type, obj_id)
+        if module_id is None and self._signature_parents is not None:
+            # index might be out of date, eg if the pipeline was edited
+            # directly instead of through actions
+            self._signature_parents = None
+            module_id = self._find_signature_module(obj_type, obj_id)
+        if module_id is not None:
+            self.invalidate_signatures([module_id])
+
+    def _find_signature_module(self, obj_type, obj_id):
+        if obj_type == Module.vtType or obj_type == Abstraction.vtType or \
+                obj_type == Group.vtType:
+            if obj_id in self.modules:
+                return obj_id
+            return None
+        elif obj_type == Connection.vtType:
+            if obj_id in self.connections:
+                connection = self.connections[obj_id]
+                if connection.destination is not None:
+                    return connection.destinationId
+            return None
+        parents = self._get_signature_parents()
+        if (obj_type, obj_id) not in parents:
+            return None
+        return self._find_signature_module(*parents[(obj_type, obj_id)])
+
+    def _get_signature_parents(self):
+        """Returns the index mapping functions, parameters and control
+        parameters to their parent object, building it if needed."""
+        if self._signature_parents is None:
+            self._signature_parents = {}
+            for module in self.module_list:
+                self._add_signature_parents(module)
+        return self._signature_parents
+
+    def _add_signature_parents(self, obj, parent_type=None, parent_id=None):
+        parents = self._signature_parents
+        if parents is None:
+            return
+        if obj.vtType == ModuleParam.vtType:
+            parents[(obj.vtType, obj.real_id)] = (parent_type, parent_id)
+        elif obj.vtType == ModuleFunction.vtType:
+            parents[(obj.vtType, obj.real_id)] = (parent_type, parent_id)
+            for param in obj.params:
+                parents[(param.vtType, param.real_id)] = (obj.vtType,
+                                                          obj.real_id)
+        elif obj.vtType == ModuleControlParam.vtType:
+            parents[(obj.vtType, obj.id)] = (parent_type, parent_id)
+        elif obj.vtType in (Module.vtType, Abstraction.vtType, Group.vtType):
+            for function in obj.functions:
+                self._add_signature_parents(function, obj.vtType, obj.id)
+            for control_param in obj.control_parameters:
+                self._add_signature_parents(control_param, obj.vtType,
+                                            obj.id)
+
     def get_subpipeline(self, module_set):
         """get_subpipeline([module_id] or subgraph) -> Pipeline
 
@@ -1508,6 +1651,93 @@ class TestPipeline(unittest.TestCase):
         self.assertNotEquals(c_sig_size_before, c_sig_size_after)
         self.assertNotEquals(p_sig_size_before, p_sig_size_after)
 
+    def test_incremental_signatures(self):
+        """Makes sure only the downstream closure of a change is rehashed."""
+        from vistrails.core.vistrail.operation import ChangeOp, DeleteOp
+        id_scope = IdScope()
+        # copying indexes the functions and parameters
+        p = copy.copy(self.create_default_pipeline(id_scope))
+        (m1, m2, m3) = sorted(p.modules)
+        old_sigs = dict((m, p.subpipeline_signature(m)) for m in p.modules)
+
+        function = p.modules[m2].functions[0]
+        param = ModuleParam(id=id_scope.getNewId(ModuleParam.vtType),
+                            type='String',
+                            val='-')
+        p.perform_operation(ChangeOp(
+                id=id_scope.getNewId(ChangeOp.vtType),
+                what=ModuleParam.vtType,
+                oldObjId=function.params[0].real_id,
+                newObjId=param.real_id,
+                parentObjId=function.real_id,
+                parentObjType=ModuleFunction.vtType,
+                data=param))
+        self.assertIn(m1, p._subpipeline_signatures)
+        self.assertNotIn(m2, p._module_signatures)
+        self.assertNotIn(m2, p._subpipeline_signatures)
+        self.assertNotIn(m3, p._subpipeline_signatures)
+        self.assertEqual(len(p._connection_signatures), 0)
+        p.compute_signatures()
+        new_sigs = dict((m, p.subpipeline_signature(m)) for m in p.modules)
+        self.assertEqual(new_sigs[m1], old_sigs[m1])
+        self.assertNotEqual(new_sigs[m2], old_sigs[m2])
+        self.assertNotEqual(new_sigs[m3], old_sigs[m3])
+
+        # incremental signatures match the ones computed from scratch
+        p2 = copy.copy(p)
+        p2.refresh_signatures()
+        for m in p.modules:
+            self.assertEqual(p.subpipeline_signature(m),
+                             p2.subpipeline_signature(m))
+
+        (c1, c2) = sorted(p.connections)
+        p.perform_operation(DeleteOp(id=id_scope.getNewId(DeleteOp.vtType),
+                                     what=Connection.vtType,
+                                     objectId=c2))
+        self.assertIn(m1, p._subpipeline_signatures)
+        self.assertIn(m2, p._subpipeline_signatures)
+        self.assertNotIn(m3, p._subpipeline_signatures)
+        p.compute_signatures()
+        self.assertNotEqual(p.subpipeline_signature(m3), new_sigs[m3])
+
+    def test_constant_signatures(self):
+        """Makes sure file signatures are refreshed when the file changes."""
+        import os
+        import tempfile
+        from vistrails.core.cache.path_fingerprint import \
+            get_path_fingerprinter
+        basic_pkg = get_vistrails_basic_pkg_id()
+        (fd, fname) = tempfile.mkstemp(prefix='vt_signature')
+        os.close(fd)
+        try:
+            os.utime(fname, (1000000000, 1000000000))
+            id_scope = IdScope()
+            param = ModuleParam(id=id_scope.getNewId(ModuleParam.vtType),
+                                type='File',
+                                identifier=basic_pkg,
+                                val=fname)
+            function = ModuleFunction(
+                    id=id_scope.getNewId(ModuleFunction.vtType),
+                    name='name',
+                    parameters=[param])
+            m = Module(id=id_scope.getNewId(Module.vtType),
+                       package=basic_pkg,
+                       name='File',
+                       functions=[function])
+            p = Pipeline(id=id_scope.getNewId(Pipeline.vtType),
+                         modules=[m])
+            get_path_fingerprinter().new_execution()
+            sig = p.subpipeline_signature(m.id)
+            self.assertEqual(p.refresh_constant_signatures(), [])
+
+            os.utime(fname, (1000000010, 1000000010))
+            self.assertEqual(p.refresh_constant_signatures(), [])
+            get_path_fingerprinter().new_execution()
+            self.assertEqual(p.refresh_constant_signatures(), [m.id])
+            self.assertNotEqual(p.subpipeline_signature(m.id), sig)
+        finally:
+            os.remove(fname)
+
     def test_delete_connections(self):
         p = self.create_default_pipeline()
         p.delete_connection(0)
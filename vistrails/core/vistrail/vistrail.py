@@ -37,8 +37,9 @@ from vistrails.core.paramexplore.paramexplore import ParameterExploration
 import copy
 import datetime
 import getpass
+import heapq
 
-from vistrails.db.domain import DBVistrail
+from vistrails.db.domain import DBVistrail, DBAbstraction, DBGroup
 from vistrails.db.services.io import open_vt_log_from_db, open_log_from_xml
 from vistrails.core.db.locator import DBLocator
 from vistrails.core.log.log import Log
@@ -122,6 +123,8 @@ class Vistrail(DBVistrail):
         # add all versions to the trees
         for action in sorted(self.actions, key=lambda a: a.id):
             self.tree.addVersion(action.id, action.prevId)
+        # search index is built on first use
+        self._search_index = None
 
     @staticmethod
     def convert(_vistrail):
@@ -632,14 +635,10 @@ class Vistrail(DBVistrail):
         """ getLastActions(n: int) -> list of ids
         Returns the last n actions performed
         """
-        last_n = []
-        num_actions = len(self.actionMap)
-        if num_actions < n:
-            n = num_actions
-        if n > 0:
-            sorted_keys = sorted(self.actionMap.keys())
-            last_n = sorted_keys[num_actions-n:num_actions-1]
-        return last_n
+        if n <= 1:
+            return []
+        # the n highest ids, in increasing order, except the highest
+        return heapq.nlargest(n, self.actionMap)[:0:-1]
 
     def hasVersion(self, version):
         """hasVersion(version:int) -> boolean
@@ -661,6 +660,18 @@ class Vistrail(DBVistrail):
 
         # signal to update explicit tree
         self.tree.addVersion(action.id, action.prevId)
+        if self._search_index is not None:
+            self._search_index.add_version(action)
+
+    def get_search_index(self):
+        """get_search_index() -> VersionSearchIndex
+        Returns the index used to answer version queries, building it
+        the first time it is requested
+
+        """
+        if self._search_index is None:
+            self._search_index = VersionSearchIndex(self)
+        return self._search_index
 
     def hasTag(self, tag):
         """ hasTag(tag) -> boolean 
@@ -715,6 +726,8 @@ class Vistrail(DBVistrail):
     def delete_action_annotation(self, action_id, key):
         annotation = self.get_action_annotation(action_id, key)
         self.db_delete_actionAnnotation(annotation)
+        if self._search_index is not None:
+            self._search_index.set_annotation(action_id, key, None)
 
     def set_action_annotation(self, action_id, key, value):
         changed = False
@@ -737,6 +750,11 @@ class Vistrail(DBVistrail):
             changed = True
         if changed:
             self.changed = True
+            if self._search_index is not None:
+                if value is not None and value.strip() != '':
+                    self._search_index.set_annotation(action_id, key, value)
+                else:
+                    self._search_index.set_annotation(action_id, key, None)
             return True
         return False
 
@@ -1142,17 +1160,26 @@ class Vistrail(DBVistrail):
     class InvalidAbstraction(Exception):
         pass
 
-    def get_persisted_log(self):
+    def get_persisted_log(self, version=None):
         """
         Returns the log object for this vistrail if available
+        If version is given, only the executions of that version are read
         """
         log = Log()
         if isinstance(self.locator, vistrails.core.db.locator.ZIPFileLocator):
             if self.db_log_filename is not None:
-                log = open_log_from_xml(self.db_log_filename, True)
+                if version is not None:
+                    log = open_log_from_xml(self.db_log_filename, True,
+                                            [version])
+                else:
+                    log = open_log_from_xml(self.db_log_filename, True)
         if isinstance(self.locator, vistrails.core.db.locator.DBLocator):
             connection = self.locator.get_connection()
             log = open_vt_log_from_db(connection, self.db_id)
+            if version is not None:
+                for workflow_exec in list(log.db_workflow_execs):
+                    if workflow_exec.db_parent_version != version:
+                        log.db_delete_workflow_exec(workflow_exec)
         Log.convert(log)
         return log
     
@@ -1188,7 +1215,224 @@ class ExplicitExpandedVersionTree(object):
     
     def getVersionTree(self):
         return self.expandedVersionTree
-        
+
+class VersionSearchIndex(object):
+    """
+    Inverted index from module names, users, notes and tags to the
+    versions that have them, so that version queries do not need to
+    materialize pipelines. It is kept up to date by the vistrail as
+    versions and annotations are added; generation is incremented on
+    every change.
+
+    The structure of every version is also summarized as the counts of
+    its module names and of its (source name, destination name)
+    connections, see module_counts() and connection_counts().
+    """
+    module_types = set([Module.vtType, DBAbstraction.vtType, DBGroup.vtType])
+    connection_type = 'connection'
+    port_type = 'port'
+
+    def __init__(self, vistrail):
+        self.vistrail = vistrail
+        self.generation = 0
+        self.users = {}
+        self.modules = {}
+        self.annotations = {Vistrail.TAG_ANNOTATION: {},
+                            Vistrail.NOTES_ANNOTATION: {}}
+        self._annotation_values = {Vistrail.TAG_ANNOTATION: {},
+                                   Vistrail.NOTES_ANNOTATION: {}}
+        # module name and connection counts of every version's
+        # pipeline; versions that do not touch them share their
+        # parent's dicts
+        self._module_counts = {0: {}}
+        self._connection_counts = {0: {}}
+        self._module_names = {}
+        # connection id -> (source module id, destination module id) in
+        # every version's pipeline, shared the same way; the ports of a
+        # connection can be changed differently on each branch
+        self._connections = {0: {}}
+
+        for action in vistrail.actions:
+            self._add_action(action)
+        for annotation in vistrail.action_annotations:
+            if annotation.key in self.annotations:
+                self._set_annotation(annotation.action_id, annotation.key,
+                                     annotation.value)
+
+    def add_version(self, action):
+        self._add_action(action)
+        self.generation += 1
+
+    def set_annotation(self, action_id, key, value):
+        """set_annotation(action_id, key, value) -> None
+        Records the new value of an action annotation, None meaning
+        it was removed
+
+        """
+        if key in self.annotations:
+            self._set_annotation(action_id, key, value)
+            self.generation += 1
+
+    def module_counts(self, version):
+        """module_counts(version) -> dict
+        Returns the number of modules of each name in the version's
+        pipeline; the dict must not be modified
+
+        """
+        return self._module_counts[version]
+
+    def connection_counts(self, version):
+        """connection_counts(version) -> dict
+        Returns the number of connections in the version's pipeline for
+        each pair of (source module name, destination module name); the
+        dict must not be modified
+
+        """
+        return self._connection_counts[version]
+
+    def find_users(self, match):
+        return self._find(self.users, match)
+
+    def find_modules(self, match):
+        return self._find(self.modules, match)
+
+    def find_tags(self, match):
+        return self._find(self.annotations[Vistrail.TAG_ANNOTATION], match)
+
+    def find_notes(self, match):
+        return self._find(self.annotations[Vistrail.NOTES_ANNOTATION], match)
+
+    @staticmethod
+    def _find(index, match):
+        """_find(index, match) -> set(version)
+        Returns the versions of every key for which match(key) is true
+
+        """
+        versions = set()
+        for key, key_versions in index.iteritems():
+            if match(key):
+                versions.update(key_versions)
+        return versions
+
+    def _add_action(self, action):
+        if action.id in self._module_counts:
+            return
+        # index unseen ancestors first so the parent's counts exist
+        pending = [action]
+        while pending[-1].prevId not in self._module_counts:
+            pending.append(self.vistrail.actionMap[pending[-1].prevId])
+        for a in reversed(pending):
+            if a.user:
+                self.users.setdefault(a.user, set()).add(a.id)
+            self._apply_operations(a)
+            for name in self._module_counts[a.id]:
+                self.modules.setdefault(name, set()).add(a.id)
+
+    def _apply_operations(self, action):
+        modules = self._module_counts[action.prevId]
+        connections = self._connection_counts[action.prevId]
+        endpoints = self._connections[action.prevId]
+        copied_modules = copied_connections = False
+        for op in action.operations:
+            if op.what in self.module_types:
+                if not copied_modules:
+                    modules = dict(modules)
+                    copied_modules = True
+                if op.vtType == 'add':
+                    self._add_module(modules, op.objectId, op.data)
+                elif op.vtType == 'delete':
+                    self._decrement(modules, self._module_names[op.objectId])
+                elif op.vtType == 'change':
+                    self._decrement(modules, self._module_names[op.oldObjId])
+                    self._add_module(modules, op.newObjId, op.data)
+            elif (op.what == self.connection_type or
+                  (op.what == self.port_type and
+                   op.parentObjType == self.connection_type)):
+                if not copied_connections:
+                    connections = dict(connections)
+                    endpoints = dict(endpoints)
+                    copied_connections = True
+                self._apply_connection_operation(connections, endpoints, op)
+        self._module_counts[action.id] = modules
+        self._connection_counts[action.id] = connections
+        self._connections[action.id] = endpoints
+
+    def _apply_connection_operation(self, counts, connections, op):
+        if op.what == self.port_type:
+            connection_id = op.parentObjId
+        elif op.vtType == 'change':
+            connection_id = op.oldObjId
+        else:
+            connection_id = op.objectId
+        # the endpoints valid in the parent version are removed
+        old_endpoints = connections.pop(connection_id, None)
+        if (old_endpoints is not None and
+                not (op.what == self.connection_type and op.vtType == 'add')):
+            self._remove_connection(counts, old_endpoints)
+        if op.what == self.port_type:
+            # a single endpoint of an existing connection is replaced
+            endpoints = list(old_endpoints or (None, None))
+            if op.vtType == 'delete':
+                port = None
+            else:
+                port = op.data
+            if port is not None:
+                endpoints[port.db_type == 'destination'] = port.db_moduleId
+            connections[connection_id] = tuple(endpoints)
+            self._add_connection(counts, connections[connection_id])
+        elif op.vtType != 'delete':
+            endpoints = [None, None]
+            if op.data is not None:
+                for port in op.data.db_ports:
+                    endpoints[port.db_type == 'destination'] = \
+                        port.db_moduleId
+            if op.vtType == 'change':
+                connection_id = op.newObjId
+            connections[connection_id] = tuple(endpoints)
+            self._add_connection(counts, connections[connection_id])
+
+    def _connection_key(self, endpoints):
+        source, destination = endpoints
+        if source is None or destination is None:
+            return None
+        return (self._module_names.get(source),
+                self._module_names.get(destination))
+
+    def _add_connection(self, counts, endpoints):
+        key = self._connection_key(endpoints)
+        if key is not None:
+            counts[key] = counts.get(key, 0) + 1
+
+    def _remove_connection(self, counts, endpoints):
+        key = self._connection_key(endpoints)
+        if key is not None and key in counts:
+            self._decrement(counts, key)
+
+    def _add_module(self, counts, module_id, module):
+        if module is not None:
+            self._module_names[module_id] = module.name
+        name = self._module_names[module_id]
+        counts[name] = counts.get(name, 0) + 1
+
+    @staticmethod
+    def _decrement(counts, key):
+        if counts[key] == 1:
+            del counts[key]
+        else:
+            counts[key] -= 1
+
+    def _set_annotation(self, action_id, key, value):
+        index = self.annotations[key]
+        values = self._annotation_values[key]
+        if action_id in values:
+            old_value = values.pop(action_id)
+            index[old_value].discard(action_id)
+            if not index[old_value]:
+                del index[old_value]
+        if value is not None:
+            values[action_id] = value
+            index.setdefault(value, set()).add(action_id)
+
 ##############################################################################
 
 class VersionAlreadyTagged(Exception):
@@ -1253,6 +1497,88 @@ class TestVistrail(unittest.TestCase):
         vistrail.addTag('second action', action2.id)
         return vistrail
 
+    def test_search_index(self):
+        vistrail = self.create_vistrail()
+        index = vistrail.get_search_index()
+        action1 = vistrail.get_tag_str('first action').action_id
+        action2 = vistrail.get_tag_str('second action').action_id
+        self.assertEqual(index.find_modules(lambda n: n == 'Float'),
+                         set([action1, action2]))
+        generation = index.generation
+
+        module_id = vistrail.getPipeline(action1).modules.keys()[0]
+        delete_op = DeleteOp(id=vistrail.idScope.getNewId(DeleteOp.vtType),
+                             what=Module.vtType,
+                             objectId=module_id)
+        action3 = Action(id=vistrail.idScope.getNewId(Action.vtType),
+                         operations=[delete_op])
+        vistrail.add_action(action3, action2)
+        vistrail.set_tag(action3.id, 'third action')
+        vistrail.set_tag(action1, None)
+        self.assertTrue(index.generation > generation)
+        self.assertEqual(index.find_modules(lambda n: n == 'Float'),
+                         set([action1, action2]))
+        self.assertEqual(index.find_tags(lambda t: t.endswith('action')),
+                         set([action2, action3.id]))
+        self.assertEqual(index.find_users(lambda u: True),
+                         set([action1, action2, action3.id]))
+
+    def test_search_index_connection_branches(self):
+        """Ports changed on one branch don't affect the other branches."""
+        from vistrails.core.vistrail.connection import Connection
+        from vistrails.core.vistrail.port import Port
+
+        vistrail = Vistrail()
+        id_scope = vistrail.idScope
+        def new_op(op_class, **kwargs):
+            return op_class(id=id_scope.getNewId(op_class.vtType), **kwargs)
+        def new_action(parent, *operations):
+            action = Action(id=id_scope.getNewId(Action.vtType),
+                            operations=list(operations))
+            vistrail.add_action(action, parent)
+            return action.id
+        def new_port(type, module):
+            return Port(id=id_scope.getNewId(Port.vtType), type=type,
+                        moduleId=module.id, moduleName=module.name,
+                        name='value')
+
+        modules = [Module(id=id_scope.getNewId(Module.vtType), name=name,
+                          package=get_vistrails_basic_pkg_id())
+                   for name in ('Float', 'Integer', 'String')]
+        source = new_port('source', modules[0])
+        destination = new_port('destination', modules[1])
+        connection = Connection(id=id_scope.getNewId(Connection.vtType),
+                                ports=[source, destination])
+        index = vistrail.get_search_index()
+        base = new_action(0, *([new_op(AddOp, what=Module.vtType,
+                                       objectId=m.id, data=m)
+                                for m in modules] +
+                               [new_op(AddOp, what='connection',
+                                       objectId=connection.id,
+                                       data=connection)]))
+        # one branch moves the destination to the String module
+        new_destination = new_port('destination', modules[2])
+        moved = new_action(base, new_op(ChangeOp, what='port',
+                                        oldObjId=destination.id,
+                                        newObjId=new_destination.id,
+                                        parentObjId=connection.id,
+                                        parentObjType='connection',
+                                        data=new_destination))
+        # the other deletes the connection
+        deleted = new_action(base, new_op(DeleteOp, what='connection',
+                                          objectId=connection.id))
+        self.assertEqual(index.connection_counts(base),
+                         {('Float', 'Integer'): 1})
+        self.assertEqual(index.connection_counts(moved),
+                         {('Float', 'String'): 1})
+        self.assertEqual(index.connection_counts(deleted), {})
+
+        # same result when the branches are indexed in one go
+        index = VersionSearchIndex(vistrail)
+        self.assertEqual(index.connection_counts(moved),
+                         {('Float', 'String'): 1})
+        self.assertEqual(index.connection_counts(deleted), {})
+
     def test_get_tag_str(self):
         v = self.create_vistrail()
         self.failUnlessRaises(KeyError, lambda: v.get_tag_str('not here'))
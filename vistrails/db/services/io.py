@@ -46,7 +46,9 @@ from vistrails.core.modules.sub_module import get_cur_abs_namespace,\
 import vistrails.core.requirements
 
 import os.path
+import posixpath
 import shutil
+import StringIO
 import tempfile
 import copy
 import zipfile
@@ -62,6 +64,14 @@ import vistrails.db.services.prov
 import vistrails.db.services.registry
 import vistrails.db.services.workflow
 import vistrails.db.services.vistrail
+from vistrails.db.services.journal import JOURNAL_DIR, JournalState, \
+    apply_segment, digest, get_changes, parse_deleted, serialize_deleted, \
+    take_snapshot
+from vistrails.db.services.log_index import get_log_index, \
+    discard_log_index
+from vistrails.db.services.lazy_zip import ZipMembers, LazyMemberList, \
+    register_archive, extract_member, extract_directory, discard_directory, \
+    update_archive
 from vistrails.db.versions import getVersionDAO, currentVersion, getVersionSchemaDir, \
     translate_vistrail, translate_workflow, translate_log, translate_registry
 
@@ -579,10 +589,12 @@ def open_bundle_from_zip_xml(bundle_type, filename):
         raise VistrailsDBException("cannot open bundle of type '%s' from zip" %\
                                        bundle_type)
 
-def save_bundle_to_zip_xml(save_bundle, filename, tmp_dir=None, version=None):
+def save_bundle_to_zip_xml(save_bundle, filename, tmp_dir=None, version=None,
+                           incremental=False):
     bundle_type = save_bundle.bundle_type
     if bundle_type == DBVistrail.vtType:
-        return save_vistrail_bundle_to_zip_xml(save_bundle, filename, tmp_dir, version)
+        return save_vistrail_bundle_to_zip_xml(save_bundle, filename, tmp_dir,
+                                               version, incremental)
     elif bundle_type == DBLog.vtType:
         return save_log_bundle_to_xml(save_bundle, filename, version)
     elif bundle_type == DBWorkflow.vtType:
@@ -653,6 +665,8 @@ def close_zip_xml(temp_dir):
     """
     if temp_dir is None:
         return
+    discard_directory(temp_dir)
+    discard_log_index(os.path.join(temp_dir, 'log'))
     if not os.path.isdir(temp_dir):
         if os.path.isfile(temp_dir):
             os.remove(temp_dir)
@@ -706,44 +720,48 @@ def open_vistrail_bundle_from_zip_xml(filename):
     abstractions inside archive have prefix 'abstraction_',
     and thumbnails inside archive are '.png' files in 'thumbs' dir
 
+    The vistrail and mashups are read directly from the archive. The log,
+    abstractions and thumbnails are only extracted to the returned
+    directory when they are first accessed (see
+    vistrails.db.services.lazy_zip).
+
     """
     vt_save_dir = tempfile.mkdtemp(prefix='vt_save')
-
-    z = zipfile.ZipFile(filename)
-    try:
-        z.extractall(vt_save_dir)
-    finally:
-        z.close()
+    members = ZipMembers(filename, vt_save_dir)
 
     vistrail = None
     log = None
     log_fname = None
-    abstraction_files = []
+    abstraction_files = LazyMemberList()
     unknown_files = []
-    thumbnail_files = []
+    thumbnail_files = LazyMemberList()
     mashups = []
+    package_files = []
+    segments = {}
     try:
-        for root, dirs, files in os.walk(vt_save_dir):
-            for fname in files:
-                if fname == 'vistrail' and root == vt_save_dir:
-                    vistrail = open_vistrail_from_xml(os.path.join(root, fname))
-                elif fname == 'log' and root == vt_save_dir:
+        z = zipfile.ZipFile(filename)
+        try:
+            names = z.namelist()
+            for name in names:
+                if name.endswith('/'):
+                    continue
+                (dirname, fname) = posixpath.split(name)
+                if name.startswith(JOURNAL_DIR + '/'):
+                    (_, segment, part) = name.split('/', 2)
+                    segments.setdefault(segment, {})[part] = name
+                elif fname == 'vistrail' and not dirname:
+                    vistrail = open_vistrail_from_xml(z.open(name))
+                elif fname == 'log' and not dirname:
                     # FIXME read log to get execution info
                     # right now, just ignore the file
-                    log = None 
-                    log_fname = os.path.join(root, fname)
-                    # log = open_log_from_xml(os.path.join(root, fname))
-                    # objs.append(DBLog.vtType, log)
+                    log = None
+                    log_fname = members.add(name)
                 elif fname.startswith('abstraction_'):
-                    abstraction_file = os.path.join(root, fname)
-                    abstraction_files.append(abstraction_file)
-                elif (fname.endswith('.png') and
-                      root == os.path.join(vt_save_dir,'thumbs')):
-                    thumbnail_file = os.path.join(root, fname)
-                    thumbnail_files.append(thumbnail_file)
-                elif root == os.path.join(vt_save_dir,'mashups'):
-                    mashup_file = os.path.join(root, fname)
-                    mashup = open_mashuptrail_from_xml(mashup_file)
+                    abstraction_files.append(members.add(name))
+                elif fname.endswith('.png') and dirname == 'thumbs':
+                    thumbnail_files.append(members.add(name))
+                elif dirname == 'mashups':
+                    mashup = open_mashuptrail_from_xml(z.open(name))
                     mashups.append(mashup)
                 else:
                     handled = False
@@ -753,8 +771,20 @@ def open_vistrail_bundle_from_zip_xml(filename):
                         if package.can_handle_vt_file(fname):
                             handled = True
                             continue
-                    if not handled:
-                        unknown_files.append(os.path.join(root, fname))
+                    if handled:
+                        package_files.append(name)
+                    else:
+                        unknown_files.append(os.path.join(vt_save_dir,
+                                                          *name.split('/')))
+            # package hooks read their files from vt_save_dir
+            for name in package_files:
+                z.extract(name, vt_save_dir)
+            if vistrail is not None and segments:
+                log_fname = _apply_journal(z, sorted(segments.iteritems()),
+                                           vistrail, mashups, members,
+                                           log_fname)
+        finally:
+            z.close()
     except OSError, e:
         raise VistrailsDBException("Error when reading vt file")
     if len(unknown_files) > 0:
@@ -762,7 +792,14 @@ def open_vistrail_bundle_from_zip_xml(filename):
                                        unknown_files)
     if vistrail is None:
         raise VistrailsDBException("vt file does not contain vistrail")
+    register_archive(members)
     vistrail.db_log_filename = log_fname
+    if _journaling_enabled():
+        vistrail._journal_state = JournalState(
+            filename, vistrail,
+            dict((str(m.id), digest(_serialize_mashuptrail(m)))
+                 for m in mashups),
+            names, len(segments), _fingerprint_xml)
 
     # call package hooks
     from vistrails.core.packagemanager import get_package_manager
@@ -775,6 +812,51 @@ def open_vistrail_bundle_from_zip_xml(filename):
                              thumbnails=thumbnail_files, mashups=mashups)
     return (save_bundle, vt_save_dir)
 
+def _apply_journal(z, segments, vistrail, mashups, members, log_fname):
+    """Replays the journal segments of an archive on its vistrail.
+
+    Returns the log filename, as the log can also start in a segment.
+
+    """
+    for (_, parts) in segments:
+        journal_vistrail = None
+        deleted = []
+        if 'vistrail' in parts:
+            journal_vistrail = open_vistrail_from_xml(z.open(parts['vistrail']))
+        if 'deleted' in parts:
+            deleted = parse_deleted(z.read(parts['deleted']))
+        apply_segment(vistrail, journal_vistrail, deleted)
+        if 'log' in parts:
+            if log_fname is None:
+                log_fname = os.path.join(members.directory, 'log')
+            members.add(parts['log'], log_fname)
+        for (part, name) in parts.iteritems():
+            if part.startswith('mashups/'):
+                mashup = open_mashuptrail_from_xml(z.open(name))
+                mashups[:] = [m for m in mashups if str(m.id) != str(mashup.id)]
+                mashups.append(mashup)
+    vistrails.db.services.vistrail.update_id_scope(vistrail)
+    return log_fname
+
+def _journaling_enabled():
+    """_journaling_enabled() -> bool
+    Tells whether archives are saved incrementally ('incrementalSave'
+    configuration option), and so need to remember what they contain.
+
+    """
+    from vistrails.core.configuration import get_vistrails_configuration
+    conf = get_vistrails_configuration()
+    return conf is not None and bool(conf.check('incrementalSave'))
+
+def _fingerprint_xml(obj):
+    daoList = getVersionDAO(currentVersion)
+    return digest(ElementTree.tostring(daoList.write_xml_object(obj)))
+
+def _serialize_mashuptrail(mashuptrail):
+    f = StringIO.StringIO()
+    save_mashuptrail_to_xml(mashuptrail, f)
+    return f.getvalue()
+
 def open_vistrail_bundle_from_db(db_connection, vistrail_id, tmp_dir=None):
     """open_vistrail_bundle_from_db(db_connection, id: long, tmp_dir: str) -> SaveBundle
        Open a vistrail bundle from the database.
@@ -857,14 +939,18 @@ def save_vistrail_to_xml(vistrail, filename, version=None):
     vistrail.db_currentVersion = current_action
     return vistrail
 
-def save_vistrail_bundle_to_zip_xml(save_bundle, filename, vt_save_dir=None, version=None):
+def save_vistrail_bundle_to_zip_xml(save_bundle, filename, vt_save_dir=None,
+                                    version=None, incremental=False):
     """save_vistrail_bundle_to_zip_xml(save_bundle: SaveBundle, filename: str,
-                                vt_save_dir: str, version: str)
+                                vt_save_dir: str, version: str,
+                                incremental: bool)
          -> (save_bundle: SaveBundle, vt_save_dir: str)
 
     save_bundle: a SaveBundle object containing vistrail data to save
     filename: filename to save to
     vt_save_dir: directory storing any previous files
+    incremental: append the changes to filename as a journal segment if
+                 possible, instead of rewriting it
 
     Generates a zip compressed version of vistrail.
     It raises an Exception if there was an error.
@@ -874,8 +960,17 @@ def save_vistrail_bundle_to_zip_xml(save_bundle, filename, vt_save_dir=None, ver
     if save_bundle.vistrail is None:
         raise VistrailsDBException('save_vistrail_bundle_to_zip_xml failed, '
                                    'bundle does not contain a vistrail')
+    if incremental:
+        result = append_vistrail_bundle_to_zip_xml(save_bundle, filename,
+                                                   vt_save_dir, version)
+        if result is not None:
+            return result
     if not vt_save_dir:
         vt_save_dir = tempfile.mkdtemp(prefix='vt_save')
+    else:
+        # the whole directory gets zipped, including members of the archive
+        # it was opened from that were not needed so far
+        extract_directory(vt_save_dir)
     # abstractions are saved in the root of the zip file
     # abstraction_dir = os.path.join(vt_save_dir, 'abstractions')
     #thumbnails and mashups have their own folder
@@ -890,6 +985,7 @@ def save_vistrail_bundle_to_zip_xml(save_bundle, filename, vt_save_dir=None, ver
     if save_bundle.vistrail.db_log_filename is not None:
         xml_fname = os.path.join(vt_save_dir, 'log')
         if save_bundle.vistrail.db_log_filename != xml_fname:
+            extract_member(save_bundle.vistrail.db_log_filename)
             shutil.copyfile(save_bundle.vistrail.db_log_filename, xml_fname)
             save_bundle.vistrail.db_log_filename = xml_fname
 
@@ -982,17 +1078,182 @@ def save_vistrail_bundle_to_zip_xml(save_bundle, filename, vt_save_dir=None, ver
             for root, dirs, files in os.walk('.'):
                 for f in files:
                     z.write(os.path.join(root, f))
+        names = z.namelist()
         z.close()
         shutil.copyfile(tmp_zip_file, filename)
     finally:
         os.unlink(tmp_zip_file)
         os.rmdir(tmp_zip_dir)
+    if (version is None or version == currentVersion) and \
+            (incremental or _journaling_enabled()):
+        save_bundle.vistrail._journal_state = JournalState(
+            filename, save_bundle.vistrail,
+            dict((str(m.id), digest(_serialize_mashuptrail(m)))
+                 for m in saved_mashups),
+            names, 0, _fingerprint_xml)
     save_bundle = SaveBundle(save_bundle.bundle_type, save_bundle.vistrail,
                              save_bundle.log, thumbnails=saved_thumbnails,
                              abstractions=saved_abstractions,
                              mashups=saved_mashups)
     return (save_bundle, vt_save_dir)
 
+def append_vistrail_bundle_to_zip_xml(save_bundle, filename, vt_save_dir,
+                                      version=None):
+    """append_vistrail_bundle_to_zip_xml(save_bundle: SaveBundle,
+                                         filename: str, vt_save_dir: str,
+                                         version: str)
+         -> (save_bundle: SaveBundle, vt_save_dir: str)
+
+    Appends what changed since the vistrail was last read from or written
+    to filename as a journal segment, without rewriting the archive.
+    Returns None if that is not possible and a full save is needed.
+
+    """
+    vistrail = save_bundle.vistrail
+    state = getattr(vistrail, '_journal_state', None)
+    if (state is None or not vt_save_dir or not state.is_current(filename) or
+            (version is not None and version != currentVersion) or
+            vistrail.db_version != currentVersion):
+        return None
+    log_fname = os.path.join(vt_save_dir, 'log')
+    if vistrail.db_log_filename not in (None, log_fname):
+        return None
+    # package hooks may write anything to vt_save_dir
+    try:
+        from vistrails.core.packagemanager import get_package_manager
+        pm = get_package_manager()
+        for package in pm.enabled_package_list():
+            if hasattr(package.init_module, 'saveVistrailFileHook'):
+                return None
+    except Exception:
+        pass
+    mashups = dict((str(m.id), _serialize_mashuptrail(m))
+                   for m in save_bundle.mashups)
+    if any(mashup_id not in mashups for mashup_id in state.mashup_digests):
+        return None
+
+    segment = []
+    (changed, deleted) = get_changes(vistrail, state.snapshot,
+                                     _fingerprint_xml)
+    if changed:
+        journal_vistrail = DBVistrail(id=vistrail.db_id,
+                                      entity_type=vistrail.db_entity_type,
+                                      version=currentVersion)
+        for (collection, objs) in changed.iteritems():
+            for obj in objs:
+                getattr(journal_vistrail, 'db_add_%s' % collection)(obj)
+        f = StringIO.StringIO()
+        save_vistrail_to_xml(journal_vistrail, f)
+        segment.append(('vistrail', f.getvalue()))
+    if deleted:
+        segment.append(('deleted', serialize_deleted(deleted)))
+    if save_bundle.log is not None:
+        (fd, tmp_log_fname) = tempfile.mkstemp(prefix='vt_log')
+        os.close(fd)
+        try:
+            save_log_to_xml(save_bundle.log, tmp_log_fname, version, True)
+            f = open(tmp_log_fname, 'rb')
+            try:
+                segment.append(('log', f.read()))
+            finally:
+                f.close()
+        finally:
+            os.unlink(tmp_log_fname)
+    mashup_digests = {}
+    for (mashup_id, data) in mashups.iteritems():
+        mashup_digests[mashup_id] = digest(data)
+        if state.mashup_digests.get(mashup_id) != mashup_digests[mashup_id]:
+            segment.append(('mashups/%s' % mashup_id, data))
+
+    # abstractions and thumbnails never change once written, so only the
+    # new ones are appended
+    files = []
+    saved_abstractions = []
+    for obj in list.__iter__(save_bundle.abstractions):
+        if not isinstance(obj, basestring):
+            raise VistrailsDBException('append_vistrail_bundle_to_zip_xml '
+                                       'failed, abstraction list entry must '
+                                       'be a filename')
+        obj_fname = os.path.basename(obj)
+        if not obj_fname.startswith('abstraction_'):
+            obj_fname = 'abstraction_' + obj_fname
+        files.append((obj, obj_fname, saved_abstractions))
+    saved_thumbnails = []
+    for obj in list.__iter__(save_bundle.thumbnails):
+        if not isinstance(obj, basestring):
+            raise VistrailsDBException('append_vistrail_bundle_to_zip_xml '
+                                       'failed, thumbnail list entry must be '
+                                       'a filename')
+        files.append((obj, 'thumbs/' + os.path.basename(obj),
+                      saved_thumbnails))
+    new_files = []
+    for (obj, name, saved) in files:
+        xml_fname = os.path.join(vt_save_dir, *name.split('/'))
+        if name not in state.names:
+            if obj != xml_fname:
+                try:
+                    if not os.path.exists(os.path.dirname(xml_fname)):
+                        os.mkdir(os.path.dirname(xml_fname))
+                    shutil.copyfile(obj, xml_fname)
+                except (IOError, OSError), e:
+                    debug.warning('copying %s -> %s failed: %s' % \
+                                      (obj, xml_fname, str(e)))
+                    continue
+            new_files.append((xml_fname, name))
+        saved.append(xml_fname)
+
+    appended = []
+    if segment or new_files:
+        part_names = dict((part, state.segment_name(part))
+                          for (part, _) in segment)
+        # the central directory gets overwritten by the appended members, so
+        # keep it to restore the archive if appending fails
+        z = zipfile.ZipFile(filename, 'a')
+        start_dir = z.start_dir
+        with open(filename, 'rb') as f:
+            f.seek(start_dir)
+            central_dir = f.read()
+        try:
+            for (part, data) in segment:
+                z.writestr(part_names[part], data)
+            for (xml_fname, name) in new_files:
+                z.write(xml_fname, name)
+            z.close()
+        except Exception:
+            z.fp = None
+            with open(filename, 'r+b') as f:
+                f.truncate(start_dir)
+                f.seek(start_dir)
+                f.write(central_dir)
+            raise
+        state.names.update(part_names.itervalues())
+        state.names.update(name for (_, name) in new_files)
+        state.segments += 1
+        if 'log' in part_names:
+            appended.append((log_fname, part_names['log'], dict(segment)['log']))
+            vistrail.db_log_filename = log_fname
+    update_archive(vt_save_dir, appended)
+    state.stat = state.get_stat()
+    state.snapshot = take_snapshot(vistrail, _fingerprint_xml)
+    state.mashup_digests = mashup_digests
+
+    save_bundle = SaveBundle(save_bundle.bundle_type, vistrail,
+                             save_bundle.log, thumbnails=saved_thumbnails,
+                             abstractions=saved_abstractions,
+                             mashups=list(save_bundle.mashups))
+    return (save_bundle, vt_save_dir)
+
+def compact_vistrail_bundle_zip_xml(filename):
+    """compact_vistrail_bundle_zip_xml(filename: str) -> None
+    Rewrites a vistrail archive, merging its journal segments.
+
+    """
+    (save_bundle, vt_save_dir) = open_vistrail_bundle_from_zip_xml(filename)
+    try:
+        save_vistrail_bundle_to_zip_xml(save_bundle, filename, vt_save_dir)
+    finally:
+        close_zip_xml(vt_save_dir)
+
 def save_vistrail_bundle_to_db(save_bundle, db_connection, do_copy=False, version=None):
     if save_bundle.vistrail is None:
         raise VistrailsDBException('save_vistrail_bundle_to_db failed, '
@@ -1183,32 +1444,28 @@ def get_saved_workflows(vistrail, db_connection):
 ##############################################################################
 # Logging I/O
 
-def open_log_from_xml(filename, was_appended=False):
-    """open_log_from_xml(filename) -> DBLog"""
+def open_log_from_xml(filename, was_appended=False, versions=None):
+    """open_log_from_xml(filename: str, was_appended: bool,
+                         versions: list) -> DBLog
+
+    was_appended: the log is a sequence of workflow executions appended to
+                  each other, as in vt files
+    versions: only read the executions of these vistrail versions, using
+              the log index (appended logs only)
+
+    """
+    extract_member(filename)
     if was_appended:
-        parser = ElementTree.XMLTreeBuilder()
-        parser.feed("<log>\n")
-        f = open(filename, "rb")
-        parser.feed(f.read())
-        parser.feed("</log>\n")
-        root = parser.close()
-        workflow_execs = []
-        for node in root:
-            version = get_version_for_xml(node)
-            daoList = getVersionDAO(version)
-            workflow_exec = \
-                daoList.read_xml_object(DBWorkflowExec.vtType, node)
-            if version != currentVersion:
-                # if version is wrong, dump this into a dummy log object, 
-                # then translate, then get workflow_exec back
-                log = DBLog()
-                translate_log(log, currentVersion, version)
-                log.db_add_workflow_exec(workflow_exec)
-                log = translate_log(log, version)
-                workflow_exec = log.db_workflow_execs[0]
-            workflow_execs.append(workflow_exec)
+        if versions is not None:
+            index = get_log_index(filename)
+            workflow_execs = list(_iter_indexed_log(filename, index,
+                                                    versions))
+            count = len(index.entries)
+        else:
+            workflow_execs = list(_iter_appended_log(filename))
+            count = len(workflow_execs)
         log = DBLog(workflow_execs=workflow_execs)
-        vistrails.db.services.log.update_ids(log)
+        log.id_scope.updateBeginId(DBWorkflowExec.vtType, count + 1)
     else:
         tree = ElementTree.parse(filename)
         version = get_version_for_xml(tree.getroot())
@@ -1218,6 +1475,87 @@ def open_log_from_xml(filename, was_appended=False):
         vistrails.db.services.log.update_id_scope(log)
     return log
 
+def iter_log_from_xml(filename, versions=None, start=None, end=None):
+    """iter_log_from_xml(filename: str, versions: list, start: datetime,
+                         end: datetime) -> iterator over DBWorkflowExec
+
+    Reads the workflow executions of an appended log one at a time. They
+    get the ids open_log_from_xml() would give them.
+
+    If versions, start or end are set, only the executions of these
+    vistrail versions and within that time range are read, seeking to them
+    with the log index instead of parsing the whole log.
+
+    """
+    extract_member(filename)
+    if versions is None and start is None and end is None:
+        return _iter_appended_log(filename)
+    return _iter_indexed_log(filename, get_log_index(filename), versions,
+                             start, end)
+
+class _AppendedLogFile(object):
+    """Reads an appended log as a single <log> document."""
+    def __init__(self, f):
+        self._f = f
+        self._prefix = '<log>\n'
+        self._suffix = '</log>\n'
+
+    def read(self, size=-1):
+        data = self._prefix
+        self._prefix = ''
+        if size < 0 or len(data) < size:
+            data += self._f.read(size - len(data) if size >= 0 else -1)
+        if size < 0 or len(data) < size:
+            data += self._suffix
+            self._suffix = ''
+        return data
+
+def _iter_appended_log(filename):
+    f = open(filename, 'rb')
+    try:
+        depth = 0
+        position = 0
+        for (event, node) in ElementTree.iterparse(_AppendedLogFile(f),
+                                                   ('start', 'end')):
+            if event == 'start':
+                if depth == 0:
+                    root = node
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 1:
+                    position += 1
+                    yield _read_appended_workflow_exec(node, position)
+                    # drop the executions that were already read
+                    root.clear()
+    finally:
+        f.close()
+
+def _iter_indexed_log(filename, index, versions=None, start=None, end=None):
+    f = open(filename, 'rb')
+    try:
+        for (position, offset, length) in index.find(versions, start, end):
+            f.seek(offset)
+            node = ElementTree.fromstring(f.read(length))
+            yield _read_appended_workflow_exec(node, position + 1)
+    finally:
+        f.close()
+
+def _read_appended_workflow_exec(node, id):
+    version = get_version_for_xml(node)
+    daoList = getVersionDAO(version)
+    workflow_exec = daoList.read_xml_object(DBWorkflowExec.vtType, node)
+    if version != currentVersion:
+        # if version is wrong, dump this into a dummy log object,
+        # then translate, then get workflow_exec back
+        log = DBLog()
+        translate_log(log, currentVersion, version)
+        log.db_add_workflow_exec(workflow_exec)
+        log = translate_log(log, version)
+        workflow_exec = log.db_workflow_execs[0]
+    workflow_exec.db_id = id
+    return workflow_exec
+
 def open_log_from_db(db_connection, id, lock=False, version=None):
     """open_log_from_db(db_connection, id : long: lock: bool, version: str) 
          -> DBLog 
@@ -1826,6 +2164,7 @@ def create_temp_folder(prefix='vt_save'):
 def remove_temp_folder(temp_dir):
     if temp_dir is None:
         return
+    discard_directory(temp_dir)
     if not os.path.isdir(temp_dir):
         if os.path.isfile(temp_dir):
             os.remove(temp_dir)
@@ -1893,3 +2232,155 @@ class TestDBIO(unittest.TestCase):
                 self.fail(str(e))
         finally:
             os.rmdir(testdir)
+
+    def test_lazy_members(self):
+        """test that opening a vt file doesn't extract it"""
+        fname = os.path.join(vistrails.core.system.vistrails_root_directory(),
+                             'tests/resources/paramexp-1.0.3.vt')
+        testdir = tempfile.mkdtemp(prefix='vt_')
+        filename = os.path.join(testdir, 'paramexp.vt')
+        (save_bundle, vt_save_dir) = open_bundle_from_zip_xml(
+            DBVistrail.vtType, fname)
+        try:
+            self.assertEqual(os.listdir(vt_save_dir), [])
+            self.assertEqual(len(save_bundle.mashups), 2)
+            log_fname = save_bundle.vistrail.db_log_filename
+            self.assertFalse(os.path.exists(log_fname))
+            log = open_log_from_xml(log_fname, True)
+            self.assertGreater(len(log.db_workflow_execs), 0)
+            self.assertEqual(os.listdir(vt_save_dir), ['log'])
+
+            thumbnail = save_bundle.thumbnails[0]
+            self.assertTrue(os.path.isfile(thumbnail))
+            self.assertEqual(len(os.listdir(os.path.dirname(thumbnail))), 1)
+
+            # saving writes all the members
+            save_bundle_to_zip_xml(save_bundle, filename, vt_save_dir)
+            z = zipfile.ZipFile(fname)
+            try:
+                expected = set(n for n in z.namelist() if not n.endswith('/'))
+            finally:
+                z.close()
+            z = zipfile.ZipFile(filename)
+            try:
+                self.assertEqual(set(z.namelist()), expected)
+            finally:
+                z.close()
+        finally:
+            close_zip_xml(vt_save_dir)
+            shutil.rmtree(testdir)
+
+    def test_log_streaming(self):
+        """test reading an appended log one execution at a time"""
+        fname = os.path.join(vistrails.core.system.vistrails_root_directory(),
+                             'tests/resources/paramexp-1.0.3.vt')
+        (save_bundle, vt_save_dir) = open_bundle_from_zip_xml(
+            DBVistrail.vtType, fname)
+        try:
+            log_fname = save_bundle.vistrail.db_log_filename
+            log = open_log_from_xml(log_fname, True)
+            execs = [(e.db_id, e.db_parent_version, e.db_ts_start)
+                     for e in log.db_workflow_execs]
+            self.assertGreater(len(execs), 1)
+            self.assertEqual([(e.db_id, e.db_parent_version, e.db_ts_start)
+                              for e in iter_log_from_xml(log_fname)], execs)
+
+            version = execs[-1][1]
+            version_log = open_log_from_xml(log_fname, True, [version])
+            self.assertEqual([(e.db_id, e.db_parent_version, e.db_ts_start)
+                              for e in version_log.db_workflow_execs],
+                             [e for e in execs if e[1] == version])
+            self.assertEqual(
+                version_log.id_scope.getNewId(DBWorkflowExec.vtType),
+                len(execs) + 1)
+            self.assertEqual(
+                [e.db_id for e in iter_log_from_xml(log_fname,
+                                                    start=execs[-1][2])],
+                [e[0] for e in execs if e[2] >= execs[-1][2]])
+        finally:
+            close_zip_xml(vt_save_dir)
+
+    def test_incremental_save(self):
+        """test that an incremental save appends a journal segment"""
+        from vistrails.core.configuration import get_vistrails_configuration
+        from vistrails.db.domain import DBAnnotation
+        fname = os.path.join(vistrails.core.system.vistrails_root_directory(),
+                             'tests/resources/paramexp-1.0.3.vt')
+        testdir = tempfile.mkdtemp(prefix='vt_')
+        filename = os.path.join(testdir, 'paramexp.vt')
+        conf = get_vistrails_configuration()
+        old_incremental = conf.check('incrementalSave')
+        try:
+            # nothing is remembered about the archive unless needed
+            conf.incrementalSave = False
+            (save_bundle, vt_save_dir) = open_bundle_from_zip_xml(
+                DBVistrail.vtType, fname)
+            try:
+                self.assertIsNone(getattr(save_bundle.vistrail,
+                                          '_journal_state', None))
+            finally:
+                close_zip_xml(vt_save_dir)
+            conf.incrementalSave = True
+
+            (save_bundle, vt_save_dir) = open_bundle_from_zip_xml(
+                DBVistrail.vtType, fname)
+            try:
+                save_bundle_to_zip_xml(save_bundle, filename, vt_save_dir)
+            finally:
+                close_zip_xml(vt_save_dir)
+
+            (save_bundle, vt_save_dir) = open_bundle_from_zip_xml(
+                DBVistrail.vtType, filename)
+            try:
+                vistrail = save_bundle.vistrail
+                z = zipfile.ZipFile(filename)
+                try:
+                    offset = z.getinfo('vistrail').header_offset
+                finally:
+                    z.close()
+                vistrail.db_add_annotation(DBAnnotation(id=1000L, key='k',
+                                                        value='v'))
+                action = vistrail.db_actions[-1]
+                vistrail.db_delete_action(action)
+                save_bundle_to_zip_xml(save_bundle, filename, vt_save_dir,
+                                       incremental=True)
+                snapshot = take_snapshot(vistrail, _fingerprint_xml)
+                z = zipfile.ZipFile(filename)
+                try:
+                    self.assertEqual(z.getinfo('vistrail').header_offset,
+                                     offset)
+                    self.assertIn('journal/000001/vistrail', z.namelist())
+                    self.assertIn('journal/000001/deleted', z.namelist())
+                finally:
+                    z.close()
+            finally:
+                close_zip_xml(vt_save_dir)
+
+            (save_bundle, vt_save_dir) = open_bundle_from_zip_xml(
+                DBVistrail.vtType, filename)
+            try:
+                self.assertEqual(take_snapshot(save_bundle.vistrail,
+                                               _fingerprint_xml), snapshot)
+                self.assertFalse(save_bundle.vistrail.db_has_action_with_id(
+                        action.db_id))
+            finally:
+                close_zip_xml(vt_save_dir)
+
+            # a regular save merges the journal
+            compact_vistrail_bundle_zip_xml(filename)
+            z = zipfile.ZipFile(filename)
+            try:
+                self.assertFalse(any(n.startswith(JOURNAL_DIR + '/')
+                                     for n in z.namelist()))
+            finally:
+                z.close()
+            (save_bundle, vt_save_dir) = open_bundle_from_zip_xml(
+                DBVistrail.vtType, filename)
+            try:
+                self.assertEqual(take_snapshot(save_bundle.vistrail,
+                                               _fingerprint_xml), snapshot)
+            finally:
+                close_zip_xml(vt_save_dir)
+        finally:
+            conf.incrementalSave = old_incremental
+            shutil.rmtree(testdir)
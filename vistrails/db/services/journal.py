@@ -0,0 +1,263 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+
+"""Journal segments for incremental saves of zipped vistrails.
+
+Saving a .vt file normally rewrites the whole archive. An incremental save
+instead appends a journal segment to it, holding only the vistrail objects
+that were added or changed since the archive was last written, and the ids
+of the ones that were deleted. Segments are stored in the archive as
+
+    journal/<number>/vistrail   objects added or changed, as a vistrail
+    journal/<number>/deleted    one JSON [collection, key] line per deletion
+    journal/<number>/log        workflow executions to append to the log
+    journal/<number>/mashups/*  mashuptrails added or changed
+
+and are replayed in order when the archive is opened. A regular save
+compacts the archive again.
+
+"""
+
+import hashlib
+import json
+import os
+
+import unittest
+
+JOURNAL_DIR = 'journal'
+
+# (collection name, key attribute, fingerprint function)
+# the fingerprint only includes the fields that can change after an object
+# was added to the vistrail
+COLLECTIONS = [
+    ('action', 'db_id',
+     lambda a: tuple((an.db_id, an.db_key, an.db_value)
+                     for an in a.db_annotations)),
+    ('tag', 'db_id', lambda t: t.db_name),
+    ('annotation', 'db_id', lambda a: (a.db_key, a.db_value)),
+    ('controlParameter', 'db_id', lambda c: (c.db_name, c.db_value)),
+    ('vistrailVariable', 'db_name',
+     lambda v: (v.db_uuid, v.db_package, v.db_module, v.db_namespace,
+                v.db_value)),
+    ('parameter_exploration', 'db_id', None),
+    ('actionAnnotation', 'db_id',
+     lambda a: (a.db_action_id, a.db_key, a.db_value, a.db_user,
+                a.db_date)),
+    ]
+
+def _get_objects(vistrail, collection):
+    return getattr(vistrail, 'db_%ss' % collection)
+
+class JournalState(object):
+    """What was last written to an archive, used to find what to append.
+
+    """
+    def __init__(self, filename, vistrail, mashup_digests, names,
+                 segments=0, fingerprint_xml=None):
+        self.filename = os.path.abspath(filename)
+        self.stat = self.get_stat()
+        self.snapshot = take_snapshot(vistrail, fingerprint_xml)
+        self.mashup_digests = mashup_digests
+        self.names = set(names)
+        self.segments = segments
+
+    def get_stat(self):
+        st = os.stat(self.filename)
+        return (st.st_size, st.st_mtime)
+
+    def is_current(self, filename):
+        """is_current(filename: str) -> bool
+        Tells whether filename is the archive as we last wrote or read it.
+
+        """
+        return (os.path.abspath(filename) == self.filename and
+                os.path.isfile(self.filename) and
+                self.get_stat() == self.stat)
+
+    def segment_name(self, part):
+        return '%s/%06d/%s' % (JOURNAL_DIR, self.segments + 1, part)
+
+def take_snapshot(vistrail, fingerprint_xml=None):
+    """take_snapshot(vistrail: DBVistrail, fingerprint_xml: callable)
+         -> dict
+    Returns the fingerprints of the vistrail objects, per collection.
+    fingerprint_xml(obj) is used for objects that don't have a cheaper
+    fingerprint.
+
+    """
+    snapshot = {}
+    for (collection, key, fingerprint) in COLLECTIONS:
+        if fingerprint is None:
+            fingerprint = fingerprint_xml
+        snapshot[collection] = dict((getattr(obj, key), fingerprint(obj))
+                                    for obj in _get_objects(vistrail,
+                                                            collection))
+    return snapshot
+
+def get_changes(vistrail, snapshot, fingerprint_xml=None):
+    """get_changes(vistrail: DBVistrail, snapshot: dict,
+                   fingerprint_xml: callable) -> (dict, list)
+    Compares the vistrail to a snapshot. Returns the objects that were
+    added or changed, per collection, and the (collection, key) pairs of
+    the ones that were deleted.
+
+    """
+    changed = {}
+    deleted = []
+    for (collection, key, fingerprint) in COLLECTIONS:
+        if fingerprint is None:
+            fingerprint = fingerprint_xml
+        old = snapshot[collection]
+        objs = []
+        keys = set()
+        for obj in _get_objects(vistrail, collection):
+            obj_key = getattr(obj, key)
+            keys.add(obj_key)
+            if obj_key not in old or old[obj_key] != fingerprint(obj):
+                objs.append(obj)
+        if objs:
+            changed[collection] = objs
+        deleted.extend((collection, k) for k in old if k not in keys)
+    return (changed, deleted)
+
+def serialize_deleted(deleted):
+    return ''.join(json.dumps([collection, key]) + '\n'
+                   for (collection, key) in deleted)
+
+def parse_deleted(data):
+    """parse_deleted(data: str) -> list
+    Reads the deleted keys of a journal segment. Lines that are not a
+    known collection with an integer (or, for vistrail variables, string)
+    key are ignored.
+
+    """
+    key_types = dict((collection, (int, long))
+                     for (collection, _, _) in COLLECTIONS)
+    key_types['vistrailVariable'] = basestring
+    deleted = []
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        try:
+            (collection, key) = json.loads(line)
+        except (ValueError, TypeError):
+            continue
+        if collection in key_types and \
+                isinstance(key, key_types[collection]) and \
+                not isinstance(key, bool):
+            deleted.append((str(collection), key))
+    return deleted
+
+def apply_segment(vistrail, journal_vistrail, deleted):
+    """apply_segment(vistrail: DBVistrail, journal_vistrail: DBVistrail,
+                     deleted: list) -> None
+    Replays a journal segment on the vistrail read from the archive.
+
+    """
+    for (collection, key) in deleted:
+        if collection == 'vistrailVariable':
+            getter = getattr(vistrail, 'db_get_%s_by_name' % collection)
+        else:
+            getter = getattr(vistrail, 'db_get_%s_by_id' % collection)
+        try:
+            obj = getter(key)
+        except KeyError:
+            continue
+        getattr(vistrail, 'db_delete_%s' % collection)(obj)
+    if journal_vistrail is None:
+        return
+    for (collection, key, _) in COLLECTIONS:
+        if collection == 'vistrailVariable':
+            has = getattr(vistrail, 'db_has_%s_with_name' % collection)
+        else:
+            has = getattr(vistrail, 'db_has_%s_with_id' % collection)
+        for obj in _get_objects(journal_vistrail, collection):
+            if has(getattr(obj, key)):
+                getattr(vistrail, 'db_change_%s' % collection)(obj)
+            else:
+                getattr(vistrail, 'db_add_%s' % collection)(obj)
+
+def digest(data):
+    return hashlib.sha1(data).hexdigest()
+
+##############################################################################
+
+class TestJournal(unittest.TestCase):
+    def test_changes(self):
+        from vistrails.db.domain import DBVistrail, DBAction, DBAnnotation, \
+            DBActionAnnotation, DBTag
+        vistrail = DBVistrail(id=1)
+        vistrail.db_add_action(DBAction(id=1, prevId=0))
+        vistrail.db_add_tag(DBTag(id=1, name='first'))
+        vistrail.db_add_annotation(DBAnnotation(id=1, key='a', value='1'))
+        snapshot = take_snapshot(vistrail, repr)
+
+        action = DBAction(id=2, prevId=1)
+        vistrail.db_add_action(action)
+        vistrail.db_get_tag_by_id(1).db_name = 'renamed'
+        vistrail.db_delete_annotation(vistrail.db_get_annotation_by_id(1))
+        vistrail.db_add_actionAnnotation(
+            DBActionAnnotation(id=1, action_id=2, key='__notes__',
+                               value='note'))
+        (changed, deleted) = get_changes(vistrail, snapshot, repr)
+        self.assertEqual(sorted(changed),
+                         ['action', 'actionAnnotation', 'tag'])
+        self.assertEqual(changed['action'], [action])
+        self.assertEqual(deleted, [('annotation', 1)])
+        self.assertEqual(parse_deleted(serialize_deleted(deleted)), deleted)
+
+        # replay on the original vistrail
+        old = DBVistrail(id=1)
+        old.db_add_action(DBAction(id=1, prevId=0))
+        old.db_add_tag(DBTag(id=1, name='first'))
+        old.db_add_annotation(DBAnnotation(id=1, key='a', value='1'))
+        journal = DBVistrail(id=1)
+        for collection, objs in changed.iteritems():
+            for obj in objs:
+                getattr(journal, 'db_add_%s' % collection)(obj)
+        apply_segment(old, journal, deleted)
+        self.assertEqual(take_snapshot(old, repr),
+                         take_snapshot(vistrail, repr))
+
+    def test_parse_deleted(self):
+        deleted = [('action', 3), ('vistrailVariable', 'var')]
+        self.assertEqual(parse_deleted(serialize_deleted(deleted)), deleted)
+        # nothing but plain keys of known collections is accepted
+        data = ('annotation ().__class__.__base__.__subclasses__()\n'
+                '["annotation", "__import__(\'os\')"]\n'
+                '["unknown", 1]\n'
+                '["action", true]\n'
+                '["tag", 2]\n')
+        self.assertEqual(parse_deleted(data), [('tag', 2)])
@@ -0,0 +1,318 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+
+"""Deferred extraction of the members of a zipped bundle (.vt file).
+
+open_vistrail_bundle_from_zip_xml() reads the vistrail straight from the
+archive. The other members (log, thumbnails, abstractions) are registered
+here with the path they would have had if the archive had been extracted to
+the bundle directory, and are only copied there when that path is actually
+needed: by the readers in vistrails.db.services.io, when iterating over a
+LazyMemberList, or before the bundle directory is saved again.
+
+"""
+
+import os
+import shutil
+import threading
+import zipfile
+
+from vistrails.db import VistrailsDBException
+
+import unittest
+
+_lock = threading.RLock()
+# destination path -> ZipMembers
+_pending_paths = {}
+# bundle directory -> ZipMembers
+_archives = {}
+
+class ZipMembers(object):
+    """Members of a zip archive to be extracted to a directory on demand.
+
+    """
+    def __init__(self, filename, directory):
+        self.filename = os.path.abspath(filename)
+        self.directory = directory
+        self._stat = self._get_stat()
+        self._pending = {}
+
+    def _get_stat(self):
+        st = os.stat(self.filename)
+        return (st.st_size, st.st_mtime)
+
+    def add(self, name, path=None):
+        """add(name: str, path: str) -> str
+        Registers the archive member and returns its destination path.
+        Members added with the same path are concatenated, in order.
+
+        """
+        if path is None:
+            path = os.path.join(self.directory, *name.split('/'))
+        self._pending.setdefault(path, []).append(name)
+        return path
+
+    def pending(self):
+        return self._pending.keys()
+
+    def refresh(self):
+        """refresh() -> None
+        Accepts the current state of the archive, after members were
+        appended to it.
+
+        """
+        self._stat = self._get_stat()
+
+    def extract(self, paths):
+        """extract(paths: list of str) -> None
+        Copies the given members out of the archive.
+
+        """
+        paths = [p for p in paths if p in self._pending]
+        if not paths:
+            return
+        if self._get_stat() != self._stat:
+            raise VistrailsDBException("%s changed since it was opened, "
+                                       "cannot read %s" %
+                                       (self.filename,
+                                        ', '.join(', '.join(self._pending[p])
+                                                  for p in paths)))
+        z = zipfile.ZipFile(self.filename)
+        try:
+            for path in paths:
+                dirname = os.path.dirname(path)
+                if not os.path.isdir(dirname):
+                    os.makedirs(dirname)
+                with open(path, 'wb') as dst:
+                    for name in self._pending[path]:
+                        src = z.open(name)
+                        try:
+                            shutil.copyfileobj(src, dst)
+                        finally:
+                            src.close()
+                del self._pending[path]
+        finally:
+            z.close()
+
+def register_archive(members):
+    """register_archive(members: ZipMembers) -> None
+    Makes the pending members of an archive available to extract_member().
+
+    """
+    with _lock:
+        _archives[members.directory] = members
+        for path in members.pending():
+            _pending_paths[path] = members
+
+def extract_member(path):
+    """extract_member(path: str) -> str
+    Makes sure the file at path exists if it is a pending archive member.
+
+    """
+    if path in _pending_paths:
+        with _lock:
+            members = _pending_paths.get(path)
+            if members is not None:
+                members.extract([path])
+                del _pending_paths[path]
+    return path
+
+def is_pending(path):
+    """is_pending(path: str) -> bool
+    Tells whether path is an archive member that wasn't extracted yet.
+
+    """
+    return path in _pending_paths
+
+def update_archive(directory, appended=()):
+    """update_archive(directory: str, appended: list) -> None
+    Records that members were appended to the archive opened in directory.
+
+    appended is a list of (path, name, data) tuples: archive member name
+    with contents data extends the file at path, whether that file was
+    already extracted or not.
+
+    """
+    with _lock:
+        members = _archives.get(directory)
+        if members is not None:
+            members.refresh()
+        for (path, name, data) in appended:
+            if members is not None and path in _pending_paths:
+                members.add(name, path)
+            elif members is not None and not os.path.exists(path):
+                members.add(name, path)
+                _pending_paths[path] = members
+            else:
+                with open(path, 'ab') as f:
+                    f.write(data)
+
+def extract_directory(directory):
+    """extract_directory(directory: str) -> None
+    Extracts every pending member of the archive opened in directory.
+
+    """
+    with _lock:
+        members = _archives.get(directory)
+        if members is None:
+            return
+        paths = members.pending()
+        members.extract(paths)
+        for path in paths:
+            _pending_paths.pop(path, None)
+
+def discard_directory(directory):
+    """discard_directory(directory: str) -> None
+    Forgets the archive opened in directory, eg when it is removed.
+
+    """
+    with _lock:
+        members = _archives.pop(directory, None)
+        if members is not None:
+            for path in members.pending():
+                _pending_paths.pop(path, None)
+
+class LazyMemberList(list):
+    """List of filenames, the files are extracted when items are read.
+
+    Membership tests, append() and remove() don't need the files and don't
+    extract them.
+
+    """
+    def __getitem__(self, index):
+        item = list.__getitem__(self, index)
+        if isinstance(index, slice):
+            for fname in item:
+                extract_member(fname)
+        else:
+            extract_member(item)
+        return item
+
+    def __getslice__(self, i, j):
+        return self.__getitem__(slice(i, j))
+
+    def __iter__(self):
+        for fname in list.__iter__(self):
+            yield extract_member(fname)
+
+    def pop(self, *args):
+        return extract_member(list.pop(self, *args))
+
+    def __copy__(self):
+        return LazyMemberList(list.__iter__(self))
+
+##############################################################################
+
+class TestLazyZip(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp(prefix='vt_test_lazy')
+        self.filename = os.path.join(self.directory, 'test.zip')
+        z = zipfile.ZipFile(self.filename, 'w')
+        try:
+            z.writestr('log', 'log contents')
+            z.writestr('thumbs/a.png', 'a')
+            z.writestr('thumbs/b.png', 'b')
+        finally:
+            z.close()
+        self.bundle_dir = os.path.join(self.directory, 'bundle')
+        os.mkdir(self.bundle_dir)
+        self.members = ZipMembers(self.filename, self.bundle_dir)
+
+    def tearDown(self):
+        discard_directory(self.bundle_dir)
+        shutil.rmtree(self.directory)
+
+    def test_extract_member(self):
+        log = self.members.add('log')
+        register_archive(self.members)
+        self.assertFalse(os.path.exists(log))
+        self.assertEqual(extract_member(log), log)
+        with open(log, 'rb') as f:
+            self.assertEqual(f.read(), 'log contents')
+        # not extracted twice
+        os.remove(log)
+        extract_member(log)
+        self.assertFalse(os.path.exists(log))
+
+    def test_lazy_list(self):
+        thumbs = LazyMemberList([self.members.add('thumbs/a.png'),
+                                 self.members.add('thumbs/b.png')])
+        register_archive(self.members)
+        self.assertIn(os.path.join(self.bundle_dir, 'thumbs', 'b.png'),
+                      thumbs)
+        self.assertFalse(os.path.exists(list.__getitem__(thumbs, 1)))
+        self.assertTrue(os.path.exists(thumbs[0]))
+        self.assertFalse(os.path.exists(list.__getitem__(thumbs, 1)))
+        self.assertTrue(all(os.path.exists(t) for t in thumbs))
+
+    def test_extract_directory(self):
+        log = self.members.add('log')
+        thumb = self.members.add('thumbs/a.png')
+        register_archive(self.members)
+        extract_directory(self.bundle_dir)
+        self.assertTrue(os.path.exists(log))
+        self.assertTrue(os.path.exists(thumb))
+        self.assertEqual(self.members.pending(), [])
+
+    def test_concatenated(self):
+        log = self.members.add('log')
+        self.members.add('thumbs/a.png', log)
+        register_archive(self.members)
+        with open(extract_member(log), 'rb') as f:
+            self.assertEqual(f.read(), 'log contentsa')
+
+    def test_update_archive(self):
+        log = self.members.add('log')
+        register_archive(self.members)
+        z = zipfile.ZipFile(self.filename, 'a')
+        try:
+            z.writestr('journal/1/log', ' more')
+        finally:
+            z.close()
+        self.assertRaises(VistrailsDBException, extract_member, log)
+        update_archive(self.bundle_dir, [(log, 'journal/1/log', ' more')])
+        with open(extract_member(log), 'rb') as f:
+            self.assertEqual(f.read(), 'log contents more')
+        # extracted files are appended to directly
+        update_archive(self.bundle_dir, [(log, 'journal/2/log', '!')])
+        with open(log, 'rb') as f:
+            self.assertEqual(f.read(), 'log contents more!')
+
+    def test_changed_archive(self):
+        log = self.members.add('log')
+        register_archive(self.members)
+        self.members._stat = (0, 0)
+        self.assertRaises(VistrailsDBException, extract_member, log)
@@ -653,7 +653,8 @@ class ZIPFileLocator(XMLFileLocator):
                 obj.locator = self
             return save_bundle
 
-    def save(self, save_bundle, do_copy=True, version=None):
+    def save(self, save_bundle, do_copy=True, version=None,
+             incremental=False):
         if do_copy:
             # make sure we create a fresh temporary directory if we're
             # duplicating the vistrail
@@ -661,7 +662,8 @@ class ZIPFileLocator(XMLFileLocator):
         else:
             # otherwise, use the existing temp directory if one is set
             tmp_dir = self.tmp_dir
-        (save_bundle, tmp_dir) = io.save_bundle_to_zip_xml(save_bundle, self._name, tmp_dir, version)
+        (save_bundle, tmp_dir) = io.save_bundle_to_zip_xml(save_bundle, self._name, tmp_dir, version,
+                                                           incremental)
         self.tmp_dir = tmp_dir
         for obj in save_bundle.get_db_objs():
             obj.locator = self
@@ -0,0 +1,270 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+
+
+"""Byte-offset index of appended execution logs.
+
+The log of a zipped vistrail is a sequence of workflow_exec elements that
+gets appended to after each execution. A LogIndex records where each of
+them starts, along with its vistrail version and time range, so that the
+executions of a single version can be read without parsing the whole log.
+Since the log only grows, an existing index is extended by scanning the
+appended bytes only.
+
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+import xml.parsers.expat
+
+from vistrails.db import VistrailsDBException
+
+import unittest
+
+HEAD_SIZE = 4096
+CHUNK_SIZE = 1 << 20
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+class LogIndex(object):
+    """Offsets of the workflow executions of an appended log.
+
+    entries holds one (offset, parent_version, ts_start, ts_end) tuple per
+    execution, in the order of the log. size is the number of bytes of the
+    log that were indexed.
+
+    """
+    def __init__(self, size=0, head=None, entries=None):
+        self.size = size
+        self.head = head
+        if entries is None:
+            entries = []
+        self.entries = entries
+
+    def update(self, filename):
+        """update(filename: str) -> bool
+        Indexes what was appended to the log since it was last indexed, or
+        the whole log if it was rewritten. Returns whether anything changed.
+
+        """
+        size = os.path.getsize(filename)
+        with open(filename, 'rb') as f:
+            head = f.read(HEAD_SIZE)
+            if (self.head is None or size < self.size or
+                    _digest(head[:self.size]) != self.head):
+                # not just appended to
+                self.size = 0
+                self.entries = []
+            elif size == self.size:
+                return False
+            f.seek(self.size)
+            self.entries.extend(self._scan(f, self.size))
+        self.size = size
+        self.head = _digest(head[:size])
+        return True
+
+    @staticmethod
+    def _scan(f, base):
+        entries = []
+        depth = [0]
+        parser = xml.parsers.expat.ParserCreate()
+        prefix = '<log>'
+        def start_element(name, attrs):
+            depth[0] += 1
+            if depth[0] == 2:
+                offset = base + parser.CurrentByteIndex - len(prefix)
+                entries.append((offset,
+                                _to_version(attrs.get('parentVersion')),
+                                attrs.get('tsStart'), attrs.get('tsEnd')))
+        def end_element(name):
+            depth[0] -= 1
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        try:
+            parser.Parse(prefix)
+            while True:
+                data = f.read(CHUNK_SIZE)
+                if not data:
+                    break
+                parser.Parse(data)
+            parser.Parse('</log>', True)
+        except xml.parsers.expat.ExpatError, e:
+            raise VistrailsDBException('cannot index log: %s' % e)
+        return entries
+
+    def find(self, versions=None, start=None, end=None):
+        """find(versions: list, start: str, end: str)
+              -> [(position, offset, length)]
+        Returns the executions of the given vistrail versions that started
+        at or after start and ended at or before end, as their position in
+        the log and byte range. start and end are datetimes or strings
+        formatted as in the log, eg '2014-05-20 12:34:56'.
+
+        """
+        if versions is not None:
+            versions = set(versions)
+        start = _to_timestamp(start)
+        end = _to_timestamp(end)
+        found = []
+        for (i, (offset, version, ts_start, ts_end)) in \
+                enumerate(self.entries):
+            if versions is not None and version not in versions:
+                continue
+            if start is not None and (ts_start is None or ts_start < start):
+                continue
+            if end is not None and (ts_end is None or ts_end > end):
+                continue
+            if i + 1 < len(self.entries):
+                next_offset = self.entries[i + 1][0]
+            else:
+                next_offset = self.size
+            found.append((i, offset, next_offset - offset))
+        return found
+
+    def save(self, filename):
+        with open(filename, 'wb') as f:
+            json.dump({'size': self.size, 'head': self.head,
+                       'entries': self.entries}, f)
+
+    @staticmethod
+    def load(filename):
+        with open(filename, 'rb') as f:
+            data = json.load(f)
+        return LogIndex(data['size'], data['head'],
+                        [tuple(e) for e in data['entries']])
+
+def _digest(data):
+    return hashlib.sha1(data).hexdigest()
+
+def _to_timestamp(value):
+    if isinstance(value, datetime.datetime):
+        return value.strftime(TIMESTAMP_FORMAT)
+    return value
+
+def _to_version(version):
+    try:
+        return long(version)
+    except (TypeError, ValueError):
+        return version
+
+_lock = threading.Lock()
+# log filename -> LogIndex
+_indexes = {}
+
+def get_log_index(filename, index_filename=None):
+    """get_log_index(filename: str, index_filename: str) -> LogIndex
+    Returns the index of an appended log, brought up to date. Indexes are
+    kept for the rest of the session, and in index_filename if given.
+
+    """
+    filename = os.path.abspath(filename)
+    with _lock:
+        index = _indexes.get(filename)
+        if index is None and index_filename and \
+                os.path.isfile(index_filename):
+            try:
+                index = LogIndex.load(index_filename)
+            except (IOError, ValueError, KeyError):
+                index = None
+        if index is None:
+            index = LogIndex()
+        if index.update(filename) and index_filename:
+            index.save(index_filename)
+        _indexes[filename] = index
+        return index
+
+def discard_log_index(filename):
+    with _lock:
+        _indexes.pop(os.path.abspath(filename), None)
+
+##############################################################################
+
+class TestLogIndex(unittest.TestCase):
+    EXEC = ('<workflowExec id="-1" parentVersion="%d" tsStart="%s" '
+            'tsEnd="%s" version="1.0.4">\n'
+            '  <moduleExec id="1" moduleId="%d" />\n'
+            '</workflowExec>\n')
+
+    def write_execs(self, f, execs):
+        for (version, ts_start, ts_end) in execs:
+            f.write(self.EXEC % (version, ts_start, ts_end, version))
+
+    def test_index(self):
+        import shutil
+        import tempfile
+        testdir = tempfile.mkdtemp(prefix='vt_')
+        try:
+            fname = os.path.join(testdir, 'log')
+            with open(fname, 'wb') as f:
+                self.write_execs(f, [(3, '2014-01-01 10:00:00',
+                                      '2014-01-01 10:01:00'),
+                                     (5, '2014-01-02 10:00:00',
+                                      '2014-01-02 10:01:00')])
+            index = get_log_index(fname)
+            self.assertEqual([e[1] for e in index.entries], [3, 5])
+            ((position, offset, length),) = index.find([5])
+            self.assertEqual(position, 1)
+            with open(fname, 'rb') as f:
+                f.seek(offset)
+                self.assertTrue(f.read(length).startswith(
+                        '<workflowExec id="-1" parentVersion="5"'))
+
+            # appended executions are indexed without rescanning the rest
+            with open(fname, 'ab') as f:
+                self.write_execs(f, [(3, '2014-01-03 10:00:00',
+                                      '2014-01-03 10:01:00')])
+            old_entries = index.entries[:]
+            index.update(fname)
+            self.assertEqual(index.entries[:2], old_entries)
+            self.assertEqual([p for (p, _, _) in index.find([3])], [0, 2])
+            self.assertEqual(
+                [p for (p, _, _) in index.find(start='2014-01-02 00:00:00')],
+                [1, 2])
+            self.assertEqual(
+                [p for (p, _, _) in index.find(end='2014-01-02 23:00:00')],
+                [0, 1])
+
+            # saved index
+            index_fname = os.path.join(testdir, 'log.idx')
+            discard_log_index(fname)
+            index = get_log_index(fname, index_fname)
+            discard_log_index(fname)
+            self.assertEqual(LogIndex.load(index_fname).entries,
+                             index.entries)
+        finally:
+            discard_log_index(fname)
+            shutil.rmtree(testdir)
@@ -36,6 +36,8 @@ from vistrails.db.domain import DBWorkflow, DBAdd, DBDelete, DBAction, DBAbstrac
     DBModule, DBConnection, DBPort, DBFunction, DBParameter, DBGroup
 from vistrails.db.services.action_chain import getActionChain, getCurrentOperationDict, \
     getCurrentOperations, simplify_ops
+from vistrails.db.services.workflow_cache import get_workflow_checkpoints, \
+    get_workflow_diff_cache
 from vistrails.db import VistrailsDBException
 
 import copy
@@ -71,10 +73,13 @@ def materializeWorkflow(vistrail, version):
     # construct path up through tree and perform each action
     if vistrail.db_has_action_with_id(version):
         workflow = DBWorkflow()
-        #for action in getActionChain(vistrail, version):
-        #    oldPerformAction(action, workflow)
-        performActions(getActionChain(vistrail, version), 
-                            workflow)
+        # start from the nearest checkpointed ancestor instead of
+        # replaying the whole action chain
+        op_dict = get_workflow_checkpoints(vistrail).get_operation_dict(
+            vistrail, version)
+        operations = op_dict.values()
+        operations.sort(key=lambda x: x.db_id)
+        performAdds(operations, workflow)
         workflow.db_id = version
         workflow.db_vistrailId = vistrail.db_id
         return workflow
@@ -126,6 +131,15 @@ def performActions(actions, workflow):
     # a change after an add is effectively an add if the add is discarded
     performAdds(getCurrentOperations(actions), workflow)
 
+def reset_search_index(vistrail):
+    """reset_search_index(vistrail) -> None
+    Drops the version search index of a core vistrail whose actions or
+    annotations were added directly; it is rebuilt on first use.
+
+    """
+    if getattr(vistrail, '_search_index', None) is not None:
+        vistrail._search_index = None
+
 def synchronize(old_vistrail, new_vistrail, current_action_id):
     id_remap = {}
     for action in new_vistrail.db_actions:
@@ -188,6 +202,7 @@ def synchronize(old_vistrail, new_vistrail, current_action_id):
                 old_vistrail.db_delete_tag(old_tag)
             old_vistrail.db_add_tag(new_tag)
 
+    reset_search_index(old_vistrail)
     new_action_id = \
         id_remap.get((DBAction.vtType, current_action_id), current_action_id)
     old_vistrail.db_currentVersion = new_action_id
@@ -574,6 +589,7 @@ def merge(sb, next_sb, app='', interactive = False, tmp_dir = '', next_tmp_dir =
                             '/' + annotation.db_value
                     if thumb not in sb.thumbnails:
                         sb.thumbnails.append(thumb)
+    reset_search_index(vt)
     # make this a valid checked out version
     if len(app):
         vt.update_checkout_version(app)
@@ -639,8 +655,8 @@ def normalOperations(adds, deletes, do_copy=False):
 
 def getPathAsAction(vistrail, v1, v2, do_copy=False):
     sharedRoot = getSharedRoot(vistrail, [v1, v2])
-    sharedActionChain = getActionChain(vistrail, sharedRoot)
-    sharedOperationDict = getCurrentOperationDict(sharedActionChain)
+    sharedOperationDict = get_workflow_checkpoints(
+        vistrail).get_operation_dict(vistrail, sharedRoot)
     v1Actions = getActionChain(vistrail, v1, sharedRoot)
     v2Actions = getActionChain(vistrail, v2, sharedRoot)
     (v1AddDict, v1DeleteDict) = getOperationDiff(v1Actions, 
@@ -703,8 +719,8 @@ def addAndFixActions(startDict, actions):
     return curDict
 
 def fixActions(vistrail, v, actions):
-    startingChain = getActionChain(vistrail, v)
-    startingDict = getCurrentOperationDict(startingChain)
+    startingDict = get_workflow_checkpoints(vistrail).get_operation_dict(
+        vistrail, v)
     addAndFixActions(startingDict, actions)
     
 ################################################################################
@@ -793,9 +809,11 @@ def getObjects(actions):
     return objects
 
 def getVersionDifferences(vistrail, versions):
+    # only the actions below the shared root are replayed, the state at
+    # the shared root comes from the checkpoints
     sharedRoot = getSharedRoot(vistrail, versions)
-    sharedActionChain = getActionChain(vistrail, sharedRoot)
-    sharedOperationDict = getCurrentOperationDict(sharedActionChain)
+    sharedOperationDict = get_workflow_checkpoints(
+        vistrail).get_operation_dict(vistrail, sharedRoot)
 
     vOnlySorted = []
     for v in versions:
@@ -1250,12 +1268,32 @@ def setNewObjId(operation, id):
         operation.db_objectId = id
 
 def getWorkflowDiffCommon(vistrail, v1, v2, heuristic_match=True):
+    """getWorkflowDiffCommon(vistrail, v1, v2, heuristic_match) -> tuple
+    Diffs two versions of the same vistrail from the operations added
+    and deleted since their shared root. Results are cached per pair of
+    versions; a cached diff is returned with new workflows and copies
+    of the result lists so that callers can modify them.
+
+    """
+    cache = get_workflow_diff_cache(vistrail)
+    key = (v1, v2, heuristic_match)
+    cached = cache.get(vistrail, key)
+    if cached is None:
+        (v1Workflow, v2Workflow, v1Ops, v2Ops, diff) = \
+            computeWorkflowDiffCommon(vistrail, v1, v2, heuristic_match)
+        cache.put(vistrail, key, (v1Ops, v2Ops, diff))
+    else:
+        (v1Ops, v2Ops, diff) = cached
+        v1Workflow = DBWorkflow()
+        performAdds(v1Ops, v1Workflow)
+        v2Workflow = DBWorkflow()
+        performAdds(v2Ops, v2Workflow)
+    return (v1Workflow, v2Workflow) + tuple(list(l) for l in diff)
+
+def computeWorkflowDiffCommon(vistrail, v1, v2, heuristic_match=True):
     (sharedOps, vOnlyOps) = \
         getVersionDifferences(vistrail, [v1, v2])
 
-    sharedWorkflow = DBWorkflow()
-    performAdds(sharedOps, sharedWorkflow)
-
     # FIXME better to do additional ops (and do deletes) or do this?
     v1Workflow = DBWorkflow()
     v1Ops = vOnlyOps[0][2]
@@ -1425,11 +1463,11 @@ def getWorkflowDiffCommon(vistrail, v1, v2, heuristic_match=True):
         check_params_diff(v1Workflow, v2Workflow, allChgModulePairs, 
                           True, heuristic_match)
 
-    return (v1Workflow, v2Workflow, 
-            sharedModulePairs, heuristicModulePairs, v1Only, v2Only, 
-            paramChanges, cparam_changes, annot_changes,
-            sharedConnectionPairs, heuristicConnectionPairs, 
-            c1Only, c2Only)
+    return (v1Workflow, v2Workflow, v1Ops, v2Ops,
+            (sharedModulePairs, heuristicModulePairs, v1Only, v2Only, 
+             paramChanges, cparam_changes, annot_changes,
+             sharedConnectionPairs, heuristicConnectionPairs, 
+             c1Only, c2Only))
 
 def do_heuristic_diff(v1Workflow, v2Workflow, v1_modules, v2_modules, 
                       v1_connections, v2_connections):    
@@ -1627,5 +1665,45 @@ class TestDBVistrailService(unittest.TestCase):
         # test parameter change inequality
         assert heuristicModuleMatch(module1, module5) == 0
 
+    def test_workflow_diff_cache(self):
+        from vistrails.core.db.locator import FileLocator
+        from vistrails.core.system import vistrails_root_directory
+        locator = FileLocator(vistrails_root_directory() +
+                              '/tests/resources/terminator.vt')
+        vistrail = locator.load().vistrail
+        versions = sorted(vistrail.db_actions_id_index.keys())
+        v1, v2 = versions[len(versions) // 2], versions[-1]
+        diff = getWorkflowDiff((vistrail, v1), (vistrail, v2))
+        self.assertEqual(len(get_workflow_diff_cache(vistrail)), 1)
+        for l in diff[2:]:
+            del l[:]
+        cached = getWorkflowDiff((vistrail, v1), (vistrail, v2))
+        self.assertEqual(len(get_workflow_diff_cache(vistrail)), 1)
+        self.assertIsNot(cached[0], diff[0])
+        self.assertEqual(sorted(cached[0].db_modules_id_index),
+                         sorted(diff[0].db_modules_id_index))
+
+        # same as without the cache
+        get_workflow_diff_cache(vistrail).clear()
+        self.assertEqual(cached[2:],
+                         getWorkflowDiff((vistrail, v1), (vistrail, v2))[2:])
+        self.assertTrue(any(cached[2:]))
+
+    def test_synchronize_search_index(self):
+        from vistrails.core.db.locator import XMLFileLocator
+        from vistrails.core.system import vistrails_root_directory
+        from vistrails.core.vistrail.action import Action
+        filename = vistrails_root_directory() + '/tests/resources/dummy.xml'
+        old_vistrail = XMLFileLocator(filename).load()
+        new_vistrail = XMLFileLocator(filename).load()
+        old_vistrail.get_search_index()
+        action = Action(id=new_vistrail.idScope.getNewId(Action.vtType),
+                        operations=[])
+        new_vistrail.add_action(action, 0)
+        action.is_new = True
+        new_id = synchronize(old_vistrail, new_vistrail, action.id)
+        self.assertEqual(old_vistrail.get_search_index().module_counts(new_id),
+                         {})
+
 if __name__ == '__main__':
     unittest.main()
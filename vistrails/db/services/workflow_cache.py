@@ -0,0 +1,369 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+
+"""Checkpoints of materialized workflows along the version tree.
+
+Materializing a version means replaying every action from the root. The
+cache below keeps the current operation dictionaries (see
+getCurrentOperationDict) at selected versions so that materialization can
+start from the nearest cached ancestor instead. A version is checkpointed
+when its depth is a multiple of the checkpoint interval, when it is tagged,
+when it is a branch point, or when it is the version that was requested.
+The cached dictionaries only reference operations that already belong to
+the vistrail; the total number of entries is bounded and the least recently
+used checkpoints are evicted first.
+
+"""
+
+from collections import deque
+
+from vistrails.db.services.action_chain import getCurrentOperationDict
+
+import unittest
+
+# version depth between two automatic checkpoints
+DEFAULT_CHECKPOINT_INTERVAL = 50
+# maximum number of operation references kept for a single vistrail
+DEFAULT_MAX_CACHED_OPERATIONS = 500000
+# maximum number of workflow diffs kept for a single vistrail
+DEFAULT_MAX_CACHED_DIFFS = 32
+
+class _LRUDict(object):
+    """Dictionary remembering the order in which keys were last set.
+
+    Only provides what the caches below use; collections.OrderedDict isn't
+    available in Python 2.6. Setting a key makes it the most recent one,
+    popitem() removes the least recent one.
+
+    """
+    def __init__(self):
+        # key -> (stamp, value)
+        self._items = {}
+        # (stamp, key), oldest first; stale stamps are skipped
+        self._order = deque()
+        self._stamp = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __setitem__(self, key, value):
+        self._stamp += 1
+        self._items[key] = (self._stamp, value)
+        self._order.append((self._stamp, key))
+        if len(self._order) > 2 * len(self._items) + 16:
+            self._order = deque((stamp, k) for stamp, k in self._order
+                                if self._items.get(k, (None,))[0] == stamp)
+
+    def itervalues(self):
+        for stamp, value in self._items.itervalues():
+            yield value
+
+    def pop(self, key, *default):
+        try:
+            return self._items.pop(key)[1]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+
+    def popitem(self):
+        while self._order:
+            stamp, key = self._order.popleft()
+            item = self._items.get(key)
+            if item is not None and item[0] == stamp:
+                del self._items[key]
+                return key, item[1]
+        raise KeyError('popitem(): dictionary is empty')
+
+    def clear(self):
+        self._items.clear()
+        self._order.clear()
+
+class WorkflowCheckpoints(object):
+    """Per-vistrail LRU cache of current operation dictionaries.
+
+    """
+    def __init__(self, interval=DEFAULT_CHECKPOINT_INTERVAL,
+                 max_operations=DEFAULT_MAX_CACHED_OPERATIONS):
+        self.interval = interval
+        self.max_operations = max_operations
+        # version -> (action, depth, operation dict)
+        self._checkpoints = _LRUDict()
+        self._size = 0
+        self._children_count = {}
+        self._seen_actions = 0
+
+    def __len__(self):
+        return len(self._checkpoints)
+
+    def clear(self):
+        self._checkpoints.clear()
+        self._size = 0
+        self._children_count = {}
+        self._seen_actions = 0
+
+    def _update_children_count(self, vistrail):
+        actions = vistrail.db_actions
+        if len(actions) < self._seen_actions:
+            self._children_count = {}
+            self._seen_actions = 0
+        for action in actions[self._seen_actions:]:
+            prev_id = action.db_prevId
+            self._children_count[prev_id] = \
+                self._children_count.get(prev_id, 0) + 1
+        self._seen_actions = len(actions)
+
+    def _is_checkpoint(self, vistrail, version, depth):
+        if self.interval > 0 and depth % self.interval == 0:
+            return True
+        if self._children_count.get(version, 0) > 1:
+            return True
+        return vistrail.db_has_actionAnnotation_with_action_id(
+            (version, '__tag__'))
+
+    def _store(self, version, action, depth, op_dict):
+        if version in self._checkpoints:
+            self._size -= len(self._checkpoints.pop(version)[2])
+        if len(op_dict) > self.max_operations:
+            return
+        self._checkpoints[version] = (action, depth, dict(op_dict))
+        self._size += len(op_dict)
+        while self._size > self.max_operations:
+            _, (_, _, evicted) = self._checkpoints.popitem()
+            self._size -= len(evicted)
+
+    def _lookup(self, vistrail, version):
+        try:
+            entry = self._checkpoints.pop(version)
+        except KeyError:
+            return None
+        if vistrail.db_get_action_by_id(version) is not entry[0]:
+            # the action was replaced, the checkpoint is stale
+            self._size -= len(entry[2])
+            return None
+        # move to the most recently used end
+        self._checkpoints[version] = entry
+        return entry
+
+    def get_operation_dict(self, vistrail, version):
+        """get_operation_dict(vistrail: DBVistrail, version: long) -> dict
+        Returns a new dictionary equivalent to
+        getCurrentOperationDict(getActionChain(vistrail, version)).
+
+        """
+        self._update_children_count(vistrail)
+        chain = []
+        current = version
+        base = None
+        while current > 0:
+            base = self._lookup(vistrail, current)
+            if base is not None:
+                break
+            action = vistrail.db_get_action_by_id(current)
+            chain.append(action)
+            current = action.db_prevId
+
+        if base is not None:
+            depth = base[1]
+            op_dict = dict(base[2])
+        else:
+            depth = 0
+            op_dict = {}
+        if not chain:
+            return op_dict
+
+        chain.reverse()
+        for action in chain:
+            getCurrentOperationDict([action], op_dict)
+            depth += 1
+            if action.db_id == version or \
+                    self._is_checkpoint(vistrail, action.db_id, depth):
+                self._store(action.db_id, action, depth, op_dict)
+        return op_dict
+
+def get_workflow_checkpoints(vistrail):
+    """get_workflow_checkpoints(vistrail: DBVistrail) -> WorkflowCheckpoints
+    Returns the checkpoint cache attached to a vistrail, creating it if
+    necessary.
+
+    """
+    checkpoints = getattr(vistrail, '_workflow_checkpoints', None)
+    if checkpoints is None:
+        checkpoints = WorkflowCheckpoints()
+        vistrail._workflow_checkpoints = checkpoints
+    return checkpoints
+
+def clear_workflow_checkpoints(vistrail):
+    checkpoints = getattr(vistrail, '_workflow_checkpoints', None)
+    if checkpoints is not None:
+        checkpoints.clear()
+
+class WorkflowDiffCache(object):
+    """Per-vistrail LRU cache of diffs between pairs of versions.
+
+    Entries are keyed by a tuple whose first two items are the compared
+    versions; an entry is dropped if the action of either version was
+    replaced since it was stored.
+
+    """
+    def __init__(self, max_entries=DEFAULT_MAX_CACHED_DIFFS):
+        self.max_entries = max_entries
+        # key -> ((action 1, action 2), value)
+        self._entries = _LRUDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    @staticmethod
+    def _get_actions(vistrail, key):
+        index = vistrail.db_actions_id_index
+        return (index.get(key[0]), index.get(key[1]))
+
+    def get(self, vistrail, key):
+        try:
+            actions, value = self._entries.pop(key)
+        except KeyError:
+            return None
+        if any(a is not b for a, b in zip(actions,
+                                          self._get_actions(vistrail, key))):
+            return None
+        self._entries[key] = (actions, value)
+        return value
+
+    def put(self, vistrail, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = (self._get_actions(vistrail, key), value)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem()
+
+def get_workflow_diff_cache(vistrail):
+    """get_workflow_diff_cache(vistrail: DBVistrail) -> WorkflowDiffCache
+    Returns the diff cache attached to a vistrail, creating it if
+    necessary.
+
+    """
+    cache = getattr(vistrail, '_workflow_diff_cache', None)
+    if cache is None:
+        cache = WorkflowDiffCache()
+        vistrail._workflow_diff_cache = cache
+    return cache
+
+################################################################################
+
+class TestWorkflowCheckpoints(unittest.TestCase):
+    def get_vistrail(self):
+        from vistrails.core.db.locator import FileLocator
+        from vistrails.core.system import vistrails_root_directory
+        locator = FileLocator(vistrails_root_directory() +
+                              '/tests/resources/terminator.vt')
+        return locator.load().vistrail
+
+    def check_all_versions(self, vistrail, checkpoints):
+        from vistrails.db.services.action_chain import getActionChain
+        versions = sorted(vistrail.db_actions_id_index.keys())
+        for version in versions:
+            expected = getCurrentOperationDict(getActionChain(vistrail,
+                                                              version))
+            result = checkpoints.get_operation_dict(vistrail, version)
+            self.assertEqual(expected, result)
+
+    def test_matches_full_replay(self):
+        vistrail = self.get_vistrail()
+        checkpoints = WorkflowCheckpoints(interval=5)
+        self.check_all_versions(vistrail, checkpoints)
+        self.assertTrue(len(checkpoints) > 0)
+        # second pass hits the cache
+        self.check_all_versions(vistrail, checkpoints)
+
+    def test_bounded(self):
+        vistrail = self.get_vistrail()
+        checkpoints = WorkflowCheckpoints(interval=1, max_operations=100)
+        self.check_all_versions(vistrail, checkpoints)
+        self.assertTrue(checkpoints._size <= 100)
+        self.assertEqual(checkpoints._size,
+                         sum(len(e[2])
+                             for e in checkpoints._checkpoints.itervalues()))
+
+    def test_result_is_independent(self):
+        vistrail = self.get_vistrail()
+        checkpoints = WorkflowCheckpoints()
+        version = max(vistrail.db_actions_id_index.keys())
+        ops = checkpoints.get_operation_dict(vistrail, version)
+        ops.clear()
+        self.assertTrue(len(checkpoints.get_operation_dict(vistrail,
+                                                           version)) > 0)
+
+    def test_lru_dict(self):
+        d = _LRUDict()
+        for i in xrange(5):
+            d[i] = str(i)
+        for i in xrange(100):
+            d[1] = 'one'
+        self.assertEqual(d.pop(3), '3')
+        self.assertEqual(d.pop(3, None), None)
+        self.assertEqual(len(d), 4)
+        self.assertTrue(len(d._order) <= 2 * len(d) + 16)
+        self.assertEqual([d.popitem() for i in xrange(4)],
+                         [(0, '0'), (2, '2'), (4, '4'), (1, 'one')])
+        self.assertRaises(KeyError, d.popitem)
+
+    def test_diff_cache(self):
+        vistrail = self.get_vistrail()
+        versions = sorted(vistrail.db_actions_id_index.keys())
+        cache = WorkflowDiffCache(max_entries=2)
+        cache.put(vistrail, (versions[0], versions[1]), 'a')
+        cache.put(vistrail, (versions[1], versions[2]), 'b')
+        self.assertEqual(cache.get(vistrail, (versions[0], versions[1])), 'a')
+        cache.put(vistrail, (versions[2], versions[3]), 'c')
+        # least recently used entry was evicted
+        self.assertIsNone(cache.get(vistrail, (versions[1], versions[2])))
+        self.assertEqual(len(cache), 2)
+
+        # replaced actions invalidate the entries that use them
+        import copy
+        action = vistrail.db_get_action_by_id(versions[3])
+        vistrail.db_delete_action(action)
+        vistrail.db_add_action(copy.copy(action))
+        self.assertIsNone(cache.get(vistrail, (versions[2], versions[3])))
+        self.assertEqual(cache.get(vistrail, (versions[0], versions[1])), 'a')
+
+if __name__ == '__main__':
+    unittest.main()
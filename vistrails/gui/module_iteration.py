@@ -170,6 +170,19 @@ class QModuleIteration(QtGui.QDialog, QVistrailsPaletteInterface):
         whileLayout.addStretch(1)
         self.layout().addLayout(whileLayout)
 
+        layout = QtGui.QHBoxLayout()
+        self.threadsLabel = QtGui.QLabel("Threads:")
+        layout.addWidget(self.threadsLabel)
+        layout.setStretch(0, 0)
+        self.threadsEdit = QtGui.QLineEdit()
+        self.threadsEdit.setValidator(QtGui.QIntValidator(self))
+        self.threadsEdit.setToolTip('Number of iterations to run concurrently '
+                                    'if the module is thread-safe '
+                                    '(default: loopThreads option)')
+        layout.addWidget(self.threadsEdit)
+        layout.setStretch(1, 1)
+        self.layout().addLayout(layout)
+
         self.layout().addStretch(1)
         self.buttonLayout = QtGui.QHBoxLayout()
         self.buttonLayout.setMargin(5)
@@ -200,6 +213,7 @@ class QModuleIteration(QtGui.QDialog, QVistrailsPaletteInterface):
         self.delayEdit.textChanged.connect(self.stateChanged)
         self.feedInputEdit.textChanged.connect(self.stateChanged)
         self.feedOutputEdit.textChanged.connect(self.stateChanged)
+        self.threadsEdit.textChanged.connect(self.stateChanged)
 
     def sizeHint(self):
         """ sizeHint() -> QSize
@@ -287,6 +301,7 @@ class QModuleIteration(QtGui.QDialog, QVistrailsPaletteInterface):
             self.cartesianButton.setEnabled(False)
             self.customButton.setEnabled(False)
             self.whileButton.setEnabled(False)
+            self.threadsEdit.setEnabled(False)
             self.condEdit.setVisible(False)
             self.maxEdit.setVisible(False)
             self.delayEdit.setVisible(False)
@@ -307,6 +322,8 @@ class QModuleIteration(QtGui.QDialog, QVistrailsPaletteInterface):
 
         self.whileButton.setEnabled(True)
         self.whileButton.setChecked(False)
+        self.threadsEdit.setEnabled(True)
+        self.threadsEdit.setText('')
         self.condEdit.setVisible(False)
         self.maxEdit.setVisible(False)
         self.delayEdit.setVisible(False)
@@ -345,6 +362,9 @@ class QModuleIteration(QtGui.QDialog, QVistrailsPaletteInterface):
         if module.has_control_parameter_with_name(ModuleControlParam.WHILE_OUTPUT_KEY):
             output = module.get_control_parameter_by_name(ModuleControlParam.WHILE_OUTPUT_KEY).value
             self.feedOutputEdit.setText(output)
+        if module.has_control_parameter_with_name(ModuleControlParam.LOOP_THREADS_KEY):
+            threads = module.get_control_parameter_by_name(ModuleControlParam.LOOP_THREADS_KEY).value
+            self.threadsEdit.setText(threads)
 
     def updateVistrail(self):
         values = []
@@ -366,6 +386,8 @@ class QModuleIteration(QtGui.QDialog, QVistrailsPaletteInterface):
                        _while and self.feedInputEdit.text()))
         values.append((ModuleControlParam.WHILE_OUTPUT_KEY,
                        _while and self.feedOutputEdit.text()))
+        values.append((ModuleControlParam.LOOP_THREADS_KEY,
+                       self.threadsEdit.text()))
         for name, value in values:
             if value:
                 if not self.module.has_control_parameter_with_name(name) or \
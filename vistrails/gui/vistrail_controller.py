@@ -325,7 +325,7 @@ class VistrailController(QtCore.QObject, BaseController):
         if action is not None:
             BaseController.add_new_action(self, action, description)
             self.emit(QtCore.SIGNAL("new_action"), action)
-            self.recompute_terse_graph()
+            self.update_terse_graph([action.db_id])
 
     ##########################################################################
 
@@ -626,6 +626,12 @@ class VistrailController(QtCore.QObject, BaseController):
         self._current_graph_layout.layout_from(self.vistrail,
                                                self._current_terse_graph)
 
+    def update_terse_graph(self, versions):
+        BaseController.update_terse_graph(self, versions)
+        self._previous_graph_layout = copy.deepcopy(self._current_graph_layout)
+        self._current_graph_layout.layout_from(self.vistrail,
+                                               self._current_terse_graph)
+
     def refine_graph(self, step=1.0):
         """ refine_graph(step: float in [0,1]) -> (Graph, Graph)        
         Refine the graph of the current vistrail based the search
@@ -799,6 +805,7 @@ class VistrailController(QtCore.QObject, BaseController):
             full = self._current_full_graph
         changed = False
         new_current_version = None
+        pruned = []
         for v in versions:
             if v!=0: # not root
                 highest = v
@@ -814,11 +821,12 @@ class VistrailController(QtCore.QObject, BaseController):
                     if highest == self.current_version:
                         new_current_version = full.parent(highest)
                 self.vistrail.pruneVersion(highest)
+                pruned.append(highest)
         if changed:
             self.set_changed(True)
         if new_current_version is not None:
             self.change_selected_version(new_current_version)
-        self.recompute_terse_graph()
+        self.update_terse_graph(pruned)
         self.invalidate_version_tree(False)
 
     def hide_versions_below(self, v=None):
@@ -834,6 +842,7 @@ class VistrailController(QtCore.QObject, BaseController):
         am = self.vistrail.actionMap
 
         changed = False
+        hidden = []
 
         while 1:
             try:
@@ -845,6 +854,7 @@ class VistrailController(QtCore.QObject, BaseController):
                         if (to in am) and \
                             not self.vistrail.is_pruned(to)]
             self.vistrail.hideVersion(current)
+            hidden.append(current)
             changed = True
 
             for child in children:
@@ -852,7 +862,7 @@ class VistrailController(QtCore.QObject, BaseController):
 
         if changed:
             self.set_changed(True)
-        self.recompute_terse_graph()
+        self.update_terse_graph(hidden)
         self.invalidate_version_tree(False, False) 
 
     def show_all_versions(self):
@@ -875,14 +885,16 @@ class VistrailController(QtCore.QObject, BaseController):
         """
         full = self.vistrail.getVersionGraph()
         changed = False
+        expanded = []
         p = full.parent(v2)
         while p>v1:
             self.vistrail.expandVersion(p)
+            expanded.append(p)
             changed = True
             p = full.parent(p)
         if changed:
             self.set_changed(True)
-        self.recompute_terse_graph()
+        self.update_terse_graph(expanded)
         self.invalidate_version_tree(False, True)
 
     def collapse_versions(self, v):
@@ -897,6 +909,7 @@ class VistrailController(QtCore.QObject, BaseController):
         tm = self.vistrail.get_tagMap()
 
         changed = False
+        collapsed = []
 
         while 1:
             try:
@@ -909,6 +922,7 @@ class VistrailController(QtCore.QObject, BaseController):
             if len(children) > 1:
                 break;
             self.vistrail.collapseVersion(current)
+            collapsed.append(current)
             changed = True
 
             for child in children:
@@ -918,7 +932,7 @@ class VistrailController(QtCore.QObject, BaseController):
 
         if changed:
             self.set_changed(True)
-        self.recompute_terse_graph()
+        self.update_terse_graph(collapsed)
         self.invalidate_version_tree(False, True) 
 
     def expand_or_collapse_all_versions_below(self, v=None, expand=True):
@@ -935,6 +949,7 @@ class VistrailController(QtCore.QObject, BaseController):
         am = self.vistrail.actionMap
 
         changed = False
+        versions = []
 
         while 1:
             try:
@@ -948,6 +963,7 @@ class VistrailController(QtCore.QObject, BaseController):
                 self.vistrail.expandVersion(current)
             else:
                 self.vistrail.collapseVersion(current)
+            versions.append(current)
             changed = True
 
             for child in children:
@@ -955,7 +971,7 @@ class VistrailController(QtCore.QObject, BaseController):
 
         if changed:
             self.set_changed(True)
-        self.recompute_terse_graph()
+        self.update_terse_graph(versions)
         self.invalidate_version_tree(False, True) 
 
     def expand_all_versions_below(self, v=None):
@@ -1011,7 +1027,7 @@ class VistrailController(QtCore.QObject, BaseController):
                          "Please enter a different one." % tag)
             return False
         self.set_changed(True)
-        self.recompute_terse_graph()
+        self.update_terse_graph([self.current_version])
         self.invalidate_version_tree(False)
         return True
 
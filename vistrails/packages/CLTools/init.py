@@ -370,7 +370,8 @@ def add_tool(path):
                                            "__doc__": d})
     reg = vistrails.core.modules.module_registry.get_module_registry()
     reg.add_module(M, package=identifiers.identifier,
-                   package_version=identifiers.version)
+                   package_version=identifiers.version,
+                   thread_safe=True)
 
     def to_vt_type(s):
         # add recognized types here - default is String
@@ -0,0 +1,409 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+
+"""Download engine used by the URL package.
+
+Files are streamed to disk in large chunks. A download first goes to a
+'.part' file next to the cache entry, and is moved into place once it is
+complete; if it is interrupted, the next attempt resumes it with a Range
+request, guarded by an If-Range header so that a file changed on the
+server is fetched again from the start.
+
+The ETag and Last-Modified headers of a cache entry are stored next to it
+('.etag' and '.last-modified' files) and sent back as If-None-Match and
+If-Modified-Since, so that unchanged files are not transferred again.
+
+fetch_many() downloads several files on a bounded pool of threads.
+"""
+
+import email.utils
+import os
+import urllib2
+from multiprocessing.pool import ThreadPool
+
+from .https_if_available import build_opener
+
+
+CHUNK_SIZE = 256 * 1024
+
+VALIDATORS = (('etag', 'ETag'),
+              ('last-modified', 'Last-Modified'))
+
+
+def read_validators(filename):
+    """read_validators(filename: str) -> dict
+    Reads the validators stored next to the given file.
+    """
+    validators = {}
+    for ext, header in VALIDATORS:
+        try:
+            with open('%s.%s' % (filename, ext), 'rb') as fp:
+                value = fp.read()
+        except IOError:
+            continue
+        if value:
+            validators[header] = value
+    return validators
+
+
+def write_validators(filename, headers):
+    """write_validators(filename: str, headers) -> None
+    Stores the validators found in the given response headers next to the
+    file.
+    """
+    for ext, header in VALIDATORS:
+        value = headers.get(header)
+        validator_file = '%s.%s' % (filename, ext)
+        if value:
+            with open(validator_file, 'wb') as fp:
+                fp.write(value)
+        elif os.path.exists(validator_file):
+            os.remove(validator_file)
+
+
+def remove_file(filename, validators=True):
+    names = [filename]
+    if validators:
+        names.extend('%s.%s' % (filename, ext) for ext, header in VALIDATORS)
+    for name in names:
+        try:
+            os.remove(name)
+        except OSError:
+            pass
+
+
+def copy_response(response, fp, chunk_size=CHUNK_SIZE, progress=None,
+                  offset=0, total=None):
+    """copy_response(response, fp, ...) -> int
+    Streams the body of a response to a file object, calling
+    progress(fraction) if the total size is known. Returns the number of
+    bytes written.
+    """
+    size = offset
+    while True:
+        chunk = response.read(chunk_size)
+        if not chunk:
+            break
+        fp.write(chunk)
+        size += len(chunk)
+        if progress is not None and total:
+            progress(size * 1.0 / total)
+    return size - offset
+
+
+class DownloadEngine(object):
+    """Downloads files into a local cache, reusing and resuming entries.
+    """
+    def __init__(self, opener=None, insecure=False, chunk_size=CHUNK_SIZE,
+                 max_workers=4):
+        if opener is None:
+            opener = build_opener(insecure=insecure)
+        self.opener = opener
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+
+    def fetch(self, url, local_filename, progress=None):
+        """fetch(url: str, local_filename: str, progress=None) -> bool
+        Makes local_filename an up-to-date copy of url. Returns False if
+        the cached copy could be used, True if the file was downloaded.
+
+        Network errors are raised as urllib2.URLError.
+        """
+        part_filename = local_filename + '.part'
+        if os.path.isfile(part_filename):
+            resume = read_validators(part_filename)
+            offset = os.path.getsize(part_filename)
+        else:
+            resume = None
+            offset = 0
+
+        request = urllib2.Request(url)
+        cached = None
+        if resume and offset:
+            # Resume the partial download if it is still the same file
+            request.add_header('Range', 'bytes=%d-' % offset)
+            request.add_header('If-Range',
+                               resume.get('ETag') or resume['Last-Modified'])
+        elif os.path.isfile(local_filename):
+            cached = read_validators(local_filename)
+            if 'ETag' in cached:
+                request.add_header('If-None-Match', cached['ETag'])
+            if 'Last-Modified' not in cached:
+                # Entries cached by older versions only have an ETag
+                cached['Last-Modified'] = email.utils.formatdate(
+                        os.path.getmtime(local_filename), usegmt=True)
+            request.add_header('If-Modified-Since', cached['Last-Modified'])
+
+        try:
+            response = self.opener.open(request)
+        except urllib2.HTTPError, e:
+            if e.code == 304 and cached is not None:
+                # Not modified
+                return False
+            elif e.code == 416 and resume:
+                # The partial file is not a prefix of the remote one
+                remove_file(part_filename)
+                return self.fetch(url, local_filename, progress)
+            raise
+
+        try:
+            headers = response.info()
+            if cached and self._matches(cached, headers):
+                # Server ignored the conditional request
+                return False
+            if getattr(response, 'code', 200) == 206:
+                mode = 'ab'
+            else:
+                mode = 'wb'
+                offset = 0
+            total = self._total_size(headers, offset)
+            write_validators(part_filename, headers)
+            with open(part_filename, mode) as fp:
+                copy_response(response, fp, self.chunk_size, progress,
+                              offset, total)
+        finally:
+            response.close()
+
+        remove_file(local_filename)
+        os.rename(part_filename, local_filename)
+        for ext, header in VALIDATORS:
+            if os.path.exists('%s.%s' % (part_filename, ext)):
+                os.rename('%s.%s' % (part_filename, ext),
+                          '%s.%s' % (local_filename, ext))
+        return True
+
+    @staticmethod
+    def _matches(validators, headers):
+        etag = headers.get('ETag')
+        if etag and 'ETag' in validators:
+            return etag == validators['ETag']
+        last_modified = headers.get('Last-Modified')
+        if last_modified and 'Last-Modified' in validators:
+            return last_modified == validators['Last-Modified']
+        return False
+
+    @staticmethod
+    def _total_size(headers, offset):
+        try:
+            return offset + int(headers['Content-Length'])
+        except (KeyError, ValueError, TypeError):
+            return None
+
+    def fetch_many(self, downloads):
+        """fetch_many(downloads: [(str, str)]) -> [bool]
+        Fetches several (url, local_filename) pairs concurrently, returning
+        the results of fetch() in the same order.
+        """
+        downloads = list(downloads)
+        if len(downloads) <= 1 or self.max_workers <= 1:
+            return [self.fetch(url, filename) for url, filename in downloads]
+        pool = ThreadPool(min(self.max_workers, len(downloads)))
+        try:
+            return pool.map(lambda (url, filename): self.fetch(url, filename),
+                            downloads)
+        finally:
+            pool.close()
+            pool.join()
+
+
+###############################################################################
+
+import threading
+import unittest
+
+
+class FileServer(object):
+    """Local stand-in for a web server, serving a dict of files.
+
+    It honors ETag, Last-Modified, conditional and Range requests, and
+    records the requests it receives.
+    """
+    def __init__(self, files=None):
+        import BaseHTTPServer
+
+        self.files = dict(files or {})
+        self.requests = []
+        self.accept_ranges = True
+        server = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.requests.append((self.path, dict(self.headers)))
+                entry = server.files.get(self.path)
+                if entry is None:
+                    self.send_error(404)
+                    return
+                if isinstance(entry, str):
+                    entry = (entry, '"%x"' % hash(entry),
+                             'Mon, 01 Jan 2001 00:00:00 GMT', None)
+                data, etag, last_modified, content_type = entry
+                # If-None-Match takes precedence (RFC 7232)
+                if 'If-None-Match' in self.headers:
+                    not_modified = self.headers['If-None-Match'] == etag
+                else:
+                    not_modified = (self.headers.get('If-Modified-Since') ==
+                                    last_modified)
+                if not_modified:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                start = 0
+                byte_range = self.headers.get('Range')
+                if (server.accept_ranges and byte_range and
+                        self.headers.get('If-Range') in (etag,
+                                                         last_modified)):
+                    start = int(byte_range[6:-1])
+                    if start >= len(data):
+                        self.send_error(416)
+                        return
+                    self.send_response(206)
+                    self.send_header('Content-Range', 'bytes %d-%d/%d' % (
+                            start, len(data) - 1, len(data)))
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Type',
+                                 content_type or 'application/octet-stream')
+                self.send_header('Content-Length', str(len(data) - start))
+                self.send_header('ETag', etag)
+                self.send_header('Last-Modified', last_modified)
+                self.end_headers()
+                self.wfile.write(data[start:])
+
+        self.httpd = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    @staticmethod
+    def opener():
+        # Don't go through a proxy to reach the local server
+        return urllib2.build_opener(urllib2.ProxyHandler({}))
+
+
+class TestDownloadEngine(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp(prefix='vt_test_download_')
+        self.data = ''.join(chr(i % 251) for i in xrange(100000))
+        self.server = FileServer({'/data': self.data})
+        self.engine = DownloadEngine(FileServer.opener(), chunk_size=4096)
+        self.filename = os.path.join(self.directory, 'data')
+
+    def tearDown(self):
+        import shutil
+        self.server.close()
+        shutil.rmtree(self.directory)
+
+    def read(self, filename):
+        with open(filename, 'rb') as fp:
+            return fp.read()
+
+    def test_validators(self):
+        url = self.server.url + '/data'
+        progress = []
+        self.assertTrue(self.engine.fetch(url, self.filename,
+                                          progress.append))
+        self.assertEqual(self.read(self.filename), self.data)
+        self.assertEqual(progress[-1], 1.0)
+        self.assertEqual(read_validators(self.filename),
+                         {'ETag': '"%x"' % hash(self.data),
+                          'Last-Modified': 'Mon, 01 Jan 2001 00:00:00 GMT'})
+        self.assertFalse(os.path.exists(self.filename + '.part'))
+
+        # Unchanged: not transferred again
+        self.assertFalse(self.engine.fetch(url, self.filename))
+        headers = self.server.requests[-1][1]
+        self.assertEqual(headers['if-none-match'], '"%x"' % hash(self.data))
+
+        # Changed on the server
+        self.server.files['/data'] = 'new data'
+        self.assertTrue(self.engine.fetch(url, self.filename))
+        self.assertEqual(self.read(self.filename), 'new data')
+
+    def test_resume(self):
+        url = self.server.url + '/data'
+        part = self.filename + '.part'
+        with open(part, 'wb') as fp:
+            fp.write(self.data[:30000])
+        write_validators(part, {'ETag': '"%x"' % hash(self.data)})
+        self.assertTrue(self.engine.fetch(url, self.filename))
+        self.assertEqual(self.read(self.filename), self.data)
+        headers = self.server.requests[-1][1]
+        self.assertEqual(headers['range'], 'bytes=30000-')
+        self.assertFalse(os.path.exists(part))
+        self.assertFalse(os.path.exists(part + '.etag'))
+
+        # The file changed since the partial download: start over
+        with open(part, 'wb') as fp:
+            fp.write('old')
+        write_validators(part, {'ETag': '"old"'})
+        self.assertTrue(self.engine.fetch(url, self.filename))
+        self.assertEqual(self.read(self.filename), self.data)
+
+        # Server doesn't support ranges
+        self.server.accept_ranges = False
+        with open(part, 'wb') as fp:
+            fp.write(self.data[:10])
+        write_validators(part, {'ETag': '"%x"' % hash(self.data)})
+        self.assertTrue(self.engine.fetch(url, self.filename))
+        self.assertEqual(self.read(self.filename), self.data)
+
+    def test_missing(self):
+        self.assertRaises(urllib2.HTTPError, self.engine.fetch,
+                          self.server.url + '/missing', self.filename)
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_fetch_many(self):
+        for i in xrange(10):
+            self.server.files['/f%d' % i] = 'file %d' % i
+        downloads = [(self.server.url + '/f%d' % i,
+                      os.path.join(self.directory, 'f%d' % i))
+                     for i in xrange(10)]
+        self.assertEqual(self.engine.fetch_many(downloads), [True] * 10)
+        for i in xrange(10):
+            self.assertEqual(self.read(downloads[i][1]), 'file %d' % i)
+        self.assertEqual(self.engine.fetch_many(downloads), [False] * 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,11 @@
 # https://gist.github.com/remram44/6540454
 
 from HTMLParser import HTMLParser
+from multiprocessing.pool import ThreadPool
 import os
 import re
 
+from .download import copy_response
 from .https_if_available import build_opener
 
 
@@ -54,24 +56,30 @@ class ListingParser(HTMLParser):
                     break
 
 
-def download_directory(url, target, insecure=False):
-    def mkdir():
-        if not mkdir.done:
-            try:
-                os.mkdir(target)
-            except OSError:
-                pass
-            mkdir.done = True
-    mkdir.done = False
+def download_directory(url, target, insecure=False, max_workers=4,
+                       opener=None):
+    """Downloads the files linked from the HTML listing at url into target.
 
-    opener = build_opener(insecure=insecure)
-    response = opener.open(url)
+    The listings and files of each level of the hierarchy are fetched
+    concurrently, on up to max_workers threads.
+    """
+    if opener is None:
+        opener = build_opener(insecure=insecure)
 
-    if response.info().type == 'text/html':
-        contents = response.read()
+    def visit((url, target)):
+        response = opener.open(url)
+        try:
+            if response.info().type != 'text/html':
+                with open(target, 'wb') as fp:
+                    copy_response(response, fp)
+                return []
+            contents = response.read()
+        finally:
+            response.close()
 
         parser = ListingParser(url)
         parser.feed(contents)
+        children = []
         for link in parser.links:
             link = resolve_link(link, url)
             if link[-1] == '/':
@@ -81,9 +89,13 @@ def download_directory(url, target, insecure=False):
             name = link.rsplit('/', 1)[1]
             if '?' in name:
                 continue
-            mkdir()
-            download_directory(link, os.path.join(target, name), insecure)
-        if not mkdir.done:
+            children.append((link, os.path.join(target, name)))
+        if children:
+            try:
+                os.mkdir(target)
+            except OSError:
+                pass
+        else:
             # We didn't find anything to write inside this directory
             # Maybe it's a HTML file?
             if url[-1] != '/':
@@ -92,13 +104,23 @@ def download_directory(url, target, insecure=False):
                     target = target + '.html'
                 with open(target, 'wb') as fp:
                     fp.write(contents)
-    else:
-        buffer_size = 4096
-        with open(target, 'wb') as fp:
-            chunk = response.read(buffer_size)
-            while chunk:
-                fp.write(chunk)
-                chunk = response.read(buffer_size)
+        return children
+
+    pending = [(url, target)]
+    pool = None
+    try:
+        while pending:
+            if len(pending) > 1 and max_workers > 1:
+                if pool is None:
+                    pool = ThreadPool(max_workers)
+                results = pool.map(visit, pending)
+            else:
+                results = map(visit, pending)
+            pending = [child for children in results for child in children]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
 
 ###############################################################################
@@ -175,3 +197,41 @@ Index of /test</title></head><body><h1>Index of /test</h1><table><tr><th>
                 'http://a.remram.fr/cc/',
                 'http://a.remram.fr/dd',
         ]))
+
+
+class TestDownloadDirectory(unittest.TestCase):
+    def test_local_server(self):
+        import shutil
+        import tempfile
+        from .download import FileServer
+
+        def listing(*names):
+            return ('<html><body>%s</body></html>' %
+                    ''.join('<a href="%s">%s</a>' % (n, n) for n in names),
+                    '"listing"', 'Mon, 01 Jan 2001 00:00:00 GMT',
+                    'text/html')
+        files = {'/test/': listing('a', 'b', 'sub/', '/', '?C=N;O=D'),
+                 '/test/sub': listing('c', 'd.html'),
+                 '/test/sub/d.html': listing()}
+        for name in ('a', 'b', 'sub/c'):
+            files['/test/' + name] = 'data ' + name
+        server = FileServer(files)
+        testdir = tempfile.mkdtemp(prefix='vt_test_http_')
+        try:
+            download_directory(server.url + '/test/', testdir,
+                               opener=FileServer.opener())
+            contents = {}
+            for dirpath, dirnames, filenames in os.walk(testdir):
+                for name in filenames:
+                    filename = os.path.join(dirpath, name)
+                    with open(filename, 'rb') as fp:
+                        relpath = os.path.relpath(filename, testdir)
+                        contents[relpath.replace(os.sep, '/')] = fp.read()
+            self.assertEqual(contents, {'a': 'data a',
+                                        'b': 'data b',
+                                        'sub/c': 'data sub/c',
+                                        'sub/d.html': files['/test/sub/'
+                                                            'd.html'][0]})
+        finally:
+            server.close()
+            shutil.rmtree(testdir)
@@ -43,8 +43,6 @@ way, files that haven't been changed do not need to be downloaded again. The
 check is performed efficiently using HTTP headers.
 """
 
-from datetime import datetime
-import email.utils
 import hashlib
 import os
 import re
@@ -56,9 +54,10 @@ from vistrails.core.configuration import get_vistrails_persistent_configuration
 from vistrails.core import debug
 import vistrails.core.modules.basic_modules
 from vistrails.core.modules.basic_modules import PathObject
+from vistrails.core.modules.config import ModuleSettings
 import vistrails.core.modules.module_registry
 from vistrails.core.modules.vistrails_module import Module, ModuleError
-from vistrails.core.system import current_dot_vistrails, strptime
+from vistrails.core.system import current_dot_vistrails
 from vistrails.core.upgradeworkflow import UpgradeWorkflowHandler
 import vistrails.gui.repository
 from vistrails.gui.utils import show_warning
@@ -67,6 +66,7 @@ from vistrails.core.repository.poster.encode import multipart_encode
 from vistrails.core.repository.poster.streaminghttp import register_openers
 
 from .identifiers import identifier
+from .download import DownloadEngine, copy_response
 from .http_directory import download_directory
 from .https_if_available import build_opener
 
@@ -131,21 +131,12 @@ class Downloader(object):
         return True
 
     def download(self, response):
+        def progress(fraction):
+            self.module.logging.update_progress(self.module, fraction)
         try:
-            dl_size = 0
-            CHUNKSIZE = 4096
-            f2 = open(self.local_filename, 'wb')
-            while True:
-                if self.size_header is not None:
-                    self.module.logging.update_progress(
-                            self.module,
-                            dl_size*1.0/self.size_header)
-                chunk = response.read(CHUNKSIZE)
-                if not chunk:
-                    break
-                dl_size += len(chunk)
-                f2.write(chunk)
-            f2.close()
+            with open(self.local_filename, 'wb') as f2:
+                copy_response(response, f2, progress=progress,
+                              total=self.size_header)
             response.close()
 
         except Exception, e:
@@ -166,81 +157,32 @@ class Downloader(object):
 
 
 class HTTPDownloader(Downloader):
-    def pre_download(self):
-        # Get ETag from disk
-        try:
-            with open(self.local_filename + '.etag') as etag_file:
-                self.etag = etag_file.read()
-        except IOError:
-            self.etag = None
-
-    def send_request(self):
-        try:
-            request = urllib2.Request(self.url)
-            if self.etag is not None:
-                request.add_header(
-                    'If-None-Match',
-                    self.etag)
-            try:
-                mtime = email.utils.formatdate(
-                        os.path.getmtime(self.local_filename),
-                        usegmt=True)
-                request.add_header(
-                    'If-Modified-Since',
-                    mtime)
-            except OSError:
-                pass
-            return self.opener.open(request)
-        except urllib2.HTTPError, e:
-            if e.code == 304:
-                # Not modified
-                return None
-            raise
-
-    def read_headers(self, response):
-        try:
-            self.mod_header = response.headers['last-modified']
-        except KeyError:
-            self.mod_header = None
-        try:
-            size_header = response.headers['content-length']
-            if not size_header:
-                raise ValueError
-            self.size_header = int(size_header)
-        except (KeyError, ValueError):
-            self.size_header = None
-        return True
-
-    def _is_outdated(self):
-        local_time = datetime.utcfromtimestamp(
-                os.path.getmtime(self.local_filename))
+    """Downloads HTTP files through the DownloadEngine, which revalidates
+    the cached copy and resumes interrupted downloads.
+    """
+    def execute(self):
+        self.local_filename = os.path.join(package_directory,
+                                           urllib.quote_plus(self.url))
+        engine = DownloadEngine(self.opener)
         try:
-            remote_time = strptime(self.mod_header,
-                                   "%a, %d %b %Y %H:%M:%S %Z")
-        except ValueError:
-            try:
-                remote_time = strptime(self.mod_header,
-                                       "%a, %d %B %Y %H:%M:%S %Z")
-            except ValueError:
-                # unable to parse last-modified header, download file again
-                debug.warning("Unable to parse Last-Modified header, "
-                              "downloading file")
-                return True
-        return remote_time > local_time
-
-    def download(self, response):
-        if (not self.is_in_local_cache or
-                not self.mod_header or self._is_outdated()):
-            Downloader.download(self, response)
+            engine.fetch(self.url, self.local_filename, self.update_progress)
+        except urllib2.URLError, e:
+            if self.is_in_local_cache:
+                debug.warning("A network error occurred. DownloadFile will "
+                              "use a cached version of the file")
+                return self.local_filename
+            else:
+                raise ModuleError(
+                        self.module,
+                        "Network error: %s" % debug.format_exception(e))
+        except (IOError, OSError), e:
+            raise ModuleError(
+                    self.module,
+                    "Error retrieving URL: %s" % debug.format_exception(e))
+        return self.local_filename
 
-    def post_download(self, response):
-        try:
-            etag = response.headers['ETag']
-        except KeyError:
-            pass
-        else:
-            with open(self.local_filename + '.etag', 'w') as etag_file:
-                etag = etag_file.write(etag)
+    def update_progress(self, fraction):
+        self.module.logging.update_progress(self.module, fraction)
 
 
 class SSHDownloader(object):
@@ -368,6 +310,7 @@ class DownloadFile(Module):
             (to the user's home directory) and that no username or port can
             be specified
     """
+    _settings = ModuleSettings(thread_safe=True)
 
     def compute(self):
         self.check_input('url')
@@ -524,8 +467,8 @@ class RepoSync(Module):
                 if not self._file_is_in_local_cache(local_filename):
                     # file not in cache, download.
                     try:
-                        urllib.urlretrieve(self.url, local_filename)
-                    except IOError, e:
+                        DownloadEngine().fetch(self.url, local_filename)
+                    except (urllib2.URLError, IOError, OSError), e:
                         raise ModuleError(self, ("Invalid URL: %s" % e))
                 out_file = PathObject(local_filename)
                 debug.warning('RepoSync is using repository data')
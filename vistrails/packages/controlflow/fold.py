@@ -33,9 +33,12 @@
 ##
 ###############################################################################
 from vistrails.core import debug
+from vistrails.core.interpreter.parallel import QueuedModuleLogging, \
+    ThreadCalls
 from vistrails.core.modules.basic_modules import create_constant, get_module
 from vistrails.core.modules.vistrails_module import Module, ModuleError, \
-    ModuleConnector, InvalidOutput, ModuleSuspended, ModuleWasSuspended
+    ModuleConnector, InvalidOutput, ModuleSuspended, ModuleWasSuspended, \
+    map_iterations
 from vistrails.core.modules.basic_modules import Boolean, String, Integer, \
     Float, Constant, List
 from vistrails.core.modules.module_registry import get_module_registry
@@ -153,6 +156,13 @@ class FoldWithModule(Fold):
         else:
             element_is_iter = True
             inputList = rawInputList
+        connectors = self.inputPorts.get('FunctionPort')
+        max_workers = self.get_loop_threads([connector.obj
+                                             for connector in connectors])
+        if max_workers > 1 and len(inputList) > 1:
+            return self.updateFunctionPortConcurrently(
+                    nameInput, nameOutput, inputList, element_is_iter,
+                    max_workers)
         suspended = []
         loop = self.logging.begin_loop_execution(self, len(inputList))
         ## Update everything for each value inside the list
@@ -206,6 +216,78 @@ class FoldWithModule(Fold):
                     children=suspended)
         loop.end_loop_execution()
 
+    def updateFunctionPortConcurrently(self, nameInput, nameOutput, inputList,
+                                       element_is_iter, max_workers):
+        """
+        Version of updateFunctionPort() updating the modules connected to the
+        FunctionPort port for max_workers elements at a time, on a pool of
+        threads. The operation is still applied to the results in order.
+        """
+        calls = ThreadCalls()
+        logging = QueuedModuleLogging(self.logging, calls)
+        loop = logging.begin_loop_execution(self, len(inputList))
+        connectors = self.inputPorts.get('FunctionPort')
+        if not self.upToDate: # pragma: no branch
+            ## Type checking
+            for connector in connectors:
+                self.typeChecking(connector.obj, nameInput, inputList)
+
+        def iteration(i):
+            suspended = []
+            result = None
+            for connector in connectors:
+                module = copy.copy(connector.obj)
+                module.logging = QueuedModuleLogging(connector.obj.logging,
+                                                     calls)
+
+                if not self.upToDate: # pragma: no branch
+                    module.upToDate = False
+                    module.computed = False
+
+                    self.setInputValues(module, nameInput, inputList[i], i)
+
+                loop.begin_iteration(module, i)
+
+                try:
+                    module.update()
+                except ModuleSuspended, e:
+                    suspended.append(e)
+                    loop.end_iteration(module)
+                    continue
+
+                loop.end_iteration(module)
+
+                ## Getting the result from the output port
+                if nameOutput not in module.outputPorts:
+                    raise ModuleError(module,
+                                      'Invalid output port: %s' % nameOutput)
+                result = module.get_output(nameOutput)
+            return suspended, result
+
+        suspended = []
+        for i, (iteration_suspended, result) in enumerate(
+                map_iterations(iteration, len(inputList), max_workers,
+                               calls)):
+            if element_is_iter:
+                self.element = inputList[i]
+            else:
+                self.element = inputList[i][0]
+            if iteration_suspended:
+                suspended.extend(iteration_suspended)
+            else:
+                self.elementResult = result
+                self.operation()
+
+            logging.update_progress(self, (i + 1.0) / len(inputList))
+
+        if suspended:
+            raise ModuleSuspended(
+                    self,
+                    "function module suspended in %d/%d iterations" % (
+                            len(suspended), len(inputList)),
+                    children=suspended)
+        loop.end_loop_execution()
+
     def compute(self):
         """The compute method for the Fold."""
 
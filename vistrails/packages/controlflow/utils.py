@@ -201,6 +201,55 @@ class TestMap(unittest.TestCase):
                 ]))
         self.assertEqual(results, [[3, 11, 1]])
 
+    def test_concurrent(self):
+        import threading
+        from vistrails.core.configuration import get_vistrails_configuration
+        from vistrails.core.modules.module_registry import get_module_registry
+
+        src = urllib2.quote('import time\n'
+                            'time.sleep(0.01 * (10 - i))\n'
+                            'o = i + 1')
+        descriptor = get_module_registry().get_descriptor_by_name(
+                'org.vistrails.vistrails.basic', 'PythonSource')
+        configuration = get_vistrails_configuration()
+        old_threads = configuration.check('loopThreads')
+        old_thread_safe = descriptor.thread_safe
+        threads = set()
+        def compute(module):
+            threads.add(threading.current_thread().ident)
+            old_compute(module)
+        old_compute = descriptor.module.compute
+        descriptor.module.compute = compute
+        descriptor.thread_safe = True
+        configuration.loopThreads = 4
+        try:
+            with intercept_result(Map, 'Result') as results:
+                self.assertFalse(execute([
+                        ('PythonSource', 'org.vistrails.vistrails.basic', [
+                            ('source', [('String', src)]),
+                        ]),
+                        ('Map', 'org.vistrails.vistrails.control_flow', [
+                            ('InputPort', [('List', "['i']")]),
+                            ('OutputPort', [('String', 'o')]),
+                            ('InputList', [('List', '[1, 2, 3, 4, 5, 6]')]),
+                        ]),
+                    ],
+                    [
+                        (0, 'self', 1, 'FunctionPort'),
+                    ],
+                    add_port_specs=[
+                        (0, 'input', 'i',
+                         'org.vistrails.vistrails.basic:Integer'),
+                        (0, 'output', 'o',
+                         'org.vistrails.vistrails.basic:Integer'),
+                    ]))
+        finally:
+            descriptor.module.compute = old_compute
+            descriptor.thread_safe = old_thread_safe
+            configuration.loopThreads = old_threads
+        self.assertEqual(results, [[2, 3, 4, 5, 6, 7]])
+        self.assertGreater(len(threads), 1)
+
 
 class TestUtils(unittest.TestCase):
     def test_filter(self):
@@ -41,4 +41,5 @@ configuration = ConfigurationObject(global_db=(None, str),
                                     git_bin=(None, str),
                                     search_dbs=(None, str),
                                     compress_by_default=False,
-                                    debug=False)
+                                    debug=False,
+                                    hash_threads=4)
@@ -34,6 +34,7 @@
 ###############################################################################
 
 import os
+import time
 try:
     import hashlib
     sha_hash = hashlib.sha1
@@ -41,7 +42,17 @@ except ImportError:
     import sha
     sha_hash = sha.new
 
-def compute_hash(persistent_path, is_dir=None):
+from hash_cache import file_stamp, get_hash_cache, \
+    RECENT_MODIFICATION_DELAY
+
+def compute_hash(persistent_path, is_dir=None, cache=None):
+    """compute_hash(persistent_path: str, is_dir: bool,
+                    cache: HashCache) -> str
+    Returns the SHA-1 of a file, or of the names and contents of all
+    the files in a directory. The digest is reused from the hash cache
+    if none of the files changed.
+
+    """
     def hash_file(filename, hasher):
         f = open(filename, 'rb')
         while True:
@@ -50,6 +61,13 @@ def compute_hash(persistent_path, is_dir=None):
                 break
             hasher.update(block)
 
+    def file_hash(filename):
+        hasher = sha_hash()
+        hash_file(filename, hasher)
+        return hasher.hexdigest()
+
+    if cache is None:
+        cache = get_hash_cache()
     sha_hasher = sha_hash()
     if is_dir is None:
         is_dir = os.path.isdir(persistent_path)
@@ -67,15 +85,34 @@ def compute_hash(persistent_path, is_dir=None):
                 else:
                     fnames.append(name)
 
+        # the digest covers all the files in sequence, so it can only be
+        # reused as a whole, if no file was added, removed or changed
+        stamp_hasher = sha_hash()
+        last_modified = 0
+        for fname in fnames:
+            st = os.stat(os.path.join(base_dir, fname))
+            last_modified = max(last_modified, st.st_mtime)
+            stamp_hasher.update('%s\0%s\0' % (fname, file_stamp(None, st)))
+        stamp = stamp_hasher.hexdigest()
+        digest = cache.get('sha1-dir', base_dir, stamp)
+        if digest is not None:
+            return digest
+
         # hash filenames and files to ensure directory structure
         # is accounted for
         for fname in fnames:
             # print fname
             sha_hasher.update(fname)
             hash_file(os.path.join(base_dir, fname), sha_hasher)
+        digest = sha_hasher.hexdigest()
+        if time.time() - last_modified > RECENT_MODIFICATION_DELAY:
+            cache.put('sha1-dir', base_dir, stamp, digest)
+            cache.commit()
+        return digest
     else:
-        hash_file(persistent_path, sha_hasher)
-    return sha_hasher.hexdigest()
+        digest = cache.hash_file('sha1', persistent_path, file_hash)
+        cache.commit()
+        return digest
 
 if __name__ == '__main__':
     import sys
@@ -56,13 +56,17 @@ def find_files(filename, version=None):
     vistrail = save_bundle.vistrail
     # FIXME hack for now, should change in the future
     log_fname = vistrail.db_log_filename
-    log = vistrails.db.services.io.open_log_from_xml(log_fname, True)
 
     if version:
         if isinstance(version, basestring):
             # need to lookup version number
             if version in vistrail.db_tags_name_index:
                 version = vistrail.db_tags_name_index[version].db_id
+    if version is not None:
+        workflow_execs = vistrails.db.services.io.iter_log_from_xml(
+            log_fname, [version])
+    else:
+        workflow_execs = vistrails.db.services.io.iter_log_from_xml(log_fname)
 
     persistent_module_ids = set()
     for action in vistrail.db_actions:
@@ -75,7 +79,7 @@ def find_files(filename, version=None):
                 
     filenames = {}
     tags = {}
-    for workflow_exec in log.db_workflow_execs:
+    for workflow_exec in workflow_execs:
         cur_version = workflow_exec.db_parent_version
         if version is not None and cur_version != version:
             continue
@@ -70,7 +70,6 @@ def find_workflows(path_name, vistrail_dir):
             vistrails.db.services.io.open_vistrail_bundle_from_zip_xml(filename)
         vistrail = save_bundle.vistrail
         log_fname = vistrail.db_log_filename
-        log = vistrails.db.services.io.open_log_from_xml(log_fname, True)
         
         persistent_module_ids = set()
         for action in vistrail.db_actions:
@@ -83,7 +82,8 @@ def find_workflows(path_name, vistrail_dir):
 
         execs = {}
         tags = {}
-        for workflow_exec in log.db_workflow_execs:
+        for workflow_exec in \
+                vistrails.db.services.io.iter_log_from_xml(log_fname):
             cur_version = workflow_exec.db_parent_version
             if cur_version in vistrail.db_tags_id_index:
                 tags[cur_version] = \
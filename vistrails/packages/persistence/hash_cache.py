@@ -0,0 +1,264 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+
+
+"""Cache of the content hashes of persistent files and directories.
+
+Hashing a file means reading every byte of it. The cache below remembers
+the digest computed for each path together with a stamp made of the
+file's inode, size and modification time, so that the content is only
+read again when one of those changed. Digests are stored in a SQLite
+database so that they survive across sessions.
+
+Files modified in the last few seconds are hashed but not cached, since
+a later change might not be visible in their modification time.
+
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import unittest
+
+# number of threads used to hash the files of a directory
+DEFAULT_MAX_WORKERS = 4
+# files modified more recently than this (in seconds) are not cached
+RECENT_MODIFICATION_DELAY = 2.0
+
+def file_stamp(path, st=None):
+    """file_stamp(path: str, st: stat_result) -> str
+    Returns a string that changes whenever the inode, size or
+    modification time of the file changes.
+
+    """
+    if st is None:
+        st = os.stat(path)
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1000000000)
+    return '%d:%d:%d' % (st.st_ino, st.st_size, mtime_ns)
+
+class HashCache(object):
+    """Maps (kind, path) to the digest last computed for that path and
+    the stamp the path had then. The kind distinguishes the different
+    hashing schemes (plain SHA-1, git blobs, ...).
+
+    """
+    def __init__(self, db_file=None, max_workers=DEFAULT_MAX_WORKERS):
+        self.db_file = db_file
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        # (kind, path) -> (stamp, digest)
+        self._entries = {}
+        self.conn = None
+        if db_file is not None:
+            self.conn = sqlite3.connect(db_file, check_same_thread=False)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS content_hash ("
+                              "kind TEXT NOT NULL, path TEXT NOT NULL, "
+                              "stamp TEXT NOT NULL, digest TEXT NOT NULL, "
+                              "PRIMARY KEY (kind, path));")
+            self.conn.commit()
+
+    def get(self, kind, path, stamp):
+        """get(kind: str, path: str, stamp: str) -> str
+        Returns the cached digest if path still has the given stamp,
+        None otherwise.
+
+        """
+        key = (kind, os.path.abspath(path))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self.conn is not None:
+                entry = self.conn.execute(
+                    "SELECT stamp, digest FROM content_hash "
+                    "WHERE kind=? AND path=?;", key).fetchone()
+                if entry is not None:
+                    entry = tuple(entry)
+                    self._entries[key] = entry
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        return None
+
+    def put(self, kind, path, stamp, digest):
+        key = (kind, os.path.abspath(path))
+        with self._lock:
+            self._entries[key] = (stamp, digest)
+            if self.conn is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO content_hash "
+                    "(kind, path, stamp, digest) VALUES (?, ?, ?, ?);",
+                    key + (stamp, digest))
+
+    def commit(self):
+        if self.conn is not None:
+            with self._lock:
+                self.conn.commit()
+
+    def close(self):
+        if self.conn is not None:
+            self.commit()
+            self.conn.close()
+            self.conn = None
+
+    def hash_file(self, kind, path, compute):
+        """hash_file(kind: str, path: str, compute: callable) -> str
+        Returns compute(path), reusing the cached digest if the file is
+        unchanged. Does not commit.
+
+        """
+        st = os.stat(path)
+        stamp = file_stamp(path, st)
+        digest = self.get(kind, path, stamp)
+        if digest is None:
+            digest = compute(path)
+            if time.time() - st.st_mtime > RECENT_MODIFICATION_DELAY:
+                self.put(kind, path, stamp, digest)
+        return digest
+
+    def hash_files(self, kind, paths, compute):
+        """hash_files(kind: str, paths: list, compute: callable) -> list
+        Returns the digests of all paths, computing the ones that are
+        not cached on a pool of max_workers threads.
+
+        """
+        if self.max_workers > 1 and len(paths) > 1:
+            pool = ThreadPool(min(self.max_workers, len(paths)))
+            try:
+                digests = pool.map(lambda p: self.hash_file(kind, p, compute),
+                                   paths)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            digests = [self.hash_file(kind, p, compute) for p in paths]
+        self.commit()
+        return digests
+
+_hash_cache = None
+
+def get_hash_cache():
+    """get_hash_cache() -> HashCache
+    Returns the cache set by the package, or an in-memory one if it was
+    not initialized.
+
+    """
+    global _hash_cache
+    if _hash_cache is None:
+        _hash_cache = HashCache()
+    return _hash_cache
+
+def set_hash_cache(cache):
+    global _hash_cache
+    _hash_cache = cache
+
+################################################################################
+
+class TestHashCache(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp(prefix='vt_hash_cache')
+        self.fname = os.path.join(self.directory, 'data')
+        with open(self.fname, 'wb') as f:
+            f.write('some data')
+        # make the file old enough to be cached
+        old = time.time() - 60
+        os.utime(self.fname, (old, old))
+        self.calls = []
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def compute(self, path):
+        self.calls.append(path)
+        with open(path, 'rb') as f:
+            return f.read().upper()
+
+    def test_cached(self):
+        cache = HashCache()
+        self.assertEqual(cache.hash_file('t', self.fname, self.compute),
+                         'SOME DATA')
+        self.assertEqual(cache.hash_file('t', self.fname, self.compute),
+                         'SOME DATA')
+        self.assertEqual(len(self.calls), 1)
+        # other kinds are separate
+        cache.hash_file('u', self.fname, self.compute)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_modified(self):
+        cache = HashCache()
+        cache.hash_file('t', self.fname, self.compute)
+        with open(self.fname, 'wb') as f:
+            f.write('other data')
+        old = time.time() - 30
+        os.utime(self.fname, (old, old))
+        self.assertEqual(cache.hash_file('t', self.fname, self.compute),
+                         'OTHER DATA')
+        self.assertEqual(len(self.calls), 2)
+
+    def test_recent_not_cached(self):
+        cache = HashCache()
+        os.utime(self.fname, None)
+        cache.hash_file('t', self.fname, self.compute)
+        cache.hash_file('t', self.fname, self.compute)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_persistent(self):
+        db_file = os.path.join(self.directory, 'hashes.db')
+        cache = HashCache(db_file)
+        cache.hash_files('t', [self.fname], self.compute)
+        cache.close()
+        cache = HashCache(db_file)
+        self.assertEqual(cache.hash_file('t', self.fname, self.compute),
+                         'SOME DATA')
+        self.assertEqual(len(self.calls), 1)
+        cache.close()
+
+    def test_parallel(self):
+        fnames = []
+        for i in xrange(10):
+            fname = os.path.join(self.directory, 'f%d' % i)
+            with open(fname, 'wb') as f:
+                f.write('file %d' % i)
+            fnames.append(fname)
+        cache = HashCache(max_workers=4)
+        self.assertEqual(cache.hash_files('t', fnames, self.compute),
+                         ['FILE %d' % i for i in xrange(10)])
+
+if __name__ == '__main__':
+    unittest.main()
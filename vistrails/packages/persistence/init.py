@@ -56,7 +56,8 @@ from widgets import PersistentRefInlineWidget, \
     PersistentInputFileConfiguration, PersistentOutputFileConfiguration, \
     PersistentInputDirConfiguration, PersistentOutputDirConfiguration, \
     PersistentRefModel, PersistentConfiguration
-from db_utils import DatabaseAccessSingleton
+from db_utils import DatabaseAccess, DatabaseAccessSingleton
+from hash_cache import HashCache, get_hash_cache, set_hash_cache
 import repo
 
 try:
@@ -587,6 +588,12 @@ def initialize():
     local_repo = repo.get_repo(local_db)
     repo.set_current_repo(local_repo)
 
+    hash_threads = 4
+    if configuration.check('hash_threads'):
+        hash_threads = configuration.hash_threads
+    set_hash_cache(HashCache(os.path.join(local_db, '.hashes.db'),
+                             hash_threads))
+
     debug_print('creating DatabaseAccess')
     db_path = os.path.join(local_db, '.files.db')
     db_access = DatabaseAccessSingleton(db_path)
@@ -604,6 +611,25 @@ def initialize():
             else:
                 print '*** persistence warning: cannot find path "%s"' % path
 
+# SQLite connections inherited from the parent process, see
+# forkedProcessHook()
+_parent_connections = []
+
+def forkedProcessHook():
+    """Reopens the databases in a process forked from this one.
+
+    SQLite connections can't be used from both processes; the inherited
+    ones are kept referenced but unused, so they are never closed here.
+    """
+    global db_access
+    cache = get_hash_cache()
+    _parent_connections.append(cache)
+    set_hash_cache(HashCache(cache.db_file, cache.max_workers))
+    if db_access is not None:
+        _parent_connections.append(db_access)
+        DatabaseAccess._instance = None
+        db_access = DatabaseAccessSingleton(db_access.db_file)
+
 _configuration_widget = None
 
 def finalize():
@@ -616,6 +642,7 @@ def finalize():
         elif os.path.isdir(fname):
             shutil.rmtree(fname)
     db_access.finalize()
+    get_hash_cache().close()
     if _configuration_widget is not None:
         _configuration_widget.deleteLater()
 
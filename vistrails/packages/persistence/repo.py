@@ -40,6 +40,7 @@ py_import('dulwich', {
         'linux-ubuntu': 'python-dulwich',
         'linux-fedora': 'python-dulwich'})
 from vistrails.core import debug
+from hash_cache import get_hash_cache
 
 from dulwich.errors import NotCommitError, NotGitRepository
 from dulwich.repo import Repo
@@ -162,26 +163,51 @@ class GitRepo(object):
         return None
 
     @staticmethod
-    def compute_tree_hash(dirname):
+    def compute_tree_hash(dirname, cache=None):
+        if cache is None:
+            cache = get_hash_cache()
+        # list the whole tree first so that the blobs can be hashed
+        # concurrently, then build the trees from the blob hashes
+        fnames = []
+        dir_stack = [dirname]
+        while dir_stack:
+            dname = dir_stack.pop()
+            for entry in os.listdir(dname):
+                fname = os.path.join(dname, entry)
+                if os.path.isdir(fname):
+                    dir_stack.append(fname)
+                elif os.path.isfile(fname):
+                    fnames.append(fname)
+        blob_hashes = dict(zip(fnames, cache.hash_files(
+                    'git-blob', fnames, GitRepo.compute_blob_hash)))
+        return GitRepo._build_tree(dirname, blob_hashes)
+
+    @staticmethod
+    def _build_tree(dirname, blob_hashes):
         tree = Tree()
         for entry in sorted(os.listdir(dirname)):
             fname = os.path.join(dirname, entry)
             if os.path.isdir(fname):
-                thash = GitRepo.compute_tree_hash(fname)
+                thash = GitRepo._build_tree(fname, blob_hashes)
                 mode = stat.S_IFDIR # os.stat(fname)[stat.ST_MODE]
                 tree.add(entry, mode, thash)
-            elif os.path.isfile(fname):
-                bhash = GitRepo.compute_blob_hash(fname)
+            elif fname in blob_hashes:
+                bhash = blob_hashes[fname]
                 mode = os.stat(fname)[stat.ST_MODE]
                 tree.add(entry, mode, bhash)
         return tree.id
 
     @staticmethod
-    def compute_hash(path):
+    def compute_hash(path, cache=None):
+        if cache is None:
+            cache = get_hash_cache()
         if os.path.isdir(path):
-            return GitRepo.compute_tree_hash(path)
+            return GitRepo.compute_tree_hash(path, cache)
         elif os.path.isfile(path):
-            return GitRepo.compute_blob_hash(path)
+            digest = cache.hash_file('git-blob', path,
+                                     GitRepo.compute_blob_hash)
+            cache.commit()
+            return digest
         raise TypeError("Do not support this type of path")
 
     def get_latest_version(self, path):
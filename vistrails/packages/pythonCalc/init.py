@@ -33,6 +33,8 @@
 ##
 ###############################################################################
 
+from itertools import izip, repeat
+
 from vistrails.core.modules.vistrails_module import Module, ModuleError
 from vistrails.core.modules.config import IPort, OPort
 
@@ -98,8 +100,25 @@ class PythonCalc(Module):
         # clear in further examples that use these more complicated data.
         self.set_output("value", self.op(v1, v2))
 
-    def op(self, v1, v2):
-        op = self.get_input("op")
+    # When lists are connected to the input ports, VisTrails computes the
+    # module once for each element. Modules can instead implement
+    # compute_batch(self, columns), which receives all the elements at
+    # once: columns maps each port a list is connected to to the list of
+    # the values for every iteration. Each output port is then set to the
+    # list of the results.
+    def compute_batch(self, columns):
+        def column(name):
+            if name in columns:
+                return columns[name]
+            return repeat(self.get_input(name))
+        self.set_output("value", [self.op(v1, v2, op)
+                                  for v1, v2, op in izip(column("value1"),
+                                                         column("value2"),
+                                                         column("op"))])
+
+    def op(self, v1, v2, op=None):
+        if op is None:
+            op = self.get_input("op")
         if op == '+':
             return v1 + v2
         elif op == '-':
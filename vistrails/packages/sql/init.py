@@ -36,6 +36,7 @@
 from sqlalchemy.engine import create_engine
 from sqlalchemy.engine.url import URL
 from sqlalchemy.exc import SQLAlchemyError
+import threading
 import urllib
 
 from vistrails.core.db.action import create_action
@@ -50,6 +51,48 @@ from vistrails.core.utils import versions_increasing
 from vistrails.packages.tabledata.common import TableObject
 
 
+_engines = {}
+_engines_lock = threading.Lock()
+# engines inherited from the parent process, see forkedProcessHook()
+_parent_engines = []
+
+
+def get_engine(url):
+    """Gets the engine for a database URL, creating it on first use.
+
+    Engines are shared by the whole process, so that the connections in
+    their pool are reused from one execution to the next.
+    """
+    key = str(url)
+    with _engines_lock:
+        try:
+            return _engines[key]
+        except KeyError:
+            engine = _engines[key] = create_engine(url)
+            return engine
+
+
+def dispose_engines():
+    """Closes the pooled connections of every engine.
+    """
+    with _engines_lock:
+        for engine in _engines.itervalues():
+            engine.dispose()
+        _engines.clear()
+
+
+def iter_batches(results, batch_size):
+    """Fetches the rows of a result set as tables of batch_size rows.
+    """
+    keys = results.keys()
+    while True:
+        rows = results.fetchmany(batch_size)
+        if not rows:
+            break
+        yield TableObject([list(column) for column in zip(*rows)],
+                          len(rows), keys)
+
+
 class DBConnection(Module):
     """Connects to a database.
 
@@ -77,7 +120,7 @@ class DBConnection(Module):
                   database=self.get_input('db_name'))
 
         try:
-            engine = create_engine(url)
+            engine = get_engine(url)
         except ImportError, e:
             driver = url.drivername
             installed = False
@@ -119,7 +162,7 @@ class DBConnection(Module):
                 raise ModuleError(self,
                                   "Failed to install required driver")
             try:
-                engine = create_engine(url)
+                engine = get_engine(url)
             except Exception, e:
                 raise ModuleError(self,
                                   "Couldn't connect to the database: %s" %
@@ -136,13 +179,29 @@ class DBConnection(Module):
 
 
 class SQLSource(Module):
+    """Runs a query on a database.
+
+    The results are fetched in one go and returned as a table. If
+    streamResults is set, they are instead sent as a stream of tables of
+    batchSize rows on the 'batches' port, fetched from the database as
+    they are consumed; 'result' and 'resultSet' are not set then.
+    """
     _settings = ModuleSettings(configure_widget=
             'vistrails.packages.sql.widgets:SQLSourceConfigurationWidget')
     _input_ports = [('connection', '(DBConnection)'),
                     ('cacheResults', '(basic:Boolean)'),
+                    ('streamResults', '(basic:Boolean)',
+                     {'optional': True, 'defaults': "['False']"}),
+                    ('batchSize', '(basic:Integer)',
+                     {'optional': True, 'defaults': "['10000']"}),
                     ('source', '(basic:String)')]
     _output_ports = [('result', '(org.vistrails.vistrails.tabledata:Table)'),
-                     ('resultSet', '(basic:List)')]
+                     ('resultSet', '(basic:List)'),
+                     ('batches', '(org.vistrails.vistrails.tabledata:Table)',
+                      {'depth': 1, 'optional': True})]
+
+    _options = ('source', 'connection', 'cacheResults', 'streamResults',
+                'batchSize')
 
     def is_cacheable(self):
         return False
@@ -151,15 +210,24 @@ class SQLSource(Module):
         cached = False
         if self.has_input('cacheResults'):
             cached = self.get_input('cacheResults')
-            self.is_cacheable = lambda: cached
+        # a stream of batches can only be consumed once
+        if self.get_input('streamResults'):
+            cached = False
+        self.is_cacheable = lambda: cached
         connection = self.get_input('connection')
         inputs = dict((k, self.get_input(k)) for k in self.inputPorts.iterkeys()
-                  if k not in ('source', 'connection', 'cacheResults'))
+                  if k not in self._options)
         s = urllib.unquote(str(self.get_input('source')))
 
         try:
             transaction = connection.begin()
             results = connection.execute(s, inputs)
+            if (self.get_input('streamResults') and
+                    getattr(results, 'returns_rows', True)):
+                self.set_streaming_output(
+                        'batches',
+                        self.stream_batches(transaction, results))
+                return
             try:
                 rows = results.fetchall()
             except Exception:
@@ -176,10 +244,45 @@ class SQLSource(Module):
         except SQLAlchemyError, e:
             raise ModuleError(self, debug.format_exception(e))
 
+    def stream_batches(self, transaction, results):
+        batch_size = max(1, self.get_input('batchSize'))
+        committed = False
+        try:
+            for table in iter_batches(results, batch_size):
+                yield table
+            transaction.commit()
+            committed = True
+        except SQLAlchemyError, e:
+            raise ModuleError(self, debug.format_exception(e))
+        finally:
+            # also runs if the consumer stops early, releasing the pooled
+            # connection right away
+            try:
+                if not committed:
+                    transaction.rollback()
+            finally:
+                results.close()
+
 
 _modules = [DBConnection, SQLSource]
 
 
+def finalize():
+    dispose_engines()
+
+
+def forkedProcessHook():
+    """Stops using the engines in a process forked from this one.
+
+    Their pooled connections belong to the parent process: disposing of
+    them here would close the parent's sessions, so the engines are kept
+    referenced but unused, and new ones get created on demand.
+    """
+    with _engines_lock:
+        _parent_engines.extend(_engines.itervalues())
+        _engines.clear()
+
+
 def handle_module_upgrade_request(controller, module_id, pipeline):
     # Before 0.0.3, SQLSource's resultSet output was type ListOfElements (which
     #   doesn't exist anymore)
@@ -330,3 +433,183 @@ class TestSQL(unittest.TestCase):
                 os.remove(test_db)
             except OSError:
                 pass # Oops, we are leaking the file here...
+
+    def test_engine_pool(self):
+        """Checks that engines are shared between DBConnection modules.
+        """
+        url = URL(drivername='sqlite', database=':memory:')
+        engine = get_engine(url)
+        self.assertIs(get_engine(URL(drivername='sqlite',
+                                     database=':memory:')),
+                      engine)
+        self.assertIsNot(get_engine(URL(drivername='sqlite',
+                                        database='other.db')),
+                         engine)
+
+    def test_forked_process_hook(self):
+        """Checks that forked processes create their own engines.
+        """
+        url = URL(drivername='sqlite', database=':memory:')
+        engine = get_engine(url)
+        forkedProcessHook()
+        self.assertIn(engine, _parent_engines)
+        self.assertIsNot(get_engine(url), engine)
+
+    def test_stream_sqlite3(self):
+        """Streams the results of a query in batches.
+        """
+        import os
+        import sqlite3
+        import tempfile
+        import urllib2
+        from vistrails.tests.utils import execute, intercept_results
+        identifier = 'org.vistrails.vistrails.sql'
+
+        test_db_fd, test_db = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(test_db_fd)
+        try:
+            conn = sqlite3.connect(test_db)
+            cur = conn.cursor()
+            cur.execute('CREATE TABLE test(name VARCHAR(24), age INTEGER)')
+            cur.executemany('INSERT INTO test(name, age) VALUES(?, ?)',
+                            [('p%d' % i, i) for i in xrange(5)])
+            conn.commit()
+            conn.close()
+
+            source = "SELECT name, age FROM test ORDER BY age"
+
+            # The streamed module is computed once per batch, keeping the
+            # same instance, so intercept_results() would only see the end
+            from vistrails.packages.tabledata.common import ExtractColumn
+            columns = []
+            def set_output(module, port_name, value):
+                if port_name == 'value' and value is not None:
+                    columns.append(value)
+                Module.set_output(module, port_name, value)
+            ExtractColumn.set_output = set_output
+            try:
+                with intercept_results(DBConnection, 'connection') as (
+                        connection,):
+                    self.assertFalse(execute([
+                            ('DBConnection', identifier, [
+                                ('protocol', [('String', 'sqlite')]),
+                                ('db_name', [('String', test_db)]),
+                            ]),
+                            ('SQLSource', identifier, [
+                                ('source',
+                                 [('String', urllib2.quote(source))]),
+                                ('streamResults', [('Boolean', 'True')]),
+                                ('batchSize', [('Integer', '2')]),
+                            ]),
+                            ('ExtractColumn',
+                             'org.vistrails.vistrails.tabledata', [
+                                ('column_name', [('String', 'age')]),
+                            ]),
+                        ],
+                        [
+                            (0, 'connection', 1, 'connection'),
+                            (1, 'batches', 2, 'table'),
+                        ]))
+            finally:
+                del ExtractColumn.set_output
+
+            connection[0].close()
+            self.assertEqual(columns, [[0, 1], [2, 3], [4]])
+        finally:
+            try:
+                os.remove(test_db)
+            except OSError:
+                pass
+
+    def test_stream_closed_early(self):
+        """Stopping a stream early rolls back and closes the result set.
+        """
+        engine = get_engine(URL(drivername='sqlite', database=':memory:'))
+        connection = engine.connect()
+        try:
+            connection.execute('CREATE TABLE test(age INTEGER)')
+            for i in xrange(5):
+                connection.execute('INSERT INTO test(age) VALUES(?)', i)
+            transaction = connection.begin()
+            results = connection.execute('SELECT age FROM test')
+            module = SQLSource()
+            module.get_input = lambda name: 2
+            batches = module.stream_batches(transaction, results)
+            self.assertEqual(next(batches).get_column(0), [0, 1])
+            batches.close()
+            self.assertFalse(transaction.is_active)
+            self.assertTrue(results.closed)
+        finally:
+            connection.close()
+
+    def test_stream_not_cached(self):
+        """Streamed results are queried again even if cacheResults is set.
+        """
+        import os
+        import sqlite3
+        import tempfile
+        import urllib2
+        from vistrails.core.interpreter.cached import CachedInterpreter
+        from vistrails.core.utils import DummyView
+        from vistrails.packages.tabledata.common import ExtractColumn
+        from vistrails.tests.utils import build_pipeline, intercept_results
+        identifier = 'org.vistrails.vistrails.sql'
+
+        test_db_fd, test_db = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(test_db_fd)
+        interpreter = CachedInterpreter()
+        try:
+            conn = sqlite3.connect(test_db)
+            cur = conn.cursor()
+            cur.execute('CREATE TABLE test(name VARCHAR(24), age INTEGER)')
+            cur.executemany('INSERT INTO test(name, age) VALUES(?, ?)',
+                            [('p%d' % i, i) for i in xrange(3)])
+            conn.commit()
+            conn.close()
+
+            source = "SELECT name, age FROM test ORDER BY age"
+            pipeline = build_pipeline([
+                    ('DBConnection', identifier, [
+                        ('protocol', [('String', 'sqlite')]),
+                        ('db_name', [('String', test_db)]),
+                    ]),
+                    ('SQLSource', identifier, [
+                        ('source', [('String', urllib2.quote(source))]),
+                        ('cacheResults', [('Boolean', 'True')]),
+                        ('streamResults', [('Boolean', 'True')]),
+                        ('batchSize', [('Integer', '2')]),
+                    ]),
+                    ('ExtractColumn', 'org.vistrails.vistrails.tabledata', [
+                        ('column_name', [('String', 'age')]),
+                    ]),
+                ],
+                [
+                    (0, 'connection', 1, 'connection'),
+                    (1, 'batches', 2, 'table'),
+                ])
+
+            columns = []
+            def set_output(module, port_name, value):
+                if port_name == 'value' and value is not None:
+                    columns.append(value)
+                Module.set_output(module, port_name, value)
+            ExtractColumn.set_output = set_output
+            try:
+                with intercept_results(DBConnection, 'connection') as (
+                        connection,):
+                    for i in xrange(2):
+                        result = interpreter.execute(pipeline,
+                                                     view=DummyView())
+                        self.assertFalse(result.errors)
+            finally:
+                del ExtractColumn.set_output
+
+            for c in connection:
+                c.close()
+            self.assertEqual(columns, [[0, 1], [2], [0, 1], [2]])
+        finally:
+            interpreter.clear()
+            try:
+                os.remove(test_db)
+            except OSError:
+                pass
@@ -7,6 +7,8 @@ extraction and conversion routines.
 """
 
 # ChangeLog:
+# 2026-10-18 -- 0.1.6
+#   * Adds single-pass reading and binary cache to CSVFile
 # 2014-05-29 -- 0.1.5
 #   * Updates JSON readers
 # 2014-02-03 -- 0.1.4
@@ -84,6 +84,147 @@ class TableObject(object):
         return cls(columns, count, keys)
 
 
+class ColumnarTable(TableObject):
+    """A table storing its columns as NumPy arrays.
+
+    Each column is kept as an object array of the original values. The first
+    time it is used as numbers, it is also converted to a float64 array,
+    along with a mask of the values that could be converted. Columns are only
+    built when they are first needed, from sequences or from the columns of
+    other tables (see from_table(), project() and take()), so wrapping a
+    table is cheap.
+
+    This requires numpy.
+    """
+    def __init__(self, columns, nb_rows, names):
+        TableObject.__init__(self, columns, nb_rows, names)
+        self._values = {}
+        self._numeric = {}
+
+    @classmethod
+    def from_table(cls, table):
+        """Wraps any TableObject, reading its columns when they are needed.
+        """
+        if isinstance(table, ColumnarTable):
+            return table
+        result = cls([_SourceColumn(table, i) for i in xrange(table.columns)],
+                     table.rows, table.names)
+        result.name = table.name
+        return result
+
+    def values(self, i):
+        """Gets a column as an object array of the original values.
+        """
+        try:
+            return self._values[i]
+        except KeyError:
+            pass
+        source = self._columns[i]
+        if isinstance(source, _SourceColumn):
+            values = source.values()
+        else:
+            values = _object_array(source)
+        self._values[i] = values
+        return values
+
+    def numeric(self, i):
+        """Gets a column as float64 values, and the mask of the valid ones.
+
+        Values that are not numbers are NaN, and False in the mask.
+        """
+        try:
+            return self._numeric[i]
+        except KeyError:
+            pass
+        source = self._columns[i]
+        if isinstance(source, _SourceColumn) and source.has_numeric():
+            result = source.numeric()
+        else:
+            result = _to_numeric(self.values(i))
+        self._numeric[i] = result
+        return result
+
+    def get_column(self, i, numeric=False):
+        if numeric:
+            return self.numeric(i)[0].astype(numpy.float32)
+        source = self._columns[i]
+        if isinstance(source, list):
+            return source
+        return self.values(i).tolist()
+
+    def project(self, indexes, names):
+        """Makes a table from some of the columns of this one.
+        """
+        return ColumnarTable([_SourceColumn(self, i) for i in indexes],
+                             self.rows, names)
+
+    def take(self, rows):
+        """Makes a table from some of the rows of this one.
+
+        rows is an array of row indexes.
+        """
+        return ColumnarTable([_SourceColumn(self, i, rows)
+                              for i in xrange(self.columns)],
+                             len(rows), self.names)
+
+
+class _SourceColumn(object):
+    """A column of ColumnarTable taken from another table.
+    """
+    def __init__(self, table, index, rows=None):
+        self.table = table
+        self.index = index
+        self.rows = rows
+
+    def values(self):
+        if isinstance(self.table, ColumnarTable):
+            values = self.table.values(self.index)
+        else:
+            values = _object_array(self.table.get_column(self.index))
+        if self.rows is not None:
+            values = values[self.rows]
+        return values
+
+    def has_numeric(self):
+        return isinstance(self.table, ColumnarTable)
+
+    def numeric(self):
+        data, mask = self.table.numeric(self.index)
+        if self.rows is not None:
+            return data[self.rows], mask[self.rows]
+        return data, mask
+
+
+def _object_array(values):
+    if isinstance(values, numpy.ndarray) and values.dtype == object:
+        return values
+    array = numpy.empty(len(values), dtype=object)
+    try:
+        array[:] = values
+    except (ValueError, TypeError):
+        # values are sequences themselves, numpy would try to broadcast them
+        for i, value in enumerate(values):
+            array[i] = value
+    return array
+
+
+def _to_numeric(values):
+    try:
+        return (values.astype(numpy.float64),
+                numpy.ones(len(values), dtype=bool))
+    except (ValueError, TypeError):
+        pass
+    data = numpy.empty(len(values), dtype=numpy.float64)
+    mask = numpy.ones(len(values), dtype=bool)
+    for i, value in enumerate(values):
+        try:
+            data[i] = float(value)
+        except (ValueError, TypeError):
+            data[i] = numpy.nan
+            mask[i] = False
+    return data, mask
+
+
 class Table(Module):
     _input_ports = [('name', '(org.vistrails.vistrails.basic:String)')]
     _output_ports = [('value', 'Table')]
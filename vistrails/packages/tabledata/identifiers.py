@@ -1,3 +1,3 @@
 identifier = 'org.vistrails.vistrails.tabledata'
 name = 'tabledata'
-version = '0.1.5'
+version = '0.1.6'
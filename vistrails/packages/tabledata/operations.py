@@ -2,11 +2,13 @@ try:
     import numpy
 except ImportError: # pragma: no cover
     numpy = None
+import operator
 import re
 
 from vistrails.core.modules.vistrails_module import ModuleError
 
-from .common import TableObject, Table, choose_column, choose_columns
+from .common import TableObject, ColumnarTable, Table, choose_column, \
+    choose_columns
 
 # FIXME use pandas?
 
@@ -31,9 +33,15 @@ class JoinedTables(TableObject):
         self.always_prefix = always_prefix
 
         self.build_column_names()
-        self.compute_row_map()
         self.column_cache = {}
-        self.rows = len(self.row_map)
+        if numpy is not None:
+            self.left_t = ColumnarTable.from_table(left_t)
+            self.right_t = ColumnarTable.from_table(right_t)
+            self.compute_rows()
+            self.rows = len(self.left_rows)
+        else:
+            self.compute_row_map()
+            self.rows = len(self.row_map)
 
     def build_column_names(self):
         left_name = self.left_t.name
@@ -67,6 +75,19 @@ class JoinedTables(TableObject):
         if (index, numeric) in self.column_cache:
             return self.column_cache[(index, numeric)]
 
+        if numpy is not None:
+            if index < self.left_t.columns:
+                table, col, rows = self.left_t, index, self.left_rows
+            else:
+                table, col, rows = (self.right_t, index - self.left_t.columns,
+                                    self.right_rows)
+            if numeric:
+                result = table.get_column(col, True)[rows]
+            else:
+                result = table.values(col)[rows].tolist()
+            self.column_cache[(index, numeric)] = result
+            return result
+
         result = []
         if index < self.left_t.columns:
             column = self.left_t.get_column(index, numeric)
@@ -86,6 +107,37 @@ class JoinedTables(TableObject):
         self.column_cache[(index, numeric)] = result
         return result
 
+    def get_keys(self, table, key_col):
+        keys = numpy.array([utf8(val) for val in table.values(key_col)],
+                           dtype=bytes)
+        keys = numpy.char.strip(keys)
+        if not self.case_sensitive:
+            keys = numpy.char.upper(keys)
+        return keys
+
+    def compute_rows(self):
+        """Hash join on the key columns.
+
+        Sets left_rows and right_rows, the arrays of the indexes of the rows
+        that are put together.
+        """
+        codes = {}
+        right_codes = numpy.fromiter(
+                (codes.setdefault(key, len(codes))
+                 for key in self.get_keys(self.right_t, self.right_key_col)),
+                dtype=numpy.intp, count=self.right_t.rows)
+        # the last row with a given key is used, like compute_row_map() does
+        right_of = numpy.full(len(codes), -1, dtype=numpy.intp)
+        numpy.maximum.at(right_of, right_codes,
+                         numpy.arange(self.right_t.rows, dtype=numpy.intp))
+        left_codes = numpy.fromiter(
+                (codes.get(key, -1)
+                 for key in self.get_keys(self.left_t, self.left_key_col)),
+                dtype=numpy.intp, count=self.left_t.rows)
+        matched = left_codes >= 0
+        self.left_rows = numpy.flatnonzero(matched)
+        self.right_rows = right_of[left_codes[matched]]
+
     def compute_row_map(self):
         def build_key_dict(table, key_col):
             key_dict = {}
@@ -217,7 +269,11 @@ class ProjectTable(Table):
                     names[name] = 1
                 column_names.append(name)
 
-        projected_table = ProjectedTable(table, indexes, column_names)
+        if numpy is not None:
+            projected_table = ColumnarTable.from_table(table).project(
+                    indexes, column_names)
+        else:
+            projected_table = ProjectedTable(table, indexes, column_names)
         self.set_output("value", projected_table)
 
 
@@ -260,6 +316,34 @@ class SelectFromTable(Table):
         else:
             raise ValueError("Invalid comparison operator %r" % comparer)
 
+    @staticmethod
+    def select_rows(table, idx, comparand, comparer):
+        """Evaluates the condition on a whole column of a ColumnarTable.
+
+        Returns the array of the indexes of the matching rows.
+        """
+        if comparer == '=~':
+            regex = re.compile(comparand)
+            matched = numpy.fromiter(
+                    (regex.search(v) is not None for v in table.values(idx)),
+                    dtype=bool, count=table.rows)
+            return numpy.flatnonzero(matched)
+        try:
+            op = SelectFromTable.operators[comparer]
+        except KeyError:
+            raise ValueError("Invalid comparison operator %r" % comparer)
+        if isinstance(comparand, float):
+            values, valid = table.numeric(idx)
+            matched = valid & op(values, comparand)
+        else:
+            matched = numpy.asarray(op(table.values(idx), comparand),
+                                    dtype=bool)
+        return numpy.flatnonzero(matched)
+
+    operators = {'==': operator.eq, '!=': operator.ne,
+                 '<': operator.lt, '>': operator.gt,
+                 '<=': operator.le, '>=': operator.ge}
+
     def compute(self):
         table = self.get_input('table')
 
@@ -283,6 +367,15 @@ class SelectFromTable(Table):
                                   "No column %d, table only has %d columns" % (
                                   idx, table.columns))
 
+        if numpy is not None:
+            table = ColumnarTable.from_table(table)
+            try:
+                rows = self.select_rows(table, idx, comparand, comparer)
+            except ValueError, e:
+                raise ModuleError(self, e.message)
+            self.set_output('value', table.take(rows))
+            return
+
         condition = self.make_condition(comparand, comparer)
         numeric = isinstance(comparand, float)
         column = table.get_column(idx, numeric)
@@ -306,6 +399,25 @@ class AggregatedTable(TableObject):
         self.build_map()
 
     def build_map(self):
+        if numpy is not None:
+            self.table = ColumnarTable.from_table(self.table)
+            groups = {}
+            self.group_codes = numpy.fromiter(
+                    (groups.setdefault(val, len(groups))
+                     for val in self.table.values(self.group_col)),
+                    dtype=numpy.intp, count=self.table.rows)
+            # groups are numbered in order of appearance
+            self.group_rows = numpy.unique(self.group_codes,
+                                           return_index=True)[1]
+            self.rows = len(groups)
+        else:
+            self.build_agg_rows()
+        self.columns = 2
+        if self.table.names is not None:
+            self.names = [self.table.names[self.group_col],
+                          self.table.names[self.col]]
+
+    def build_agg_rows(self):
         agg_map = {}
         for i, val in enumerate(self.table.get_column(self.group_col)):
             if val in agg_map:
@@ -315,12 +427,45 @@ class AggregatedTable(TableObject):
         self.agg_rows = [(min(rows), rows) for rows in agg_map.itervalues()]
         self.agg_rows.sort()
         self.rows = len(self.agg_rows)
-        self.columns = 2
-        if self.table.names is not None:
-            self.names = [self.table.names[self.group_col],
-                          self.table.names[self.col]]
+
+    def aggregate(self):
+        """Computes the aggregated column with numpy.
+
+        Values that are not numbers are ignored, except by 'count'.
+        """
+        if self.op == 'count':
+            return numpy.bincount(self.group_codes, minlength=self.rows)
+        if self.op not in ('sum', 'average', 'min', 'max'):
+            raise ValueError('Unknown operation: "%s"' % self.op)
+        values, valid = self.table.numeric(self.col)
+        codes = self.group_codes[valid]
+        values = values[valid]
+        sums = numpy.bincount(codes, weights=values, minlength=self.rows)
+        if self.op == 'sum':
+            return sums
+        elif self.op == 'average':
+            counts = numpy.bincount(codes, minlength=self.rows)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                return sums / counts
+        # sort the values by group and reduce each run
+        order = numpy.argsort(codes, kind='mergesort')
+        codes = codes[order]
+        values = values[order]
+        starts = numpy.flatnonzero(numpy.r_[True, codes[1:] != codes[:-1]])
+        result = numpy.full(self.rows, numpy.nan)
+        if len(values):
+            reduce_op = numpy.minimum if self.op == 'min' else numpy.maximum
+            result[codes[starts]] = reduce_op.reduceat(values, starts)
+        return result
 
     def get_column(self, index, numeric=False):
+        if numpy is not None:
+            if index == 0:
+                col = self.table.get_column(self.group_col, numeric)
+                return [col[i] for i in self.group_rows]
+            else:
+                return self.aggregate().tolist()
+
         def average(value_iter):
             # value_iter can only be used once
             sum = 0
@@ -693,3 +838,52 @@ class TestAggregate(unittest.TestCase):
                                    ('group_by_index', [('Integer', '2')])])
         self.assertEqual(table.get_column(0, False), ['T', 'F'])
         self.assertEqual(table.get_column(1, True), [-7, 21])
+
+    def test_aggregate_invalid(self):
+        """Values that are not numbers are only counted.
+        """
+        if numpy is None: # pragma: no cover
+            self.skipTest("numpy is not available")
+        table = TableObject([['a', 'b', 'a', 'a'], ['1', 'x', '5', '']],
+                            4, ['key', 'value'])
+        self.assertEqual(AggregatedTable(table, 'count', 1, 0).get_column(1),
+                         [3, 1])
+        self.assertEqual(AggregatedTable(table, 'sum', 1, 0).get_column(1),
+                         [6, 0])
+        maximums = AggregatedTable(table, 'max', 1, 0).get_column(1)
+        self.assertEqual(maximums[0], 5)
+        self.assertTrue(numpy.isnan(maximums[1]))
+
+
+class TestColumnar(unittest.TestCase):
+    def setUp(self):
+        if numpy is None: # pragma: no cover
+            self.skipTest("numpy is not available")
+
+    def test_columns(self):
+        table = ColumnarTable.from_table(TableObject(
+                [[1, '2', 'three', (4, 4)], ['a', 'b', 'c', 'd']],
+                4, ['numbers', 'letters']))
+        self.assertEqual(table.get_column(0), [1, '2', 'three', (4, 4)])
+        values, valid = table.numeric(0)
+        self.assertEqual(list(valid), [True, True, False, False])
+        self.assertEqual(list(values[valid]), [1.0, 2.0])
+
+        selected = table.take(numpy.array([3, 1]))
+        self.assertEqual(selected.rows, 2)
+        self.assertEqual(selected.get_column(1), ['d', 'b'])
+        self.assertEqual(list(selected.numeric(0)[1]), [False, True])
+        projected = selected.project([1, 1], ['x', 'y'])
+        self.assertEqual(projected.names, ['x', 'y'])
+        self.assertEqual(projected.get_column(1), ['d', 'b'])
+
+    def test_join_duplicates(self):
+        left = TableObject([['a', 'B', 'c ']], 3, ['key'])
+        right = TableObject([['b', 'C', 'b'], [1, 2, 3]], 3, ['key', 'value'])
+        table = JoinedTables(left, right, 0, 0)
+        self.assertEqual(table.get_column(0), ['B', 'c '])
+        # the last row with the key is used
+        self.assertEqual(table.get_column(1), ['b', 'C'])
+        self.assertEqual(list(table.get_column(2, True)), [3, 2])
+        table = JoinedTables(left, right, 0, 0, case_sensitive=True)
+        self.assertEqual(table.rows, 0)
@@ -1,12 +1,27 @@
 import csv
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import tempfile
 try:
     import numpy
 except ImportError: # pragma: no cover
     numpy = None
 
+from vistrails.core.system import current_dot_vistrails
+
 from ..common import TableObject, Table, InternalModuleError
 
 
+# number of rows parsed at a time by read_columns()
+CHUNK_ROWS = 65536
+
+# total size of the parsed files kept by read_columns(), in bytes
+CACHE_MAX_SIZE = 1024 * 1024 * 1024
+
+
 def count_lines(fp):
     lines = 0
     for line in fp:
@@ -17,8 +32,14 @@ def count_lines(fp):
 # FIXME : test coverage for CSVTable
 class CSVTable(TableObject):
     def __init__(self, csv_file, header_present, delimiter,
-                 skip_lines=0, dialect=None, use_sniffer=True):
+                 skip_lines=0, dialect=None, use_sniffer=True,
+                 single_pass=False, cache_dir=None):
         self._rows = None
+        # parse all the columns at once (needs numpy)
+        self.single_pass = numpy is not None and (single_pass or
+                                                  cache_dir is not None)
+        self.cache_dir = cache_dir
+        self._parsed = None
 
         self.header_present = header_present
         self.delimiter = delimiter
@@ -91,7 +112,17 @@ class CSVTable(TableObject):
         if (index, numeric) in self.column_cache:
             return self.column_cache[(index, numeric)]
 
-        if numeric and numpy is not None:
+        if self.single_pass:
+            parsed = self.parse()
+            if numeric:
+                if parsed.numeric[index] is not None:
+                    result = parsed.numeric[index].astype(numpy.float32)
+                else:
+                    # raises ValueError, like loadtxt()
+                    result = parsed.strings[index].astype(numpy.float32)
+            else:
+                result = parsed.strings[index].tolist()
+        elif numeric and numpy is not None:
             result = numpy.loadtxt(
                     self.filename,
                     dtype=numpy.float32,
@@ -100,17 +131,7 @@ class CSVTable(TableObject):
                     usecols=[index])
         else:
             with open(self.filename, 'rb') as fp:
-                for i in xrange(self.skip_lines):
-                    line = fp.readline()
-                    if not line:
-                        raise InternalModuleError("skip_lines greater than "
-                                                  "the number of lines in the "
-                                                  "file")
-                if self.dialect is not None:
-                    reader = csv.reader(fp, dialect=self.dialect)
-                else:
-                    reader = csv.reader(fp, delimiter=self.delimiter)
-
+                reader = self.make_reader(fp)
                 result = [row[index] for row in reader]
             if numeric:
                 result = [float(e) for e in result]
@@ -118,16 +139,263 @@ class CSVTable(TableObject):
         self.column_cache[(index, numeric)] = result
         return result
 
+    def make_reader(self, fp):
+        for i in xrange(self.skip_lines):
+            line = fp.readline()
+            if not line:
+                raise InternalModuleError("skip_lines greater than "
+                                          "the number of lines in the "
+                                          "file")
+        if self.dialect is not None:
+            return csv.reader(fp, dialect=self.dialect)
+        else:
+            return csv.reader(fp, delimiter=self.delimiter)
+
+    def parse(self):
+        """Parses the whole file once, see read_columns().
+        """
+        if self._parsed is None:
+            self._parsed = read_columns(self, self.cache_dir)
+        return self._parsed
+
     @property
     def rows(self):
         if self._rows is not None:
             return self._rows
+        if self.single_pass:
+            self._rows = self.parse().rows
+            return self._rows
         with open(self.filename, 'rb') as fp:
             self._rows = count_lines(fp)
         self._rows -= self.skip_lines
         return self._rows
 
 
+class CSVColumns(object):
+    """All the columns of a CSV file.
+
+    strings holds the columns as arrays of byte strings. numeric holds an
+    int64 or float64 array for the columns whose values are all numbers, and
+    None for the others.
+    """
+    def __init__(self, rows, strings, numeric):
+        self.rows = rows
+        self.strings = strings
+        self.numeric = numeric
+
+
+def cache_key(table):
+    """Identifies the parsed form of a CSV file, by file size and mtime.
+
+    The key starts with a hash of the file's path, followed by '-', so that
+    the entries of older versions of the file can be found.
+    """
+    filename = os.path.abspath(table.filename)
+    st = os.stat(filename)
+    dialect = table.dialect
+    if dialect is not None and not isinstance(dialect, basestring):
+        dialect = tuple(getattr(dialect, attr, None)
+                        for attr in ('delimiter', 'doublequote',
+                                     'escapechar', 'lineterminator',
+                                     'quotechar', 'quoting',
+                                     'skipinitialspace'))
+    return '%s-%s' % (
+            hashlib.sha1(filename).hexdigest()[:16],
+            hashlib.sha1(repr((filename, st.st_size, st.st_mtime,
+                               table.skip_lines, table.delimiter, dialect,
+                               table.columns))).hexdigest())
+
+
+def read_columns(table, cache_dir=None):
+    """Parses all the columns of a CSVTable in a single pass.
+
+    The file is read CHUNK_ROWS rows at a time. Each chunk is converted to
+    byte string arrays and written to a temporary file right away, so
+    memory use is bounded by the size of a chunk while reading. Once the
+    file has been read, the width and type of each column are known, and
+    the columns are filled from the temporary file one chunk at a time.
+
+    If cache_dir is set, the columns are written there as .npy files and
+    memory-mapped, and later calls for the same file reuse them as long as
+    its size and mtime don't change. Entries for older versions of a file
+    are removed, and the least recently used ones are evicted when the
+    cache grows over CACHE_MAX_SIZE.
+    """
+    if cache_dir is not None:
+        key = cache_key(table)
+        path = os.path.join(cache_dir, key)
+        if os.path.isfile(os.path.join(path, 'columns.json')):
+            try:
+                result = _open_cached(path)
+            except (IOError, ValueError, KeyError): # pragma: no cover
+                pass
+            else:
+                os.utime(path, None)
+                return result
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        directory = tempfile.mkdtemp(prefix=key + '.', dir=cache_dir)
+        spill_fd, spill_name = tempfile.mkstemp(dir=directory)
+    else:
+        directory = None
+        spill_fd, spill_name = tempfile.mkstemp(prefix='vt_csv')
+
+    try:
+        nb_columns = table.columns
+        widths = [1] * nb_columns
+        # types each column can still be converted to
+        types = [[numpy.int64, numpy.float64] for i in xrange(nb_columns)]
+        # offsets of the chunks of each column in the spill file
+        offsets = [[] for i in xrange(nb_columns)]
+        rows = 0
+        with os.fdopen(spill_fd, 'w+b') as spill:
+            with open(table.filename, 'rb') as fp:
+                reader = table.make_reader(fp)
+                while True:
+                    chunk = list(itertools.islice(reader, CHUNK_ROWS))
+                    if not chunk:
+                        break
+                    # pad short rows, ignore blank lines
+                    chunk = [row + [''] * (nb_columns - len(row))
+                             for row in chunk if row]
+                    if not chunk:
+                        continue
+                    for i, column in enumerate(itertools.izip(*chunk)):
+                        array = numpy.array(column, dtype=bytes)
+                        widths[i] = max(widths[i], array.itemsize)
+                        while types[i]:
+                            try:
+                                array.astype(types[i][0])
+                            except (ValueError, OverflowError):
+                                types[i].pop(0)
+                            else:
+                                break
+                        offsets[i].append(spill.tell())
+                        numpy.save(spill, array)
+                    rows += len(chunk)
+                    chunk = None
+
+            strings = []
+            numeric = []
+            for i in xrange(nb_columns):
+                column_strings = _create_column(directory,
+                                                'strings%d.npy' % i,
+                                                'S%d' % widths[i], rows)
+                if rows > 0 and types[i]:
+                    column_numeric = _create_column(directory,
+                                                    'numeric%d.npy' % i,
+                                                    types[i][0], rows)
+                else:
+                    column_numeric = None
+                pos = 0
+                for offset in offsets[i]:
+                    spill.seek(offset)
+                    array = numpy.load(spill)
+                    column_strings[pos:pos + len(array)] = array
+                    if column_numeric is not None:
+                        column_numeric[pos:pos + len(array)] = \
+                            array.astype(types[i][0])
+                    pos += len(array)
+                strings.append(_finish_column(directory, 'strings%d.npy' % i,
+                                              column_strings))
+                if column_numeric is not None:
+                    column_numeric = _finish_column(directory,
+                                                    'numeric%d.npy' % i,
+                                                    column_numeric)
+                numeric.append(column_numeric)
+        os.remove(spill_name)
+        spill_name = None
+
+        if directory is not None:
+            with open(os.path.join(directory, 'columns.json'), 'wb') as fp:
+                json.dump({'rows': rows,
+                           'columns': nb_columns,
+                           'numeric': [n is not None for n in numeric]}, fp)
+            strings = numeric = None
+            try:
+                os.rename(directory, path)
+            except OSError: # pragma: no cover
+                # written concurrently
+                shutil.rmtree(directory)
+            else:
+                directory = None
+            _clean_cache(cache_dir, key)
+            return _open_cached(path)
+        return CSVColumns(rows, strings, numeric)
+    finally:
+        if spill_name is not None:
+            os.remove(spill_name)
+        if directory is not None:
+            shutil.rmtree(directory)
+
+
+def _create_column(directory, name, dtype, rows):
+    if directory is not None and rows > 0:
+        return numpy.lib.format.open_memmap(os.path.join(directory, name),
+                                            mode='w+', dtype=dtype,
+                                            shape=(rows,))
+    else:
+        return numpy.empty((rows,), dtype=dtype)
+
+
+def _finish_column(directory, name, column):
+    if directory is not None:
+        if len(column) > 0:
+            column.flush()
+        else:
+            numpy.save(os.path.join(directory, name), column)
+    return column
+
+
+def _directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, dirs, files in os.walk(path)
+               for name in files)
+
+
+def _clean_cache(cache_dir, key):
+    """Removes the entries for older versions of the file of the given key,
+    then the least recently used entries while the cache is over
+    CACHE_MAX_SIZE. The entry for key itself is kept.
+    """
+    prefix = key.split('-', 1)[0] + '-'
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        # entries being written contain a '.'
+        if name == key or '.' in name or not os.path.isdir(path):
+            continue
+        if name.startswith(prefix):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            entries.append((os.path.getmtime(path), path))
+    total = (_directory_size(os.path.join(cache_dir, key)) +
+             sum(_directory_size(path) for mtime, path in entries))
+    entries.sort(reverse=True)
+    while total > CACHE_MAX_SIZE and entries:
+        mtime, path = entries.pop()
+        total -= _directory_size(path)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _open_cached(path):
+    with open(os.path.join(path, 'columns.json'), 'rb') as fp:
+        meta = json.load(fp)
+    mmap_mode = 'r' if meta['rows'] > 0 else None
+    strings = []
+    numeric = []
+    for i in xrange(meta['columns']):
+        strings.append(numpy.load(os.path.join(path, 'strings%d.npy' % i),
+                                  mmap_mode=mmap_mode))
+        if meta['numeric'][i]:
+            numeric.append(numpy.load(os.path.join(path,
+                                                   'numeric%d.npy' % i),
+                                      mmap_mode=mmap_mode))
+        else:
+            numeric.append(None)
+    return CSVColumns(meta['rows'], strings, numeric)
+
+
 class CSVFile(Table):
     """Reads a table from a CSV file.
 
@@ -135,6 +403,11 @@ class CSVFile(Table):
     able to guess the actual format of the file in most cases, or you can use
     the 'delimiter', 'header_present' and 'skip_lines' ports to force how the
     file will be read.
+
+    By default, the file is read again for each column that is used. Set
+    'single_pass' to parse all the columns at once instead, and
+    'binary_cache' to also keep the parsed columns on disk for the next
+    time the same file is read.
     """
     _input_ports = [
             ('file', '(org.vistrails.vistrails.basic:File)'),
@@ -147,7 +420,11 @@ class CSVFile(Table):
             ('skip_lines', '(org.vistrails.vistrails.basic:Integer)',
              {'optional': True, 'defaults': "['0']"}),
             ('dialect', '(org.vistrails.vistrails.basic:String)',
-             {'optional': True})]
+             {'optional': True}),
+            ('single_pass', '(org.vistrails.vistrails.basic:Boolean)',
+             {'optional': True, 'defaults': "['False']"}),
+            ('binary_cache', '(org.vistrails.vistrails.basic:Boolean)',
+             {'optional': True, 'defaults': "['False']"})]
     _output_ports = [
             ('column_count', '(org.vistrails.vistrails.basic:Integer)'),
             ('column_names', '(org.vistrails.vistrails.basic:List)'),
@@ -160,10 +437,16 @@ class CSVFile(Table):
         skip_lines = self.get_input('skip_lines')
         dialect = self.force_get_input('dialect', None)
         sniff_header = self.get_input('sniff_header')
+        single_pass = self.get_input('single_pass')
+        if self.get_input('binary_cache'):
+            cache_dir = os.path.join(current_dot_vistrails(),
+                                     'tabledata_cache')
+        else:
+            cache_dir = None
 
         try:
             table = CSVTable(csv_file, header_present, delimiter, skip_lines,
-                             dialect, sniff_header)
+                             dialect, sniff_header, single_pass, cache_dir)
         except InternalModuleError, e:
             e.raise_module_error(self)
 
@@ -277,6 +560,143 @@ class CSVTestCase(unittest.TestCase):
         self.assertEqual(results[0],
                          ['col moutarde', '4', 'not a number', '7'])
 
+    def test_single_pass(self):
+        """Reads all the columns at once, with and without binary cache.
+        """
+        if numpy is None: # pragma: no cover
+            self.skipTest("numpy is not available")
+        import shutil
+        import tempfile
+        cache_dir = tempfile.mkdtemp(prefix='vt_csv_')
+        filename = self._test_dir + '/test.csv'
+        try:
+            for i in xrange(3):
+                table = CSVTable(filename, True, ';', single_pass=True,
+                                 cache_dir=None if i == 0 else cache_dir)
+                self.assertEqual(table.rows, 3)
+                self.assertEqual(table.names,
+                                 ['col 1', 'col 2', 'col moutarde'])
+                self.assertEqual(table.get_column(0), ['-1', '2', '6'])
+                self.assertEqual(table.get_column(2),
+                                 ['4', 'not a number', '7'])
+                parsed = table.parse()
+                self.assertEqual(parsed.numeric[0].dtype, numpy.int64)
+                self.assertEqual(parsed.numeric[1].dtype, numpy.float64)
+                self.assertIsNone(parsed.numeric[2])
+                self.assertEqual(list(table.get_column(1, True)),
+                                 [2.0, 3.0, 14.5])
+                with self.assertRaises(ValueError):
+                    table.get_column(2, True)
+                if i > 0:
+                    self.assertIsInstance(parsed.strings[0], numpy.memmap)
+                    self.assertEqual(len(os.listdir(cache_dir)), 1)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_single_pass_chunks(self):
+        """Reads a file spanning several chunks.
+        """
+        if numpy is None: # pragma: no cover
+            self.skipTest("numpy is not available")
+        import shutil
+        import tempfile
+        global CHUNK_ROWS
+        old_chunk_rows = CHUNK_ROWS
+        CHUNK_ROWS = 2
+        cache_dir = tempfile.mkdtemp(prefix='vt_csv_')
+        filename = self._test_dir + '/test.csv'
+        try:
+            for cache in (None, cache_dir):
+                table = CSVTable(filename, True, ';', single_pass=True,
+                                 cache_dir=cache)
+                parsed = table.parse()
+                self.assertEqual(parsed.rows, 3)
+                self.assertEqual(parsed.strings[2].dtype, numpy.dtype('S12'))
+                self.assertEqual(list(parsed.strings[2]),
+                                 ['4', 'not a number', '7'])
+                self.assertEqual(list(parsed.numeric[0]), [-1, 2, 6])
+                self.assertEqual(list(parsed.numeric[1]), [2.0, 3.0, 14.5])
+                self.assertIsNone(parsed.numeric[2])
+                self.assertEqual([n for n in os.listdir(cache_dir)
+                                  if '.' in n], [])
+        finally:
+            CHUNK_ROWS = old_chunk_rows
+            shutil.rmtree(cache_dir)
+
+    def test_single_pass_overflow(self):
+        """Integers that don't fit in int64 are read as floats.
+        """
+        if numpy is None: # pragma: no cover
+            self.skipTest("numpy is not available")
+        import shutil
+        import tempfile
+        directory = tempfile.mkdtemp(prefix='vt_csv_')
+        try:
+            filename = os.path.join(directory, 'big.csv')
+            with open(filename, 'wb') as fp:
+                fp.write('id;name\n12345678901234567890123;a\n1;b\n')
+            table = CSVTable(filename, True, ';', single_pass=True)
+            self.assertEqual(table.get_column(0),
+                             ['12345678901234567890123', '1'])
+            parsed = table.parse()
+            self.assertEqual(parsed.numeric[0].dtype, numpy.float64)
+            self.assertEqual(list(table.get_column(0, True)),
+                             [numpy.float32(12345678901234567890123.0),
+                              1.0])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_cache_eviction(self):
+        """Older versions of a file and least recently used entries are
+        removed from the cache.
+        """
+        if numpy is None: # pragma: no cover
+            self.skipTest("numpy is not available")
+        import shutil
+        import tempfile
+        global CACHE_MAX_SIZE
+        old_max_size = CACHE_MAX_SIZE
+        cache_dir = tempfile.mkdtemp(prefix='vt_csv_')
+        try:
+            files = []
+            for i in xrange(2):
+                filename = os.path.join(cache_dir, 'file%d.csv' % i)
+                with open(filename, 'wb') as fp:
+                    fp.write('a;b\n1;2\n')
+                files.append(filename)
+
+            def parse(filename):
+                table = CSVTable(filename, True, ';', single_pass=True,
+                                 cache_dir=os.path.join(cache_dir, 'cache'))
+                table.parse()
+                return cache_key(table)
+
+            key0 = parse(files[0])
+            key1 = parse(files[1])
+            self.assertEqual(sorted(os.listdir(os.path.join(cache_dir,
+                                                            'cache'))),
+                             sorted([key0, key1]))
+
+            # New version of file0 replaces the old entry
+            with open(files[0], 'ab') as fp:
+                fp.write('3;4\n')
+            key0 = parse(files[0])
+            self.assertEqual(sorted(os.listdir(os.path.join(cache_dir,
+                                                            'cache'))),
+                             sorted([key0, key1]))
+
+            # Over the size limit, only the newest entry is kept
+            CACHE_MAX_SIZE = 1
+            os.utime(os.path.join(cache_dir, 'cache', key0), (0, 0))
+            with open(files[1], 'ab') as fp:
+                fp.write('5;6\n')
+            key1 = parse(files[1])
+            self.assertEqual(os.listdir(os.path.join(cache_dir, 'cache')),
+                             [key1])
+        finally:
+            CACHE_MAX_SIZE = old_max_size
+            shutil.rmtree(cache_dir)
+
 
 class TestCountlines(unittest.TestCase):
     def test_countlines(self):
@@ -0,0 +1,481 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+
+"""Synthetic workloads and timings for the performance regression suite
+
+make_vistrail() generates a vistrail whose version tree and pipeline have a
+configurable size. run_benchmarks() times the hot paths of VisTrails on it:
+pipeline materialization, version switching, terse graph computation,
+signatures, execution, file I/O and log parsing. The results can be saved
+with save_results() and checked against a previous run with
+compare_results(); runbenchmarks.py is the command-line front-end.
+
+"""
+
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+import unittest
+
+
+DEFAULT_PARAMETERS = {
+    'actions': 500,
+    'modules': 50,
+    'width': 5,
+    'fan_in': 2,
+    'list_depth': 0,
+    'list_size': 3,
+    'branching': 0.3,
+    'tag_every': 25,
+    'samples': 10,
+    'executions': 20,
+    'repeat': 5,
+    'seed': 0,
+}
+
+GENERATOR_PARAMETERS = ['actions', 'modules', 'width', 'fan_in',
+                        'list_depth', 'list_size', 'branching', 'tag_every',
+                        'seed']
+
+RESULTS_FORMAT = 1
+
+basic_pkg = 'org.vistrails.vistrails.basic'
+pythoncalc_pkg = 'org.vistrails.vistrails.pythoncalc'
+
+
+def require_package(identifier):
+    """Enables the package with the given identifier if it is not enabled.
+    """
+    from vistrails.core.modules.module_registry import MissingPackage
+    from vistrails.core.packagemanager import get_package_manager
+
+    pm = get_package_manager()
+    try:
+        pm.get_package(identifier)
+    except MissingPackage:
+        dep_graph = pm.build_dependency_graph([identifier])
+        for pkg_id in pm.get_ordered_dependencies(dep_graph):
+            pkg = pm.identifier_is_available(pkg_id)
+            if pkg is None:
+                raise
+            pm.late_enable_package(pkg.codepath)
+
+
+def make_vistrail(actions=500, modules=50, width=5, fan_in=2, list_depth=0,
+                  list_size=3, branching=0.3, tag_every=25, seed=0):
+    """make_vistrail(...) -> Vistrail
+
+    Builds a vistrail whose pipeline is a layered graph of 'modules'
+    PythonCalc modules, 'width' per layer. Each module of a layer reads
+    from 'fan_in' (1 or 2) modules of the previous layer, so each module
+    also feeds 'fan_in' modules downstream. If list_depth is positive,
+    the first layer iterates over nested lists of 'list_size' elements.
+
+    Every module is added by its own action; the version where the
+    pipeline is complete is tagged 'pipeline'. The version tree is then
+    grown to 'actions' versions by changing the 'op' of random modules,
+    starting a new branch from a random version with probability
+    'branching'. Every 'tag_every'-th version is tagged.
+    """
+    import vistrails.core.db.action
+    from vistrails.core.vistrail.controller import VistrailController
+    from vistrails.core.vistrail.module_control_param import \
+        ModuleControlParam
+    from vistrails.core.vistrail.module_param import ModuleParam
+    from vistrails.core.vistrail.vistrail import Vistrail
+
+    if fan_in not in (1, 2):
+        raise ValueError("fan_in should be 1 or 2")
+    if width < 1 or modules < 1:
+        raise ValueError("width and modules should be positive")
+
+    vistrail = Vistrail()
+    id_scope = vistrail.idScope
+    rng = random.Random(seed)
+    create_module = VistrailController.create_module_static
+    create_function = VistrailController.create_function_static
+    create_connection = VistrailController.create_connection_static
+    current = [0L]
+    op_params = {} # module id -> (function id, ModuleParam)
+
+    def add_action(ops, parent):
+        action = vistrails.core.db.action.create_action(ops)
+        vistrail.add_action(action, parent)
+        current[0] = action.id
+        n = len(vistrail.actionMap) - 1
+        if tag_every and n % tag_every == 0:
+            vistrail.set_tag(action.id, 'version %d' % n)
+        return action.id
+
+    def add_module(name, identifier, functions, inputs):
+        module = create_module(id_scope, identifier, name,
+                               x=float(len(op_params)), y=0.0)
+        if list_depth > 0 and len(inputs) > 1:
+            # iterate on both lists together, not on their product
+            module.add_control_parameter(ModuleControlParam(
+                    id=id_scope.getNewId(ModuleControlParam.vtType),
+                    name=ModuleControlParam.LOOP_KEY,
+                    value='pairwise'))
+        for port, values in functions:
+            function = create_function(id_scope, module, port, values)
+            module.add_function(function)
+            if port == 'op':
+                op_params[module.id] = (function.real_id,
+                                        function.params[0])
+        ops = [('add', module)]
+        for source, source_port, port in inputs:
+            ops.append(('add', create_connection(id_scope,
+                                                 source, source_port,
+                                                 module, port)))
+        add_action(ops, current[0])
+        return module
+
+    values = repr([float(i) for i in xrange(list_size)])
+    source = None
+    for depth in xrange(list_depth):
+        if source is None:
+            source = add_module('List', basic_pkg, [('value', [values])], [])
+        else:
+            calc = add_module('PythonCalc', pythoncalc_pkg,
+                              [('value2', ['1.0']), ('op', ['+'])],
+                              [(source, 'value', 'value1')])
+            source = add_module('List', basic_pkg, [('value', [values])],
+                                [(calc, 'value', 'head')])
+
+    layer = []
+    for j in xrange(min(width, modules)):
+        functions = [('value2', ['1.0']), ('op', ['+'])]
+        if source is None:
+            functions.append(('value1', [str(float(j))]))
+            inputs = []
+        else:
+            inputs = [(source, 'value', 'value1')]
+        layer.append(add_module('PythonCalc', pythoncalc_pkg,
+                                functions, inputs))
+    count = len(layer)
+    while count < modules:
+        previous, layer = layer, []
+        for j in xrange(min(width, modules - count)):
+            functions = [('op', ['+' if j % 2 else '-'])]
+            inputs = [(previous[j], 'value', 'value1')]
+            if fan_in == 2:
+                inputs.append((previous[(j + 1) % len(previous)],
+                               'value', 'value2'))
+            else:
+                functions.append(('value2', ['2.0']))
+            layer.append(add_module('PythonCalc', pythoncalc_pkg,
+                                    functions, inputs))
+        count += len(layer)
+    vistrail.set_tag(current[0], 'pipeline')
+
+    # Grow the version tree by changing the operation of the modules
+    states = {current[0]: op_params}
+    versions = [current[0]]
+    module_ids = sorted(op_params)
+    while len(vistrail.actionMap) - 1 < actions:
+        if rng.random() < branching:
+            parent = rng.choice(versions)
+        else:
+            parent = current[0]
+        state = dict(states[parent])
+        module_id = rng.choice(module_ids)
+        function_id, old_param = state[module_id]
+        new_param = ModuleParam(id=id_scope.getNewId(ModuleParam.vtType),
+                                pos=old_param.pos,
+                                name=old_param.name,
+                                alias=old_param.alias,
+                                val='-' if old_param.strValue == '+' else '+',
+                                type=old_param.typeStr)
+        state[module_id] = (function_id, new_param)
+        version = add_action([('change', old_param, new_param,
+                               'function', function_id)], parent)
+        states[version] = state
+        versions.append(version)
+    return vistrail
+
+
+def summarize(times):
+    """summarize(times: list of float) -> dict
+    """
+    times = sorted(times)
+    n = len(times)
+    if n % 2:
+        median = times[n // 2]
+    else:
+        median = (times[n // 2 - 1] + times[n // 2]) / 2.0
+    return {'repeat': n,
+            'min': times[0],
+            'median': median,
+            'mean': sum(times) / n,
+            'max': times[-1]}
+
+
+def measure(function, repeat, setup=None):
+    """measure(function: callable, repeat: int, setup: callable) -> dict
+
+    Calls function() repeat times and summarizes the durations. setup(), if
+    given, is called before each call and is not timed.
+    """
+    times = []
+    for i in xrange(repeat):
+        if setup is not None:
+            setup()
+        start = timeit.default_timer()
+        function()
+        times.append(timeit.default_timer() - start)
+    return summarize(times)
+
+
+def run_benchmarks(parameters=None, names=None, directory=None, out=None):
+    """run_benchmarks(parameters: dict, names: list, directory: str,
+                      out: file) -> dict
+
+    Runs the benchmarks on a generated vistrail and returns the results
+    document. parameters overrides DEFAULT_PARAMETERS; names restricts the
+    benchmarks that are run; directory is where files are written (a
+    temporary directory by default). Progress is printed to out.
+    """
+    from vistrails.core.db.locator import XMLFileLocator, ZIPFileLocator
+    from vistrails.core.interpreter.cached import CachedInterpreter
+    from vistrails.core.log.controller import LogController
+    from vistrails.core.log.log import Log
+    from vistrails.core.utils import DummyView
+    from vistrails.core.vistrail.controller import VistrailController
+    from vistrails.db.domain import DBVistrail
+    from vistrails.db.services.io import SaveBundle, open_log_from_xml, \
+        iter_log_from_xml, save_log_to_xml
+
+    params = dict(DEFAULT_PARAMETERS)
+    if parameters:
+        unknown = set(parameters) - set(DEFAULT_PARAMETERS)
+        if unknown:
+            raise ValueError("Unknown parameters: %s" %
+                             ', '.join(sorted(unknown)))
+        params.update(parameters)
+    repeat = params['repeat']
+    rng = random.Random(params['seed'])
+
+    require_package(pythoncalc_pkg)
+
+    results = {}
+    def run(name, function, setup=None, times=repeat):
+        if names is not None and name not in names:
+            return
+        results[name] = measure(function, times, setup)
+        if out is not None:
+            out.write("%-24s median %.6fs  min %.6fs\n" % (
+                      name, results[name]['median'], results[name]['min']))
+
+    own_directory = directory is None
+    if own_directory:
+        directory = tempfile.mkdtemp(prefix='vt_benchmarks_')
+    try:
+        generate = dict((k, params[k]) for k in GENERATOR_PARAMETERS)
+        generated = []
+        run('make_vistrail',
+            lambda: generated.append(make_vistrail(**generate)), times=1)
+        if generated:
+            vistrail = generated[0]
+        else:
+            vistrail = make_vistrail(**generate)
+        pipeline_version = vistrail.get_version_number('pipeline')
+        versions = sorted(v for v in vistrail.actionMap if v > 0)
+        sample = [rng.choice(versions)
+                  for i in xrange(min(params['samples'], len(versions)))]
+
+        run('get_pipeline',
+            lambda: [vistrail.getPipeline(v) for v in sample])
+
+        controller = VistrailController(vistrail, None)
+        controller.change_selected_version(pipeline_version)
+        run('do_version_switch',
+            lambda: [controller.do_version_switch(v, do_validate=False)
+                     for v in sample],
+            setup=lambda: controller.do_version_switch(pipeline_version,
+                                                       do_validate=False))
+        run('recompute_terse_graph', controller.recompute_terse_graph)
+
+        pipeline = vistrail.getPipeline(pipeline_version)
+        run('signatures', pipeline.refresh_signatures)
+
+        interpreters = []
+        def execute():
+            result = interpreters[-1].execute(pipeline,
+                                              current_version=pipeline_version,
+                                              view=DummyView())
+            if result.errors:
+                raise RuntimeError("Execution failed: %r" % result.errors)
+        run('execute', execute,
+            setup=lambda: interpreters.append(CachedInterpreter()))
+        interpreters.append(CachedInterpreter())
+        execute()
+        run('execute_cached', execute)
+        for interpreter in interpreters:
+            interpreter.clear()
+        del interpreters[:]
+
+        log_filename = os.path.join(directory, 'log.xml')
+        if names is None or set(['open_log', 'stream_log']) & set(names):
+            log = Log()
+            interpreter = CachedInterpreter()
+            for i in xrange(params['executions']):
+                interpreter.execute(pipeline,
+                                    current_version=pipeline_version,
+                                    view=DummyView(),
+                                    logger=LogController(log))
+            interpreter.clear()
+            save_log_to_xml(log, log_filename, do_append=True)
+        run('open_log', lambda: open_log_from_xml(log_filename, True))
+        run('stream_log',
+            lambda: sum(1 for e in iter_log_from_xml(log_filename)))
+
+        xml_filename = os.path.join(directory, 'vistrail.xml')
+        run('save_xml', lambda: XMLFileLocator(xml_filename).save(vistrail))
+        run('open_xml', lambda: XMLFileLocator(xml_filename).load())
+        vt_filename = os.path.join(directory, 'vistrail.vt')
+        def save_vt():
+            ZIPFileLocator(vt_filename).save(
+                    SaveBundle(DBVistrail.vtType, vistrail), False)
+        def remove_vt():
+            if os.path.exists(vt_filename):
+                os.remove(vt_filename)
+        run('save_vt', save_vt, setup=remove_vt)
+        run('open_vt', lambda: ZIPFileLocator(vt_filename).load())
+    finally:
+        if own_directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    return {'format': RESULTS_FORMAT,
+            'date': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'machine': {'platform': platform.platform(),
+                        'python': sys.version.split()[0],
+                        'processor': platform.processor()},
+            'parameters': params,
+            'results': results}
+
+
+def save_results(results, filename):
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(filename):
+    with open(filename) as f:
+        results = json.load(f)
+    if results.get('format') != RESULTS_FORMAT:
+        raise ValueError("%s is not a benchmark results file" % filename)
+    return results
+
+
+def compare_results(baseline, current, threshold=0.2):
+    """compare_results(baseline: dict, current: dict, threshold: float)
+          -> list of (name, baseline median, current median, ratio,
+                      regressed)
+
+    Compares the median times of the benchmarks that both documents
+    contain. A benchmark regressed if it is more than 'threshold' (a
+    fraction) slower than in the baseline. Comparisons are only
+    meaningful if both runs used the same parameters.
+    """
+    comparison = []
+    for name in sorted(set(baseline['results']) & set(current['results'])):
+        before = baseline['results'][name]['median']
+        after = current['results'][name]['median']
+        if before > 0:
+            ratio = after / before
+        else:
+            ratio = 1.0 if after <= 0 else float('inf')
+        comparison.append((name, before, after, ratio,
+                           ratio > 1.0 + threshold))
+    return comparison
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_make_vistrail(self):
+        require_package(pythoncalc_pkg)
+        vistrail = make_vistrail(actions=40, modules=7, width=3, fan_in=2,
+                                 list_depth=2, list_size=2, tag_every=10)
+        self.assertEqual(len(vistrail.actionMap) - 1, 40)
+        pipeline = vistrail.getPipeline('pipeline')
+        calcs = [m for m in pipeline.modules.itervalues()
+                 if m.name == 'PythonCalc']
+        # 7 in the layers and 1 between the 2 lists
+        self.assertEqual(len(calcs), 8)
+        self.assertEqual(len(pipeline.modules), 10)
+        # 2 between the lists, 1 per module of the first layer and 2 per
+        # module of the other layers
+        self.assertEqual(len(pipeline.connections), 2 + 3 + 2 * 4)
+        self.assertTrue(vistrail.has_tag_str('version 10'))
+        # every other version only changes an 'op'
+        last = vistrail.getPipeline(max(vistrail.actionMap))
+        self.assertEqual(len(last.modules), 10)
+
+    def test_run(self):
+        results = run_benchmarks({'actions': 20, 'modules': 4, 'width': 2,
+                                  'executions': 2, 'repeat': 2,
+                                  'samples': 3})
+        self.assertEqual(set(results['results']),
+                         set(['make_vistrail', 'get_pipeline',
+                              'do_version_switch', 'recompute_terse_graph',
+                              'signatures', 'execute', 'execute_cached',
+                              'open_log', 'stream_log', 'save_xml',
+                              'open_xml', 'save_vt', 'open_vt']))
+        self.assertEqual(results['results']['execute']['repeat'], 2)
+
+        slower = json.loads(json.dumps(results))
+        slower['results']['execute']['median'] *= 2
+        slower['results']['execute']['median'] += 1.0
+        regressed = [c[0] for c in compare_results(results, slower)
+                     if c[4]]
+        self.assertEqual(regressed, ['execute'])
+
+        self.assertRaises(ValueError, run_benchmarks, {'bogus': 1})
+
+    def test_summarize(self):
+        s = summarize([3.0, 1.0, 2.0, 4.0])
+        self.assertEqual((s['min'], s['median'], s['max'], s['mean']),
+                         (1.0, 2.5, 4.0, 2.5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# pragma: no testimport
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+
+"""Runs the performance benchmarks of vistrails.tests.benchmarks on a
+generated vistrail and writes the timings to a JSON file.
+
+Use --compare to check the results against those of a previous run; the
+script then exits with status 1 if a benchmark got slower than the
+threshold allows.
+
+"""
+
+from optparse import OptionParser
+import os
+import shutil
+import sys
+import tempfile
+
+# Makes sure we can import modules as if we were running VisTrails
+# from the root directory
+_this_dir = os.path.dirname(os.path.realpath(__file__))
+root_directory = os.path.realpath(os.path.join(_this_dir,  '..'))
+sys.path.insert(0, os.path.realpath(os.path.join(root_directory, '..')))
+
+import vistrails.core.application
+from vistrails.tests.benchmarks import DEFAULT_PARAMETERS, run_benchmarks, \
+    save_results, load_results, compare_results
+
+usage = "Usage: %prog [options] [benchmark1 benchmark2 ...]"
+parser = OptionParser(usage=usage)
+parser.add_option("-o", "--output", action="store", type="str",
+                  default=None, dest="output",
+                  help="write the results to this JSON file")
+parser.add_option("-c", "--compare", action="store", type="str",
+                  default=None, dest="compare",
+                  help="compare the results with this previous JSON file "
+                  "(its parameters are reused unless overridden)")
+parser.add_option("-t", "--threshold", action="store", type="float",
+                  default=0.2, dest="threshold",
+                  help="slowdown allowed by --compare, as a fraction "
+                  "(default=0.2)")
+for name, default in sorted(DEFAULT_PARAMETERS.iteritems()):
+    parser.add_option("--%s" % name.replace('_', '-'), action="store",
+                      type="float" if isinstance(default, float) else "int",
+                      default=None, dest=name,
+                      help="default=%s" % default)
+
+(options, args) = parser.parse_args()
+# remove empty strings
+args = filter(len, args)
+
+baseline = None
+parameters = {}
+if options.compare:
+    baseline = load_results(options.compare)
+    parameters.update(baseline['parameters'])
+for name in DEFAULT_PARAMETERS:
+    if getattr(options, name) is not None:
+        parameters[name] = getattr(options, name)
+
+###############################################################################
+# reinitializing arguments and options so VisTrails does not try parsing them
+sys.argv = sys.argv[:1]
+
+dot_vistrails = tempfile.mkdtemp(prefix='vt_benchmarks_dot_')
+try:
+    vistrails.core.application.init({'dotVistrails': dot_vistrails,
+                                     'batch': True,
+                                     'executeWorkflows': False,
+                                     'nologger': True,
+                                     'singleInstance': False,
+                                     'enablePackagesSilently': True,
+                                     'handlerDontAsk': True})
+
+    results = run_benchmarks(parameters, args or None, out=sys.stdout)
+finally:
+    app = vistrails.core.application.get_vistrails_application()
+    if app is not None:
+        app.finishSession()
+    shutil.rmtree(dot_vistrails, ignore_errors=True)
+
+if options.output:
+    save_results(results, options.output)
+    print "Results written to %s" % options.output
+
+status = 0
+if baseline is not None:
+    print ""
+    print "%-24s %12s %12s %8s" % ("benchmark", "baseline", "current",
+                                   "ratio")
+    for name, before, after, ratio, regressed in compare_results(
+            baseline, results, options.threshold):
+        print "%-24s %11.6fs %11.6fs %7.2fx%s" % (
+                name, before, after, ratio, "  REGRESSED" if regressed else "")
+        if regressed:
+            status = 1
+sys.exit(status)